@@ -1,5 +1,7 @@
 # load each of the graphs 
-from graph_logic import load_data_from_json
+from library.cache_helper import load_graph, arrays_to_graph
+from library.community_helper import get_partition
+from library.layout_helper import get_layout
 import networkx as nx
 import json
 import community 
@@ -20,31 +22,29 @@ import plotly.express as px
 
 # Louvain community detection
 n = 13
-G = nx.node_link_graph(load_data_from_json(f'data/graph_{n}.json'))
+graph = load_graph(n)
+G = arrays_to_graph(*graph)
 
-# Convert the graph to igraph format
-G_ig = ig.Graph.from_networkx(G)
-
-# use leidenalg to find the communities and plot
-partition = leidenalg.find_partition(G_ig, leidenalg.ModularityVertexPartition)
+# cached leiden partition, see library/community_helper.py for resolution sweeps
+partition = get_partition(n, graph=graph)
 print(partition)
-print(partition.membership)
-print(partition.q)
+print(partition['membership'])
+print(partition['modularity'])
 
 
 
 # plot
 # remove edges
-pos = nx.spring_layout(G)
+xy = get_layout(n, graph, wait=True)
 # Convert nodes and edges to DataFrames
-nodes_df = pd.DataFrame(pos, columns=["x", "y"]).reset_index().rename(columns={"index": "node"})
-nodes_df["community"] = partition.membership
+nodes_df = pd.DataFrame({"node": graph[0], "x": xy[:, 0], "y": xy[:, 1]})
+nodes_df["community"] = partition['membership']
 
 edges_df = pd.DataFrame(G.edges, columns=["source", "target"])
 
 # Create custom discrete color scale
 color_scale = px.colors.qualitative.Plotly
-num_communities = len(set(partition.membership))
+num_communities = len(set(partition['membership']))
 color_list = color_scale * (num_communities // len(color_scale) + 1)
 color_discrete_map = {i: color_list[i] for i in range(num_communities)}
 
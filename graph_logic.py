@@ -1,20 +1,26 @@
-from PIL import Image
-import base64
 import numpy as np
-import networkx as nx
 import pandas as pd
 import json
 import sys, os
+import time
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from library.db_query_templates import get_all_sequence_data, get_all_shape_data
-from library.shape_helper import deserialize_shape
+from library.db_query_templates import get_all_sequence_data, get_all_shape_data, get_sequence_ids, get_sequences_by_ids, get_shapes_by_ids
+from library.cache_helper import cache_path, cache_exists, migrate_json, load_sequences, load_shapes, save_sequences, save_shapes, load_graph, save_graph, mark_stale
+from library.graph_helper import build_comapping_graph, node_degrees, comapping_delta, add_nodes, add_edges
+from library.layout_helper import get_layout
+from library.community_helper import get_partition
+from library.thumbnail_helper import prerender
 import plotly.express as px
-# save plot as pdf
-import plotly.io as pio
+import plotly.graph_objs as go
 # n value controls based on what is available in the database
 MIN_N = 8
 MAX_N = 14
 INITIAL_N = 10
+# WebGL rendering (create_gl_figure)
+GL_NODE_THRESHOLD = 2000  # the app switches to WebGL above this many nodes
+LOD_MAX_POINTS = 3000  # above this many nodes in view, nodes are merged into super-nodes
+LOD_GRID = 48  # super-node cells per axis of the view
+MAX_EDGES = 5000
 
 
 def save_data_to_json(data, file_path):
@@ -26,79 +32,111 @@ def load_data_from_json(file_path):
         data = json.load(f, )
     return data
 
-def create_network_graph(n):
-        # Housekeeping to avoid re-running the same queries
-    if os.path.exists(f'data/sequences_df_{n}.json') and os.path.exists(f'data/shapes_df_{n}.json'):
-        # read data from json as dict convert to dataframe
-        sequences_df = pd.read_json(f'data/sequences_df_{n}.json', orient='split', convert_dates=False)
-        shapes_df = pd.read_json(f'data/shapes_df_{n}.json', orient='split', convert_dates=False)
-    else:
-        sequences_df = get_all_sequence_data(n)
-        shapes_df = get_all_shape_data(n)
-        sequences_df.to_json(f'data/sequences_df_{n}.json', orient='split')
-        shapes_df.to_json(f'data/shapes_df_{n}.json', orient='split')
+
+# datasets loaded once per process by get_dataset, keyed by n
+_datasets = {}
+
+
+def load_cached_data(n):
+    """Sequences and shapes at n from the columnar cache, filling the cache from the old json files or the database first"""
+    # Housekeeping to avoid re-running the same queries
+    if not (cache_exists(n, "sequences") and cache_exists(n, "shapes")):
+        if os.path.exists(f'data/sequences_df_{n}.json') and os.path.exists(f'data/shapes_df_{n}.json'):
+            migrate_json(n)
+        else:
+            save_sequences(get_all_sequence_data(n), n)
+            save_shapes(get_all_shape_data(n), n)
+    sequences_df = load_sequences(n)
+    shapes_df = load_shapes(n)
 
 
     # Define the correct order of columns
     correct_column_order = ['sequence_id', 'sequence', 'degeneracy', 'length', 'energy', 'shape_mapping', 'path']
     sequences_df = sequences_df[correct_column_order]
+    return sequences_df, shapes_df
+
 
-    
+def load_cached_graph(n, sequences_df, shapes_df):
+    """Co-mapping graph at n from the cache, built and saved on the first call"""
     # Housekeeping to avoid re-computing the entire graph every time
-    graph_json_path = f'data/graph_{n}.json'
-    if os.path.exists(graph_json_path):
-        G = nx.node_link_graph(load_data_from_json(graph_json_path))
+    graph = load_graph(n)
+    if graph is None:
+        graph = build_comapping_graph(sequences_df, shapes_df)
+        save_graph(*graph, n)
+    return graph
+
+
+def dataset_version(n):
+    """Version key of the cached data at n, it changes whenever the sequences or shapes cache is rewritten"""
+    return "-".join(str(os.stat(cache_path(n, table)).st_mtime_ns) for table in ("sequences", "shapes"))
+
+
+def figure_version(n):
+    """Version key of everything the figures at n are drawn from (data, graph, layout and communities), so an export of
+    a figure can be looked up without building the figure"""
+    return "-".join(str(os.stat(path).st_mtime_ns) if os.path.exists(path) else "0"
+                    for path in (cache_path(n, table) for table in ("sequences", "shapes", "edges", "layout", "communities")))
+
+
+def get_dataset(n):
+    """Server side dataset at n, loaded once per process and shared read-only by every callback.
+    Reloaded when the cache files change (e.g. after update_network_graph in another worker).
+
+    :returns
+    :dict: n, version, shape_ids (node order of the graph figures), sequences_df, shapes_df and
+           index: shape_id -> (shape row as a dict, list of the sequences mapping to it)
+    """
+    dataset = _datasets.get(n)
+    if dataset is not None and dataset['version'] == dataset_version(n):
+        return dataset
+
+    sequences_df, shapes_df = load_cached_data(n)
+    nodes = load_cached_graph(n, sequences_df, shapes_df)[0]
+    shape_rows = {row['shape_id']: row for row in shapes_df.drop_duplicates('shape_id').to_dict('records')}
+    sequences = sequences_df['sequence'].astype(str).groupby(sequences_df['shape_mapping'].astype(str), sort=False).agg(list)
+    index = {shape_id: (shape_rows.get(shape_id, {'shape_id': shape_id}), sequences.get(shape_id, [])) for shape_id in nodes}
+
+    dataset = {
+        'n': n,
+        'version': dataset_version(n),
+        'shape_ids': list(nodes),
+        'sequences_df': sequences_df,
+        'shapes_df': shapes_df,
+        'index': index,
+    }
+    _datasets[n] = dataset
+    return dataset
+
+
+def hover_text(n, shape_id):
+    """Text shown next to the graph for a hovered shape: its Shapes row followed by the sequences mapping to it"""
+    shape_data, sequences = get_dataset(n)['index'][shape_id]
+    # convert to string with newline characters
+    sequences_str = '\n'.join(sequences)
+    hover_data_text = f'\n'.join([f'{col}: {val}' for col, val in shape_data.items()])
+    # add sequences to hover_data_text
+    hover_data_text += f'\nSequences:\n{sequences_str}'
+    return hover_data_text
 
-    else:
-        G = nx.Graph()
-
-        for shape_id in shapes_df['shape_id']:
-            if len(shape_id) >= 2:
-                G.add_node(shape_id)
-
-        for _, group in sequences_df.groupby('sequence'):
-            shape_mappings = group['shape_mapping'].tolist()
-            for i in range(len(shape_mappings)):
-                for j in range(i+1, len(shape_mappings)):
-                    if G.has_edge(shape_mappings[i], shape_mappings[j]):
-                        G[shape_mappings[i]][shape_mappings[j]]['weight'] += 1
-                    else:
-                        G.add_edge(shape_mappings[i], shape_mappings[j], weight=1)
-
-        nodes_to_remove = []
-        for node in G.nodes:
-            if len(node) < 2:
-                nodes_to_remove.append(node)
-        G.remove_nodes_from(nodes_to_remove)
-
-        save_data_to_json(nx.node_link_data(G), graph_json_path)
-
-
-    # spring layout makes higher weights closer together
-    pos = nx.spring_layout(G)
-    shape_ids = list(G.nodes)
-    xs = [pos[sid][0] for sid in shape_ids]
-    ys = [pos[sid][1] for sid in shape_ids]
+
+def create_network_graph(n):
+    sequences_df, shapes_df = load_cached_data(n)
+    graph = load_cached_graph(n, sequences_df, shapes_df)
+    nodes, source, target, weight = graph
+
+
+    # precomputed layout, higher weights are closer together
+    xy = get_layout(n, graph)
+    shape_ids = list(nodes)
+    xs = xy[:, 0].tolist()
+    ys = xy[:, 1].tolist()
     shape_ids = [shape_id for shape_id in shape_ids if len(shape_id) >= 2]
 
-    shape_matrices = {}
-    for shape_id in shape_ids:
-        try:
-            matrix = deserialize_shape(shape_id)
-            shape_matrices[shape_id] = matrix
-        except:
-            print("Error")
-            print(shape_id)
-
-    # Save the images and encode them as base64 strings
-    base64_images = {}
-    for shape_id, matrix in shape_matrices.items():
-        image_path = save_image(matrix, f'{shape_id}.png')
-        encoded_image = encode_image_base64(image_path)
-        base64_images[shape_id] = encoded_image
+    # thumbnails are rendered on demand by the /thumbnails route, nothing is written here
 
     # Define node_colors
-    node_colors = [G.degree(sid) for sid in shape_ids]
+    degrees = dict(zip(nodes, node_degrees(nodes, source, target).tolist()))
+    node_colors = [degrees[sid] for sid in shape_ids]
 
     fig = px.scatter(
         x=xs,
@@ -140,44 +178,236 @@ def create_network_graph(n):
         clickmode='event+select',
     )
     print(f'n: {n}, sequences_df shape: {sequences_df.shape}, unique shape_ids: {sequences_df["shape_mapping"].nunique()}')
-    pio.write_image(fig, f"graph_{n}.pdf")
-    return fig, shape_ids, shape_matrices, shapes_df, sequences_df
+    # exporting to pdf is left to library/export_helper.py, in the background
+    return fig, shape_ids, shapes_df, sequences_df
+
+
+
+def _in_range(xy, x_range, y_range):
+    visible = np.ones(len(xy), dtype=bool)
+    if x_range is not None:
+        visible &= (xy[:, 0] >= x_range[0]) & (xy[:, 0] <= x_range[1])
+    if y_range is not None:
+        visible &= (xy[:, 1] >= y_range[0]) & (xy[:, 1] <= y_range[1])
+    return visible
+
+
+def grid_super_nodes(xy, x_range, y_range, grid=LOD_GRID):
+    """Merges the nodes falling in the same cell of a grid x grid partition of the view into one super-node
+
+    :returns
+    :np.ndarray: cell: super-node index of every node
+    :np.ndarray: centers: (super-nodes, 2) mean position of their nodes
+    :np.ndarray: counts: number of nodes in each super-node
+    """
+    cx = np.clip(((xy[:, 0] - x_range[0]) / max(x_range[1] - x_range[0], 1e-9) * grid).astype(int), 0, grid - 1)
+    cy = np.clip(((xy[:, 1] - y_range[0]) / max(y_range[1] - y_range[0], 1e-9) * grid).astype(int), 0, grid - 1)
+    _, cell = np.unique(cy * grid + cx, return_inverse=True)
+    cell = cell.ravel()
+    counts = np.bincount(cell)
+    centers = np.stack([np.bincount(cell, xy[:, 0]), np.bincount(cell, xy[:, 1])], axis=1) / counts[:, None]
+    return cell, centers, counts
+
+
+def create_gl_figure(n, show_edges=False, x_range=None, y_range=None):
+    """WebGL version of the graph figure for large n. Coordinates and colours are sent as float32 / int32 arrays
+    (base64 typed arrays with plotly >= 6), and the shape id is only sent once per node, for the hover.
+    When more than LOD_MAX_POINTS nodes are in view, they are merged into grid cell super-nodes; zooming in
+    (x_range, y_range from the relayout callback) expands them again.
+
+    :params
+    :int: n: the length of the sequences
+    :bool: show_edges: if True, draws the MAX_EDGES heaviest edges as one batched line trace
+    :tuple: x_range, y_range: visible range, None for everything
+
+    :returns
+    :plotly.graph_objs.Figure: the figure
+    """
+    sequences_df, shapes_df = load_cached_data(n)
+    graph = load_cached_graph(n, sequences_df, shapes_df)
+    nodes, source, target, weight = graph
+    xy = get_layout(n, graph).astype(np.float32)
+    degrees = node_degrees(nodes, source, target).astype(np.int32)
+
+    visible = np.flatnonzero(_in_range(xy, x_range, y_range))
+    position = np.full(len(nodes), -1)  # index of each node's marker, -1 when not drawn
+    fig = go.Figure()
+    if len(visible) > LOD_MAX_POINTS:
+        view_x = x_range if x_range is not None else (xy[:, 0].min(), xy[:, 0].max())
+        view_y = y_range if y_range is not None else (xy[:, 1].min(), xy[:, 1].max())
+        cell, points, counts = grid_super_nodes(xy[visible], view_x, view_y)
+        points = points.astype(np.float32)
+        position[visible] = cell
+        marker_trace = go.Scattergl(
+            x=points[:, 0], y=points[:, 1], mode='markers',
+            marker=dict(color=(np.bincount(cell, degrees[visible]) / counts).astype(np.float32),
+                        size=(4 + 2 * np.log2(counts)).astype(np.float32)),
+            text=counts.astype(np.int32),
+            hovertemplate="%{text} shapes, zoom in to expand<extra></extra>",
+        )
+    else:
+        points = xy[visible]
+        position[visible] = np.arange(len(visible))
+        marker_trace = go.Scattergl(
+            x=points[:, 0], y=points[:, 1], mode='markers',
+            marker=dict(color=degrees[visible]),
+            customdata=[[nodes[i]] for i in visible],
+            hovertemplate="Shape ID: %{customdata[0]}<br>X: %{x}<br>Y: %{y}<extra></extra>",
+        )
+    marker_trace.marker.update(colorscale='plasma', cmid=0, showscale=True, colorbar=dict(title='Degree'))
+
+    if show_edges:
+        a, b = position[source], position[target]
+        keep = (a >= 0) & (b >= 0) & (a != b)
+        keys = np.minimum(a[keep], b[keep]).astype(np.int64) * len(points) + np.maximum(a[keep], b[keep])
+        keys, inverse = np.unique(keys, return_inverse=True)  # edges between super-nodes are summed
+        summed = np.bincount(inverse.ravel(), weights=weight[keep])
+        heaviest = np.argsort(summed, kind='stable')[::-1][:MAX_EDGES]
+        keys = keys[heaviest]
+        segments = np.full((len(keys), 3, 2), np.nan, dtype=np.float32)  # nan breaks the line between edges
+        segments[:, 0] = points[keys // len(points)]
+        segments[:, 1] = points[keys % len(points)]
+        fig.add_trace(go.Scattergl(
+            x=segments[:, :, 0].ravel(), y=segments[:, :, 1].ravel(), mode='lines',
+            line=dict(width=0.5, color='rgba(120, 120, 120, 0.3)'), hoverinfo='skip', showlegend=False,
+        ))
+    fig.add_trace(marker_trace)
+
+    fig.update_layout(
+        xaxis=dict(showticklabels=False, range=x_range),
+        yaxis=dict(showticklabels=False, range=y_range),
+        autosize=False,
+        width=900,
+        height=900,
+        title=f"Graph Visualization (n={n})",
+        hovermode='closest',
+        clickmode='event+select',
+        showlegend=False,
+        uirevision=f"gl-{n}",  # keeps the zoom when the figure is rebuilt for a new range
+    )
+    return fig
+
+
+def figure_report(ns):
+    """Prints the build time and payload size of the graph figures at every n (browser render time is not measured here)"""
+    for n in ns:
+        for name, build in (("px", lambda: create_network_graph(n)[0]), ("gl", lambda: create_gl_figure(n)),
+                            ("gl+edges", lambda: create_gl_figure(n, show_edges=True))):
+            start = time.time()
+            payload = build().to_json()
+            print(f"n={n} {name}: {len(payload) / 1024:.0f} KB in {time.time() - start:.2f}s")
+
+
+def create_new_figure(n_value):
+
+    graph = load_graph(n_value)
+    # precomputed layout, same positions as the graph view
+    xy = get_layout(n_value, graph)
+
+    new_fig = go.Figure()
+
+    # cached leiden partition (computed once per graph)
+    membership = get_partition(n_value, graph=graph)['membership']
+
+    node_data_df = pd.DataFrame({"node": graph[0], "x": xy[:, 0], "y": xy[:, 1], "membership": membership})
+    num_communities = len(set(membership))
+
+    new_fig = px.scatter(node_data_df, x="x", y="y", color="membership", color_continuous_scale='spectral', hover_name="node", custom_data=["node"])
+    new_fig.update_traces(showlegend=False)
+    new_fig.update_layout(
+        # set x
+        xaxis=dict(
+            # set to bottom
+            side="bottom",
+            showticklabels=False,
+        ),
+        # set y
+        yaxis=dict(
+       
+            showticklabels=False,
+        ),  
+        # remove all titles for x and y axes
+        xaxis_title=None,
+        yaxis_title=None,
+
+        title=f"Graph of n={n_value} with {num_communities} communities generated by Leiden algorithm",
+        title_x=0.5,  # Center the title
+    )
+    return new_fig
+
+
+FIGURE_VIEWS = ("graph", "communities")
+
+
+def build_figure(n, view="graph"):
+    """The figure of one of the app's views at n, as shown in the app"""
+    if view == "graph":
+        return create_network_graph(n)[0]
+    if view == "communities":
+        return create_new_figure(n)
+    raise ValueError(f"Unknown view {view}, expected one of {FIGURE_VIEWS}")
+
+
 
+def update_network_graph(n):
+    """Brings the cached data and graph at n up to date with the database, only fetching and applying the rows that were
+    added since the last update. The cached sequence ids act as the watermark: sequence_id is a hash, so there is no
+    "last id seen" to compare against, but only the id column is listed and full rows are fetched for the new ids alone.
+    Communities computed on the old graph are marked as stale, and the layout of the new graph is precomputed (warm
+    started from the old one) so the app does not have to.
 
+    :params
+    :int: n: the length of the sequences
 
-def save_image(matrix, image_path):
-    # Normalize the matrix values to range between 0 and 255
-    normalized_matrix = (matrix * 255).astype(np.uint8)
-    
-    # Create an image object from the normalized matrix
-    img = Image.fromarray(normalized_matrix, mode='L')
-    img = img.resize((300, 300), Image.NEAREST)
-    
-    # Save the image
-    img.save(f'assets/{image_path}')
-    return f'assets/{image_path}'
+    :returns
+    :int: number of new sequence rows applied
+    """
+    sequences_df = load_sequences(n)
+    shapes_df = load_shapes(n)
+    graph = load_graph(n)
+    if sequences_df is None or shapes_df is None or graph is None:
+        create_network_graph(n)
+        return 0
 
+    known = set(sequences_df['sequence_id'].tolist())
+    new_ids = [sequence_id for sequence_id in get_sequence_ids(n) if sequence_id not in known]
+    if not new_ids:
+        return 0
+    new_rows = get_sequences_by_ids(new_ids)
+    if new_rows.empty:
+        return 0
 
+    # shapes touched by the new rows may be new or have a lower min degeneracy / energy now
+    touched = get_shapes_by_ids(new_rows['shape_mapping'].astype(str).unique().tolist())
 
+    # new shapes become nodes even when no other shape shares a sequence with them, like in the full build
+    graph = add_nodes(graph, touched['shape_id'].astype(str))
+    graph = add_edges(graph, *comapping_delta(sequences_df, new_rows))
 
-def encode_image_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-    return encoded_string
+    shapes_df = pd.concat([shapes_df[~shapes_df['shape_id'].isin(touched['shape_id'])], touched], ignore_index=True)
+    sequences_df = pd.concat([sequences_df.astype({'sequence': str, 'shape_mapping': str}), new_rows], ignore_index=True)
 
+    save_sequences(sequences_df, n)
+    save_shapes(shapes_df, n)
+    save_graph(*graph, n)
+    mark_stale(n, "layout", "communities")
+    get_layout(n, graph, wait=True)
+    return len(new_rows)
 
 
-def save_all_pngs_to_assets(min_n=8, max_n=14):
+def prerender_thumbnails(min_n=8, max_n=14, workers=None):
+    """Renders the thumbnail of every shape between min_n and max_n ahead of time so that hovers never wait on a render"""
     for n in range(min_n, max_n + 1):
-        _, _, shape_matrices, _, _ = create_network_graph(n)
-        for shape_id, matrix in shape_matrices.items():
-            image_path = f"{shape_id}.png"
-            save_image(matrix, image_path)
+        _, shape_ids, _, _ = create_network_graph(n)
+        prerender(shape_ids, workers)
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['report']:
+        figure_report(range(MIN_N, MAX_N + 1) if len(sys.argv) == 2 else map(int, sys.argv[2:]))
+        sys.exit()
     try:
-        save_all_pngs_to_assets(min_n=15, max_n=16)
+        prerender_thumbnails(min_n=15, max_n=16)
 
     except Exception as e:
         print(e)
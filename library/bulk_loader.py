@@ -0,0 +1,137 @@
+"""
+Bulk fetches the rows of a table from the database, e.g. every sequence at a given n.
+Filters and the column projection run on the server. The key space of the table is cut into slices that are read
+concurrently over the shared client, and each slice is paged by keyset on the key column, so every page is an index range
+scan rather than an ever growing offset. Pages go straight into per-column lists and become one dataframe at the end.
+"""
+import os, sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pandas as pd
+from postgrest.exceptions import APIError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+PAGE_SIZE = 1000  # default max rows per request of PostgREST on Supabase
+
+
+def key_slices(n_slices, low=INT64_MIN, high=INT64_MAX):
+    """Cuts [low, high] into n_slices half open ranges of equal width, the last one left open ended.
+    sequence_id is a 64 bit hash, so equal width slices hold about as many rows each.
+
+    :returns
+    :list: (start, stop) pairs, stop is None for the last slice
+    """
+    edges = [low + (high - low) * i // n_slices for i in range(n_slices)]
+    return list(zip(edges, edges[1:] + [None]))
+
+
+def execute_with_retry(query, retries=5, backoff=0.5):
+    """Runs a query, retrying with exponential backoff on network and server errors"""
+    for attempt in range(retries + 1):
+        try:
+            return query.execute().data
+        except (httpx.HTTPError, APIError) as e:
+            if attempt == retries:
+                raise
+            print(f"Query failed ({e}), retrying in {backoff * 2 ** attempt:.1f}s")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def _fetch_slice(client, table, columns, filters, key, start, stop, page_size, retries):
+    """Pages through one slice of the key space (start None for no lower bound), returns its rows as a dict of column lists"""
+    data = {column: [] for column in columns}
+    last = None
+    while True:
+        query = client.table(table).select(",".join(columns))
+        for column, value in filters.items():
+            query = query.in_(column, value) if isinstance(value, (list, tuple)) else query.eq(column, value)
+        if last is not None:
+            query = query.gt(key, last)
+        elif start is not None:
+            query = query.gte(key, start)
+        if stop is not None:
+            query = query.lt(key, stop)
+        rows = execute_with_retry(query.order(key).limit(page_size), retries)
+        for column in columns:
+            data[column].extend(row[column] for row in rows)
+        if len(rows) < page_size:
+            return data
+        last = rows[-1][key]
+
+
+def fetch_rows(table, columns, filters=None, key="sequence_id", slices=16, workers=8, page_size=PAGE_SIZE, retries=5, client=None):
+    """Fetches every row of a table matching the filters.
+
+    :params
+    :str: table: name of the table
+    :list: columns: columns to fetch (the key column must be one of them)
+    :dict: filters: column -> value equality filters (or list of values to match any of), applied by the database
+    :str: key: integer column to page on, should be indexed
+    :int: slices: number of key ranges the table is cut into
+    :int: workers: number of slices fetched at the same time
+    :int: page_size: rows per request
+    :int: retries: attempts per request before giving up
+    :supabase.Client: client: defaults to the shared SupabaseDB client
+
+    :returns
+    :pd.DataFrame: the rows sorted by key, with the given columns
+    """
+    if client is None:
+        from library.db_helper import SupabaseDB
+        client = SupabaseDB.supabase
+    filters = filters or {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(lambda bounds: _fetch_slice(client, table, columns, filters, key, *bounds, page_size, retries),
+                              key_slices(slices)))
+    return pd.DataFrame({column: [value for part in parts for value in part[column]] for column in columns}, columns=columns)
+
+
+def fetch_by_keys(table, columns, column, values, key, filters=None, chunk_size=200, workers=4, page_size=PAGE_SIZE, retries=5, client=None):
+    """Fetches the rows whose column is one of the given values, with one in.() query per chunk of values
+    (paged on key when a chunk matches more than a page of rows), the chunks running concurrently.
+
+    :params
+    :str: column: column to match the values against
+    :list: values: values to look up
+    :str: key: column to page on, any sortable column works since paging does not start from a bound
+    :dict: filters: extra equality filters
+    :int: chunk_size: number of values per query (keeps the request url short)
+
+    :returns
+    :pd.DataFrame: the rows that were found, with the given columns
+    """
+    if client is None:
+        from library.db_helper import SupabaseDB
+        client = SupabaseDB.supabase
+    values = list(dict.fromkeys(values))
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(lambda chunk: _fetch_slice(client, table, columns, {**(filters or {}), column: chunk}, key, None, None, page_size, retries),
+                              chunks))
+    return pd.DataFrame({column: [value for part in parts for value in part[column]] for column in columns}, columns=columns)
+
+
+if __name__ == "__main__":
+    # checks the loader against the PostgREST stub, with 20ms of latency and 5% of failed requests
+    from supabase import create_client
+    from library.cache_helper import load_sequences, SEQUENCE_COLUMNS
+    from library.postgrest_stub import start_stub, STUB_KEY
+
+    tables = [load_sequences(n) for n in (10, 11)]
+    sequences_df = pd.concat([df.astype({"sequence": str, "shape_mapping": str}) for df in tables if df is not None], ignore_index=True)
+    stub = start_stub({"Sequences": sequences_df}, {"Sequences": "sequence_id"}, latency=0.02, fail_rate=0.05)
+    client = create_client(stub.url, STUB_KEY)
+
+    for n in (10, 11):
+        expected = sequences_df[sequences_df["length"] == n].sort_values("sequence_id").reset_index(drop=True)
+        for slices, workers in ((1, 1), (16, 8)):
+            start = time.time()
+            rows = fetch_rows("Sequences", SEQUENCE_COLUMNS, {"length": n}, slices=slices, workers=workers, retries=8, client=client)
+            same = rows.astype(expected.dtypes.to_dict()).equals(expected[SEQUENCE_COLUMNS])
+            print(f"n={n}: {len(rows)} rows, {slices} slices / {workers} workers in {time.time() - start:.2f}s, matches: {same}")
+    stub.shutdown()
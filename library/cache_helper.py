@@ -0,0 +1,298 @@
+"""
+Provides a versioned, columnar on-disk cache for the data the graph app works on (sequences, shapes and graph edges).
+Tables are uncompressed Arrow IPC (Feather v2) files under data/cache/v{CACHE_VERSION}/{n}/ so they can be memory-mapped on load.
+Sequences and shape mappings are dictionary encoded, paths use the compact codec of shape_helper.encode_paths, small
+integers are stored as int8/int32 and the graph is kept as int32 source/target/weight arrays indexing a node table.
+
+Run this file to migrate the old data/*_df_{n}.json and graph_{n}.json files and compare load times.
+"""
+import os, sys
+import json
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import networkx as nx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.shape_helper import compact_path_column
+
+CACHE_VERSION = 1
+CACHE_DIR = "data/cache"
+
+SEQUENCE_COLUMNS = ['sequence_id', 'sequence', 'degeneracy', 'length', 'energy', 'shape_mapping', 'path']
+SHAPE_COLUMNS = ['shape_id', 'min_degeneracy', 'length', 'min_energy']
+
+
+def cache_path(n, table, cache_dir=CACHE_DIR):
+    return f"{cache_dir}/v{CACHE_VERSION}/{n}/{table}.feather"
+
+
+def cache_exists(n, table, cache_dir=CACHE_DIR):
+    return os.path.exists(cache_path(n, table, cache_dir))
+
+
+def _write_table(table, path, metadata=None):
+    """Writes an arrow table with the cache version (and any extra metadata) in its schema, atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = table.replace_schema_metadata({**(metadata or {}), "cache_version": str(CACHE_VERSION)})
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+
+
+def _read_table(path):
+    """Memory-maps an arrow table, returns None if it is missing or was written by another cache version"""
+    if not os.path.exists(path):
+        return None
+    table = feather.read_table(path, memory_map=True)
+    metadata = table.schema.metadata or {}
+    if metadata.get(b"cache_version") != str(CACHE_VERSION).encode():
+        return None
+    return table
+
+
+# ========================= Sequences and Shapes =========================
+def save_sequences(sequences_df, n, cache_dir=CACHE_DIR):
+    """Stores a sequences dataframe (columns from SEQUENCE_COLUMNS) in the columnar cache"""
+    table = pa.table({
+        'sequence_id': pa.array(sequences_df['sequence_id'], pa.int64()),
+        'sequence': pa.array(sequences_df['sequence'].astype(str), pa.string()).dictionary_encode(),
+        'degeneracy': pa.array(sequences_df['degeneracy'], pa.int32()),
+        'length': pa.array(sequences_df['length'], pa.int8()),
+        'energy': pa.array(sequences_df['energy'], pa.int8()),
+        'shape_mapping': pa.array(sequences_df['shape_mapping'].astype(str), pa.string()).dictionary_encode(),
+        'path': pa.array(compact_path_column(sequences_df['path'].astype(str)), pa.string()),
+    })
+    _write_table(table, cache_path(n, "sequences", cache_dir))
+
+
+def load_sequences(n, cache_dir=CACHE_DIR):
+    """Loads the cached sequences at n as a dataframe (sequence and shape_mapping are categoricals), or None"""
+    table = _read_table(cache_path(n, "sequences", cache_dir))
+    return None if table is None else table.to_pandas()
+
+
+def save_shapes(shapes_df, n, cache_dir=CACHE_DIR):
+    """Stores a shapes dataframe (columns from SHAPE_COLUMNS) in the columnar cache"""
+    table = pa.table({
+        'shape_id': pa.array(shapes_df['shape_id'].astype(str), pa.string()),
+        'min_degeneracy': pa.array(shapes_df['min_degeneracy'], pa.int32()),
+        'length': pa.array(shapes_df['length'], pa.int8()),
+        'min_energy': pa.array(shapes_df['min_energy'], pa.int8()),
+    })
+    _write_table(table, cache_path(n, "shapes", cache_dir))
+
+
+def load_shapes(n, cache_dir=CACHE_DIR):
+    """Loads the cached shapes at n as a dataframe, or None"""
+    table = _read_table(cache_path(n, "shapes", cache_dir))
+    return None if table is None else table.to_pandas()
+
+
+# ========================= Graph =========================
+def save_graph(nodes, source, target, weight, n, cache_dir=CACHE_DIR):
+    """Stores a weighted graph as a node table and int32 source/target/weight edge arrays indexing it
+
+    :params
+    :list: nodes: shape ids of the nodes, in graph order
+    :np.array: source, target: node indices of every edge
+    :np.array: weight: weight of every edge
+    """
+    _write_table(pa.table({'shape_id': pa.array(list(nodes), pa.string())}), cache_path(n, "nodes", cache_dir))
+    _write_table(pa.table({
+        'source': pa.array(np.asarray(source, dtype=np.int32)),
+        'target': pa.array(np.asarray(target, dtype=np.int32)),
+        'weight': pa.array(np.asarray(weight, dtype=np.int32)),
+    }), cache_path(n, "edges", cache_dir))
+
+
+def load_graph(n, cache_dir=CACHE_DIR):
+    """Loads a cached graph
+
+    :returns
+    :tuple: nodes (list of shape ids), source, target, weight (int32 arrays), or None if it is not cached
+    """
+    nodes = _read_table(cache_path(n, "nodes", cache_dir))
+    edges = _read_table(cache_path(n, "edges", cache_dir))
+    if nodes is None or edges is None:
+        return None
+    return (nodes.column('shape_id').to_pylist(),
+            edges.column('source').to_numpy(),
+            edges.column('target').to_numpy(),
+            edges.column('weight').to_numpy())
+
+
+def graph_to_arrays(G):
+    """Turns a networkx graph into the (nodes, source, target, weight) form used by save_graph"""
+    nodes = list(G.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = [(index[u], index[v], data.get('weight', 1)) for u, v, data in G.edges(data=True)]
+    source, target, weight = (np.array(column, dtype=np.int32) for column in zip(*edges)) if edges else (np.empty(0, np.int32),) * 3
+    return nodes, source, target, weight
+
+
+def arrays_to_graph(nodes, source, target, weight):
+    """Builds the networkx graph for (nodes, source, target, weight) arrays, keeping the node order"""
+    G = nx.Graph()
+    G.add_nodes_from(nodes)
+    G.add_weighted_edges_from(zip((nodes[i] for i in source), (nodes[j] for j in target), weight.tolist()))
+    return G
+
+
+# ========================= Layout =========================
+def save_layout(nodes, xy, graph_hash, n, cache_dir=CACHE_DIR):
+    """Stores node positions for the graph at n, tagged with the hash of the graph they were computed on"""
+    table = pa.table({
+        'shape_id': pa.array(list(nodes), pa.string()),
+        'x': pa.array(np.asarray(xy[:, 0], dtype=np.float32)),
+        'y': pa.array(np.asarray(xy[:, 1], dtype=np.float32)),
+    })
+    _write_table(table, cache_path(n, "layout", cache_dir), {"graph_hash": graph_hash})
+
+
+def load_layout(n, cache_dir=CACHE_DIR):
+    """Loads cached node positions at n
+
+    :returns
+    :tuple: nodes (list of shape ids), xy ((nodes, 2) float32 array), graph_hash, or None if there is no layout
+    """
+    table = _read_table(cache_path(n, "layout", cache_dir))
+    if table is None:
+        return None
+    xy = np.column_stack([table.column('x').to_numpy(), table.column('y').to_numpy()])
+    return table.column('shape_id').to_pylist(), xy, table.schema.metadata[b"graph_hash"].decode()
+
+
+# ========================= Communities =========================
+def save_partitions(partitions, graph_hash, n, cache_dir=CACHE_DIR):
+    """Stores community partitions of the graph at n
+
+    :params
+    :list: partitions: dicts with resolution (None for plain modularity), seed, weighted, modularity and membership
+    :str: graph_hash: hash of the graph the partitions were computed on
+    """
+    table = pa.table({
+        'resolution': pa.array([p['resolution'] for p in partitions], pa.float64()),
+        'seed': pa.array([p['seed'] for p in partitions], pa.int32()),
+        'weighted': pa.array([p['weighted'] for p in partitions], pa.bool_()),
+        'modularity': pa.array([p['modularity'] for p in partitions], pa.float64()),
+        'membership': pa.array([np.asarray(p['membership'], dtype=np.int32) for p in partitions], pa.list_(pa.int32())),
+    })
+    _write_table(table, cache_path(n, "communities", cache_dir), {"graph_hash": graph_hash})
+
+
+def load_partitions(n, cache_dir=CACHE_DIR):
+    """Loads the cached partitions at n
+
+    :returns
+    :tuple: list of partition dicts (see save_partitions), graph_hash, or None if there are none
+    """
+    table = _read_table(cache_path(n, "communities", cache_dir))
+    if table is None:
+        return None
+    return table.to_pylist(), table.schema.metadata[b"graph_hash"].decode()
+
+
+# ========================= Derived Data State =========================
+def _state_path(n, cache_dir=CACHE_DIR):
+    return f"{cache_dir}/v{CACHE_VERSION}/{n}/state.json"
+
+
+def _load_state(n, cache_dir=CACHE_DIR):
+    if os.path.exists(_state_path(n, cache_dir)):
+        with open(_state_path(n, cache_dir), "r") as f:
+            return json.load(f)
+    return {"stale": []}
+
+
+def _save_state(state, n, cache_dir=CACHE_DIR):
+    path = _state_path(n, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def mark_stale(n, *artifacts, cache_dir=CACHE_DIR):
+    """Flags data derived from the graph at n (e.g. "layout", "communities") as out of date"""
+    state = _load_state(n, cache_dir)
+    state["stale"] = sorted(set(state["stale"]) | set(artifacts))
+    _save_state(state, n, cache_dir)
+
+
+def clear_stale(n, artifact, cache_dir=CACHE_DIR):
+    """Marks a derived artifact as recomputed"""
+    state = _load_state(n, cache_dir)
+    if artifact in state["stale"]:
+        state["stale"].remove(artifact)
+        _save_state(state, n, cache_dir)
+
+
+def is_stale(n, artifact, cache_dir=CACHE_DIR):
+    return artifact in _load_state(n, cache_dir)["stale"]
+
+
+# ========================= Migration =========================
+def read_graph_json(path):
+    """Reads an old nx.node_link_data graph file into (nodes, source, target, weight) arrays"""
+    with open(path, "r") as f:
+        data = json.load(f)
+    nodes = [node['id'] for node in data['nodes']]
+    index = {node: i for i, node in enumerate(nodes)}
+    links = data['links']
+    source = np.fromiter((index[link['source']] for link in links), dtype=np.int32, count=len(links))
+    target = np.fromiter((index[link['target']] for link in links), dtype=np.int32, count=len(links))
+    weight = np.fromiter((link.get('weight', 1) for link in links), dtype=np.int32, count=len(links))
+    return nodes, source, target, weight
+
+
+def migrate_json(n, data_dir="data", cache_dir=CACHE_DIR):
+    """Converts the old orient='split' JSON files for n into the columnar cache. Missing files are skipped.
+
+    :returns
+    :list: names of the tables that were written
+    """
+    written = []
+    if os.path.exists(f"{data_dir}/sequences_df_{n}.json"):
+        save_sequences(pd.read_json(f"{data_dir}/sequences_df_{n}.json", orient='split', convert_dates=False), n, cache_dir)
+        written.append("sequences")
+    if os.path.exists(f"{data_dir}/shapes_df_{n}.json"):
+        save_shapes(pd.read_json(f"{data_dir}/shapes_df_{n}.json", orient='split', convert_dates=False), n, cache_dir)
+        written.append("shapes")
+    if os.path.exists(f"{data_dir}/graph_{n}.json"):
+        save_graph(*read_graph_json(f"{data_dir}/graph_{n}.json"), n, cache_dir=cache_dir)
+        written.append("graph")
+    return written
+
+
+if __name__ == "__main__":
+    # migrate every JSON file and benchmark the load times
+    for n in range(8, 14):
+        print(f"n={n}: migrated {migrate_json(n)}")
+
+        if os.path.exists(f"data/sequences_df_{n}.json"):
+            start = time.time()
+            pd.read_json(f"data/sequences_df_{n}.json", orient='split', convert_dates=False)
+            json_time = time.time() - start
+            start = time.time()
+            load_sequences(n)
+            print(f"  sequences: json {json_time:.3f}s | columnar {time.time() - start:.3f}s "
+                  f"| {os.path.getsize(f'data/sequences_df_{n}.json') / 1e6:.2f}MB -> {os.path.getsize(cache_path(n, 'sequences')) / 1e6:.2f}MB")
+
+        if os.path.exists(f"data/shapes_df_{n}.json"):
+            start = time.time()
+            pd.read_json(f"data/shapes_df_{n}.json", orient='split', convert_dates=False)
+            json_time = time.time() - start
+            start = time.time()
+            load_shapes(n)
+            print(f"  shapes: json {json_time:.3f}s | columnar {time.time() - start:.3f}s")
+
+        if os.path.exists(f"data/graph_{n}.json"):
+            start = time.time()
+            read_graph_json(f"data/graph_{n}.json")
+            json_time = time.time() - start
+            start = time.time()
+            load_graph(n)
+            print(f"  graph: json {json_time:.3f}s | columnar arrays {time.time() - start:.3f}s "
+                  f"| {os.path.getsize(f'data/graph_{n}.json') / 1e6:.2f}MB -> {os.path.getsize(cache_path(n, 'edges')) / 1e6:.2f}MB")
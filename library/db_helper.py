@@ -12,6 +12,10 @@ import json
 import pandas as pd
 from tabulate import tabulate
 import sys 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.io_helper import iter_json_array
+from library.upload_helper import upload_records, upload_tables
+from library.shard_helper import merge_shapes, shard_paths
 # COMMENT LINE BELOW OUT - FOR TESTING PURPOSES ONLY
 
 
@@ -43,51 +47,60 @@ class SupabaseDB:
     supabase: Client = create_client(url, key, options=client_options)
 
 # ========================= JSON Data Saving Toolkit =========================
-def upload_data(n):
-    """ Imports data from json files and returns lists of dicts
-    PREQUESITE: You must have ran native_fold for your n of choice and have the json files in the data folder.
-    
+def upload_data(n, from_shards=False, workers=4, resume=True):
+    """ Uploads the generated data of an n to the database, Shapes first then Sequences.
+    PREQUESITE: You must have ran native_fold (or library/pipeline.py) for your n of choice and have the json files in the data folder.
+
+    Sequences are streamed from the file(s) and never held in memory all at once; shapes are few and are merged in memory.
+    A sequence_id that shows up twice is only uploaded the first time. Progress is journaled in data/{n}/upload_journal.json,
+    so running it again after a failure only sends what was not committed yet.
+
     :params
-    :int: n: the length of the sequences to be returned.
+    :int: n: the length of the sequences to be uploaded.
+    :bool: from_shards: if True, reads the pipeline shard files in data/{n}/shards instead of seq_{n}.json and shape_{n}.json
+    :int: workers: number of batches in flight at the same time
+    :bool: resume: if False, ignores the journal and uploads everything again
     """
-    with open(f"data/{n}/seq_{n}.json", "r") as f:
-        seq_list = json.load(f)
-        print("Parsed seq_list")
-    with open(f"data/{n}/shape_{n}.json", "r") as f:
-        shape_list = json.load(f)
-        print("Parsed shape_list")
-    # Drop all duplicates from the lists
-    seq_list = list({v['sequence_id']: v for v in seq_list}.values())
-    shape_list = list({v['shape_id']: v for v in shape_list}.values())
-    try:
-        commit_to_supabase(shape_list, seq_list)
-    except Exception as e:
-        print("Error: ", e)
-        print("Data not added to database")
-        return
-    
-def commit_to_supabase(shape_list, seq_list, retries = 0):
-    """ Adds all the data to the database asynchronously"""
-    # Create a client
-    db = SupabaseDB()
-    # Add all the data to the database
-    if retries > 20:
-        print("Too many retries, aborting")
-        return
-    
+    if from_shards:
+        paths = shard_paths(f"data/{n}/shards")
+
+        def shape_records():
+            shapes = {}
+            for path in paths:
+                with open(path, "r") as f:
+                    merge_shapes(shapes, {record["shape_id"]: record for record in json.load(f)["shapes"]})
+            return iter(shapes.values())
+
+        def seq_records():
+            for path in paths:
+                with open(path, "r") as f:
+                    yield from json.load(f)["sequences"]
+    else:
+        paths = [f"data/{n}/shape_{n}.json", f"data/{n}/seq_{n}.json"]
+
+        def shape_records():
+            # the last row of a shape wins, like before
+            return iter({v['shape_id']: v for v in iter_json_array(paths[0])}.values())
+
+        def seq_records():
+            return iter_json_array(paths[1])
+
     try:
-        # insert if it doesn't exist
-        db.supabase.table("Shapes").insert(shape_list, upsert=True).execute()
-        db.supabase.table("Sequences").insert(seq_list, upsert=True).execute()
+        upload_tables([("Shapes", "shape_id", shape_records), ("Sequences", "sequence_id", seq_records)],
+                      f"data/{n}/upload_journal.json", paths, workers=workers, resume=resume)
     except Exception as e:
-        # try again halving the data if it timed out
         print("Error: ", e)
-        print("Data not added to database")
-        commit_to_supabase(shape_list[:len(shape_list)//2], seq_list[:len(seq_list)//2], retries=retries+1)
-        commit_to_supabase(shape_list[len(shape_list)//2:], seq_list[len(seq_list)//2:], retries=retries+1)
+        print("Data not added to database, run again to resume")
         return
     print("Data added to database")
 
+
+def commit_to_supabase(shape_list, seq_list, workers=4):
+    """ Upserts lists of shapes and sequences to the database in batches on the shared client"""
+    upload_records("Shapes", shape_list, "shape_id", SupabaseDB.supabase, workers)
+    upload_records("Sequences", seq_list, "sequence_id", SupabaseDB.supabase, workers)
+    print("Data added to database")
+
 # ========================= Adding a new column to the DB (disregard this) =========================
 
 # This section is for adding the new "path"column to the database. 
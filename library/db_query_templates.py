@@ -7,6 +7,9 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from library.db_helper import SupabaseDB
 from library.shape_helper import *
+from library.bulk_loader import fetch_rows, fetch_by_keys
+from library.cache_helper import SEQUENCE_COLUMNS, SHAPE_COLUMNS
+from library.shape_index import lookup_shapes
 import pandas as pd
 
 # Getting things out of the database
@@ -18,17 +21,17 @@ def get_perfect_shapes(target_n=10):
     KEY: the secret key for the database
 
     :params
-    :int: target_n: the length of the shape to be returned
+    :int: target_n: the length of the shape to be returned, or a list of lengths to fetch in one go
 
     :returns
     :list: perfect_shapes: a list of all the shapes with degeneracy 2 in the database
     """
-    db = SupabaseDB()
-    # select all the shapes from the database where min_degeneracy = 2
-    perfect_shapes = db.supabase.table("Shapes").select("*").eq("min_degeneracy", 2).eq("length", target_n).execute()
+    target_ns = list(target_n) if isinstance(target_n, (list, tuple, range)) else [target_n]
+    # only the ids of the shapes with min_degeneracy = 2, paged so that no shape is cut off at the row limit
+    perfect_shapes = fetch_by_keys("Shapes", ["shape_id"], "length", target_ns, key="shape_id", filters={"min_degeneracy": 2})
 
-    # get all the shape ids and deserialize them
-    perfect_shapes = [deserialize_shape(shape["shape_id"]) for shape in perfect_shapes.data]
+    # deserialize them
+    perfect_shapes = [deserialize_shape(shape_id) for shape_id in perfect_shapes["shape_id"]]
 
     return perfect_shapes # return as list of np.arrays
 
@@ -58,19 +61,14 @@ def get_random_shape(target_n=10):
 def get_all_sequences_for_shape(shape_id):
     """ Returns all sequences for a given shape and their data.
     :params
-    :str: shape_id: the shape id of the shape to be returned
+    :str: shape_id: the shape id of the shape to be returned, or a list of shape ids to fetch in batched queries
 
     :returns
-    :pd.DataFrame: sequences: a list of all the sequences for the given shape.
+    :pd.DataFrame: sequences: a list of all the sequences for the given shape(s).
     """
-    db = SupabaseDB()
-    # select all the sequences from the database where shape_id = shape_id
-    sequences = db.supabase.table("Sequences").select("*").eq("shape_mapping", shape_id).execute()
-
-    # convert to dataframe
-    sequences = pd.DataFrame(sequences.data)
-
-    return sequences # return as list of np.arrays
+    shape_ids = [shape_id] if isinstance(shape_id, str) else list(shape_id)
+    # select all the sequences from the database where shape_mapping is one of the shape ids
+    return fetch_by_keys("Sequences", SEQUENCE_COLUMNS, "shape_mapping", shape_ids, key="sequence_id")
 
 def get_all_shape_data(target_n):
     """ Returns all shape data in the database at a target n
@@ -92,70 +90,73 @@ def get_all_shape_data(target_n):
 
 def get_all_sequence_data(target_n):
     """ Returns all sequence data in the database at a target n
+    The length filter runs in the database and the table is read in concurrent keyset-paged slices (see bulk_loader).
 
     :params
     :int: target_n: the length of the shape to be returned
 
     :returns
-    :list: sequences: a list of all the sequences in the database
+    :pd.DataFrame: sequences: all the sequences at target_n, sorted by sequence_id
     """
-    db = SupabaseDB()
-    def count_data(tb_name: str, field_name: str):
-        return db.supabase.table(tb_name).select(field_name, count='exact').execute().count
-
-    def get_field_data(tb_name: str, src_field: str, len_record: int, id_field: str = 'id'):
-        if len_record <= 1000:
-            field_data = db.supabase.table(tb_name).select(id_field, src_field).order(
-                column=id_field).execute().data
-        else:
-            rnk = int(len_record / 1000)
-            field_data = []
-            for i in range(rnk):
-                min_rg = (i * 1000) + 1
-                max_rg = (i + 1) * 1000
-                field_data = field_data + db.supabase.table(tb_name).select(id_field, src_field).order(
-                    column=id_field).range(min_rg - 1, max_rg).execute().data
-
-            field_data = field_data + db.supabase.table(tb_name).select(id_field, src_field).order(
-                column=id_field).range(max_rg, len_record).execute().data
-        return field_data
-
-    tb_name = "Sequences"
-    src_field = "*"
-    id_field = "sequence_id"
-
-    len_record = count_data(tb_name, "length")
-    sequence_data = get_field_data(tb_name, src_field, len_record, id_field)
-
-    # filter by target_n
-    sequence_data = [item for item in sequence_data if item['length'] == target_n]
+    return fetch_rows("Sequences", SEQUENCE_COLUMNS, {"length": target_n}, key="sequence_id")
+
+def get_sequence_ids(target_n):
+    """ Returns every sequence_id in the database at a target n, only fetching the id column
+
+    :params
+    :int: target_n: the length of the sequences
+
+    :returns
+    :list: sequence_ids: all the sequence ids at target_n
+    """
+    return fetch_rows("Sequences", ["sequence_id"], {"length": target_n}, key="sequence_id")["sequence_id"].tolist()
 
-    # convert to dataframe
-    sequence_data = pd.DataFrame(sequence_data)
-    return sequence_data
+
+def get_sequences_by_ids(sequence_ids, chunk_size=200):
+    """ Returns the full rows of the given sequence ids
+
+    :params
+    :list: sequence_ids: the ids to fetch
+    :int: chunk_size: number of ids per query (keeps the request url short)
+
+    :returns
+    :pd.DataFrame: sequences: the rows that were found
+    """
+    return fetch_by_keys("Sequences", SEQUENCE_COLUMNS, "sequence_id", sequence_ids, key="sequence_id", chunk_size=chunk_size)
+
+
+def get_shapes_by_ids(shape_ids, chunk_size=200):
+    """ Returns the full rows of the given shape ids
+
+    :params
+    :list: shape_ids: the ids to fetch
+    :int: chunk_size: number of ids per query (keeps the request url short)
+
+    :returns
+    :pd.DataFrame: shapes: the rows that were found
+    """
+    return fetch_by_keys("Shapes", SHAPE_COLUMNS, "shape_id", shape_ids, key="shape_id", chunk_size=chunk_size)
 
 # Checking if things exist 
 
-def check_shape(shape_mappings):
+def check_shape(shape_mappings, trust_cache=False):
     """
-    Checks if a shape is already in the database. If the input is a list, check each mapping sequentially and return the first match. 
-    If the input is a single mapping, return the first match.
+    Checks if a shape is already in the database. If the input is a list, return the first mapping (in the order given) that is.
+    If the input is a single mapping, return it if it is.
+    All mappings are looked up at once, in the local shape index first and in batched queries for the rest (see shape_index).
 
     :params
     :list: shape_mappings: a list of shape mappings to check
-    :bool: matrix: if true, the input is a matrix and not a shape mapping
+    :bool: trust_cache: if True, mappings missing from the local cache are taken as absent without asking the database,
+        only use it when the cache is known to be complete
 
     :returns
     :str: shape_id: the shape id of the match if it was found, else None
     """
     if type(shape_mappings) == str:
         shape_mappings = [shape_mappings]
-    db = SupabaseDB()
-    for shape_mapping in shape_mappings:
-        shape = db.supabase.table("Shapes").select("*").eq("shape_id", shape_mapping).execute().data
-        if shape:
-            return shape[0]["shape_id"]
-    return None
+    found = lookup_shapes(shape_mappings, trust_cache)
+    return next((shape_mapping for shape_mapping in shape_mappings if shape_mapping in found), None)
 
 if __name__ == "__main__":
     
@@ -0,0 +1,168 @@
+"""
+Exports plotly figures to PDF, PNG or SVG in the background so that rendering a graph never waits on kaleido.
+Exports are keyed by a hash of the figure: the same figure is only ever exported once per format, finished files are
+served from data/cache/exports, and a lock file next to the target keeps several server processes from exporting the same figure.
+An export can also be submitted under a name (e.g. the view and the version of its data), so that polling for it later
+(find_export) does not have to build the figure again just to hash it.
+
+usage: python library/export_helper.py 10 11 --view communities --format pdf svg
+"""
+import os, sys
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.io as pio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EXPORT_DIR = "data/cache/exports"
+EXPORT_FORMATS = ("pdf", "png", "svg")
+LOCK_TIMEOUT = 600  # seconds after which the lock of an export that never finished is ignored
+
+_pool = None
+_jobs = {}
+
+
+def figure_hash(fig):
+    """Content hash of a figure, two figures that look the same have the same hash"""
+    return hashlib.sha1(fig.to_json().encode()).hexdigest()
+
+
+def export_path(digest, fmt, export_dir=EXPORT_DIR):
+    return f"{export_dir}/{digest}.{fmt}"
+
+
+def _ref_path(name, fmt, export_dir=EXPORT_DIR):
+    return f"{export_dir}/{name}.{fmt}.ref"
+
+
+def find_export(name, fmt, export_dir=EXPORT_DIR):
+    """Path of the export last submitted under a name (see submit_export), None if there is none"""
+    try:
+        with open(_ref_path(name, fmt, export_dir), "r") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _lock_path(path):
+    return f"{path}.lock"
+
+
+def _acquire(path):
+    """Takes the lock of an export, False if another process is already on it"""
+    lock = _lock_path(path)
+    if os.path.exists(lock) and time.time() - os.path.getmtime(lock) > LOCK_TIMEOUT:
+        os.remove(lock)
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
+def _write(fig_json, path, fmt):
+    """Worker task: renders the figure with kaleido to a temporary file and moves it into place"""
+    try:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        pio.write_image(pio.from_json(fig_json), tmp, format=fmt)
+        os.replace(tmp, path)
+    finally:
+        os.remove(_lock_path(path))
+    return path
+
+
+def _get_pool(workers=1):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def submit_export(fig, fmt="pdf", export_dir=EXPORT_DIR, name=None):
+    """Queues the export of a figure unless it is already exported or being exported.
+
+    :params
+    :plotly.graph_objs.Figure: fig: the figure to export
+    :str: fmt: one of EXPORT_FORMATS
+    :str: export_dir: folder of the finished files
+    :str: name: optional name to find the export by later without the figure (see find_export)
+
+    :returns
+    :tuple: status ("done", "running" or "queued"), path of the (future) file
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt}, expected one of {EXPORT_FORMATS}")
+    path = export_path(figure_hash(fig), fmt, export_dir)
+    if name is not None:
+        os.makedirs(export_dir, exist_ok=True)
+        ref = _ref_path(name, fmt, export_dir)
+        with open(f"{ref}.{os.getpid()}.tmp", "w") as f:
+            f.write(path)
+        os.replace(f"{ref}.{os.getpid()}.tmp", ref)
+    if os.path.exists(path):
+        return "done", path
+    job = _jobs.get(path)
+    if job is not None and not job.done():
+        return "running", path
+    os.makedirs(export_dir, exist_ok=True)
+    if not _acquire(path):
+        return "running", path
+    _jobs[path] = _get_pool().submit(_write, fig.to_json(), path, fmt)
+    return "queued", path
+
+
+def export_status(path):
+    """"done", "running", "failed" (with the error of the last attempt) or "missing" for an export path"""
+    if os.path.exists(path):
+        return "done"
+    job = _jobs.get(path)
+    if job is not None and job.done() and job.exception() is not None:
+        return f"failed: {job.exception()}"
+    if (job is not None and not job.done()) or os.path.exists(_lock_path(path)):
+        return "running"
+    return "missing"
+
+
+def export_figures(figures, formats=("pdf",), workers=None, export_dir=EXPORT_DIR):
+    """Exports many figures at once on a process pool and waits for them, skipping the ones already exported.
+
+    :params
+    :dict: figures: name -> figure
+    :returns
+    :dict: name -> list of file paths
+    """
+    os.makedirs(export_dir, exist_ok=True)
+    paths = {name: [] for name in figures}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for name, fig in figures.items():
+            fig_json = fig.to_json()
+            digest = hashlib.sha1(fig_json.encode()).hexdigest()
+            for fmt in formats:
+                path = export_path(digest, fmt, export_dir)
+                paths[name].append(path)
+                if not os.path.exists(path) and _acquire(path):
+                    futures.append(pool.submit(_write, fig_json, path, fmt))
+        for future in futures:
+            future.result()
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+    from graph_logic import build_figure, FIGURE_VIEWS
+
+    parser = argparse.ArgumentParser(description="Export graph figures to files")
+    parser.add_argument("n", type=int, nargs="+", help="chain lengths")
+    parser.add_argument("--view", choices=FIGURE_VIEWS, nargs="+", default=["graph"])
+    parser.add_argument("--format", choices=EXPORT_FORMATS, nargs="+", default=["pdf"])
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    figures = {f"{view}_{n}": build_figure(n, view) for n in args.n for view in args.view}
+    start = time.time()
+    for name, paths in export_figures(figures, args.format, args.workers).items():
+        print(f"{name}: {', '.join(paths)}")
+    print(f"done in {time.time() - start:.1f}s")
@@ -0,0 +1,245 @@
+"""
+Binary fold store: the walks of a fold set in one file, replacing the data/folds/fold_{n}.json dumps.
+
+A 64 byte header is followed by one fixed-width row per walk, either its moves packed 4 per byte (2 bits each, the layout
+of native_fold.moves_to_bytes) or its int8 coordinates. The rows are opened with np.memmap, so opening is instant, any
+walk or slice of walks is read without touching the rest, and worker processes that open the same file share its pages
+through the OS cache. A FoldStore pickles as its path, so passing one to a worker costs nothing either.
+
+usage:
+    save_folds(16)                     # enumerate and write data/folds/fold_16.folds
+    store = open_folds(16)
+    store[10:20]                       # (10, 16, 2) int8 coordinates
+    for start, coords in store.iter_chunks(100000): ...
+"""
+import argparse
+import os, sys
+import struct
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.native_fold import (iter_walk_chunks, paths_to_array, mirror_path, moves_to_coords, coords_to_moves,
+                                 pack_move_rows, unpack_move_rows)
+from library.io_helper import iter_json_array
+
+MAGIC = b"SFFOLDS\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sHBBIQI")  # magic, version, encoding, mirrored, n, count, row bytes
+HEADER_SIZE = 64
+ENCODINGS = {"moves": 0, "coords": 1}
+
+
+def fold_store_path(n, data_dir="data"):
+    return f"{data_dir}/folds/fold_{n}.folds"
+
+
+def _row_bytes(n, encoding):
+    return -(-(n - 1) // 4) if encoding == "moves" else 2 * n
+
+
+def write_fold_store(path, n, chunks, encoding="moves", mirrored=True):
+    """Writes chunks of walks to a fold store, atomically.
+
+    :params
+    :str: path: file to write
+    :int: n: the length of the walks
+    :iterable: chunks: (walks, n, 2) coordinate arrays
+    :str: encoding: "moves" (2 bits per step) or "coords" (int8 coordinates, memory-mapped as is)
+    :bool: mirrored: True if every walk also stands for its mirror image (canonical walks from iter_walks)
+
+    :returns
+    :int: number of walks written
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    row_bytes = _row_bytes(n, encoding)
+    count = 0
+    with open(path + ".tmp", "wb") as f:
+        f.write(bytes(HEADER_SIZE))
+        for coords in chunks:
+            rows = pack_move_rows(coords_to_moves(coords)) if encoding == "moves" else np.asarray(coords, dtype=np.int8).reshape(len(coords), -1)
+            f.write(np.ascontiguousarray(rows).tobytes())
+            count += len(rows)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, ENCODINGS[encoding], int(mirrored), n, count, row_bytes))
+    os.replace(path + ".tmp", path)
+    return count
+
+
+class FoldStore:
+    """Read only, memory-mapped view of a fold store. Indexing returns int8 coordinates, (n, 2) for one walk and
+    (walks, n, 2) for a slice or an array of indices."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, encoding, mirrored, n, count, row_bytes = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} fold store")
+        self.n = n
+        self.encoding = "moves" if encoding == ENCODINGS["moves"] else "coords"
+        self.mirrored = bool(mirrored)
+        self.rows = (np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(count, row_bytes))
+                     if count else np.zeros((0, row_bytes), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def _decode(self, rows):
+        if self.encoding == "moves":
+            return moves_to_coords(unpack_move_rows(rows, self.n))
+        return rows.view(np.int8).reshape(len(rows), self.n, 2)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self._decode(self.rows[index][None])[0]
+        return self._decode(self.rows[index])
+
+    def moves(self, index=slice(None)):
+        """(walks, n - 1) move codes of the selected walks"""
+        rows = self.rows[index]
+        if self.encoding == "moves":
+            return unpack_move_rows(rows, self.n)
+        return coords_to_moves(self._decode(rows))
+
+    def coords(self):
+        """Every walk as a (walks, n, 2) int8 array, a view of the file for the coords encoding"""
+        return self._decode(self.rows)
+
+    def iter_chunks(self, chunk_size=100000):
+        """Yields (index of the first walk, (walks, n, 2) coordinates) chunk by chunk"""
+        for start in range(0, len(self), chunk_size):
+            yield start, self[start:start + chunk_size]
+
+    def multiplicity(self):
+        """Number of walks of the full fold_n set every stored walk stands for (see native_fold.walk_multiplicity)"""
+        if not self.mirrored:
+            return np.ones(len(self), dtype=np.int64)
+        return np.concatenate([np.where(coords[:, :, 0].any(axis=1), 2, 1) for _, coords in self.iter_chunks()] or [np.zeros(0, np.int64)])
+
+    def paths(self, index=slice(None), expand=False):
+        """Selected walks as lists of tuples. With expand, mirrored walks are followed by their mirror image like in fold_n"""
+        paths = []
+        for coords in self[index].tolist():
+            path = [tuple(coord) for coord in coords]
+            paths.append(path)
+            if expand and self.mirrored and any(x != 0 for x, _ in path):
+                paths.append(mirror_path(path))
+        return paths
+
+
+def open_folds(n, data_dir="data"):
+    return FoldStore(fold_store_path(n, data_dir))
+
+
+def save_folds(n, data_dir="data", encoding="moves", chunk_size=100000):
+    """Enumerates the canonical walks of length n into data/folds/fold_{n}.folds (replaces execute_and_save_native_fold)
+
+    :returns
+    :str: path to the store
+    """
+    path = fold_store_path(n, data_dir)
+    chunks = (moves_to_coords(unpack_move_rows(_codes_to_rows(codes, n), n)) for codes in iter_walk_chunks(n, chunk_size, packed=True))
+    write_fold_store(path, n, chunks, encoding, mirrored=True)
+    return path
+
+
+def _codes_to_rows(codes, n):
+    """Packed walk ints from iter_walks(packed=True) to rows of move bytes"""
+    row_bytes = _row_bytes(n, "moves")
+    if row_bytes <= 8:
+        return np.asarray(codes, dtype="<u8").view(np.uint8).reshape(len(codes), 8)[:, :row_bytes]
+    return np.frombuffer(b"".join(code.to_bytes(row_bytes, "little") for code in codes), dtype=np.uint8).reshape(len(codes), row_bytes)
+
+
+def read_folds(n, data_dir="data"):
+    """Same list of paths as fold_n(n) and read_fold_from_json(n), from the fold store (converted from the json file
+    the first time if there is only a json file)"""
+    path = fold_store_path(n, data_dir)
+    if not os.path.exists(path):
+        json_to_fold_store(f"{data_dir}/folds/fold_{n}.json", path)
+    return open_folds(n, data_dir).paths(expand=True)
+
+
+def json_to_fold_store(json_path, path, encoding="moves", chunk_size=100000):
+    """Converts a fold_{n}.json file (a list of paths, as written by execute_and_save_native_fold) to a fold store,
+    streaming it so the json is never loaded whole. The json holds mirror images explicitly, so the store is not mirrored.
+
+    :returns
+    :int: number of walks converted
+    """
+    walks = iter_json_array(json_path)
+    first = next(walks, None)
+    if first is None:
+        raise ValueError(f"{json_path} holds no walks")
+
+    def chunks():
+        chunk = [first]
+        for walk in walks:
+            chunk.append(walk)
+            if len(chunk) == chunk_size:
+                yield paths_to_array(chunk)
+                chunk = []
+        if chunk:
+            yield paths_to_array(chunk)
+
+    return write_fold_store(path, len(first), chunks(), encoding, mirrored=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write fold stores, or convert fold_{n}.json files, and time them")
+    parser.add_argument("n", type=int, nargs="+", help="lengths of the walks")
+    parser.add_argument("--data-dir", default="data", help="root of the data folder")
+    parser.add_argument("--encoding", default="moves", choices=list(ENCODINGS), help="row format of the store")
+    parser.add_argument("--from-json", action="store_true", help="convert data/folds/fold_{n}.json instead of enumerating")
+    parser.add_argument("--benchmark", action="store_true", help="compare with writing and reading the json format")
+    args = parser.parse_args()
+
+    for n in args.n:
+        path = fold_store_path(n, args.data_dir)
+        start = time.time()
+        if args.from_json:
+            json_to_fold_store(f"{args.data_dir}/folds/fold_{n}.json", path, args.encoding)
+        else:
+            save_folds(n, args.data_dir, args.encoding)
+        print(f"n={n}: wrote {path} ({os.path.getsize(path) / 1e6:.2f}MB) in {time.time() - start:.2f}s")
+        if not args.benchmark:
+            continue
+
+        import json
+        from library.native_fold import fold_n
+        json_path = f"{args.data_dir}/folds/fold_{n}.json"
+        if not os.path.exists(json_path):
+            with open(json_path, "w") as f:
+                json.dump(fold_n(n), f)
+
+        start = time.time()
+        with open(json_path, "r") as f:  # same as read_fold_from_json
+            expected = [[tuple(coord) for coord in path] for path in json.load(f)]
+        json_time = time.time() - start
+
+        start = time.time()
+        store = open_folds(n, args.data_dir)
+        open_time = time.time() - start
+        start = time.time()
+        walks = sum(len(coords) for _, coords in store.iter_chunks())
+        scan_time = time.time() - start
+        start = time.time()
+        paths = store.paths(expand=True)
+        paths_time = time.time() - start
+        index = np.random.default_rng(0).integers(len(store), size=1000)
+        start = time.time()
+        for k in index:
+            store[int(k)]
+        random_time = time.time() - start
+
+        assert paths == expected
+        print(f"    json {os.path.getsize(json_path) / 1e6:.1f}MB, read in {json_time:.2f}s | store: open {open_time * 1e3:.2f}ms, "
+              f"scan {walks} walks {scan_time:.3f}s, as tuples {paths_time:.2f}s, 1000 random walks {random_time * 1e3:.1f}ms")
@@ -0,0 +1,167 @@
+"""
+Provides array based tools to build and query the shape co-mapping graph: two shapes are linked when a sequence folds into both,
+and the edge weight counts how many such (sequence, pair of rows) there are.
+Graphs are kept as (nodes, source, target, weight) arrays; networkx objects are only built when something asks for one.
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _group_pairs(group_starts, group_sizes):
+    """All (i, j) row index pairs with i < j inside every group of consecutive rows, vectorized per distinct group size"""
+    first, second = [], []
+    for size in np.unique(group_sizes):
+        if size < 2:
+            continue
+        starts = group_starts[group_sizes == size]
+        i, j = np.triu_indices(size, k=1)
+        first.append((starts[:, None] + i).ravel())
+        second.append((starts[:, None] + j).ravel())
+    if not first:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def build_comapping_graph(sequences_df, shapes_df):
+    """Builds the co-mapping graph with the same nodes, node order and edge weights as the old groupby/add_edge loop.
+
+    :params
+    :pd.DataFrame: sequences_df: needs the sequence and shape_mapping columns
+    :pd.DataFrame: shapes_df: needs the shape_id column
+
+    :returns
+    :tuple: nodes (list of shape ids), source, target (int32 node indices, source <= target), weight (int32)
+    """
+    # rows of the same sequence next to each other, keeping their order (groupby order)
+    sequence_codes, _ = pd.factorize(sequences_df['sequence'].astype(str), sort=True)
+    order = np.argsort(sequence_codes, kind='stable')
+    mappings = sequences_df['shape_mapping'].astype(str).to_numpy()[order]
+    sorted_codes = sequence_codes[order]
+
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(sorted_codes)])
+    first, second = _group_pairs(group_starts, group_sizes)
+
+    # node order: the shapes table first, then mappings that only show up through an edge, in order of appearance
+    in_pairs = np.zeros(len(mappings), dtype=bool)
+    in_pairs[first] = True
+    in_pairs[second] = True
+    shape_ids = [shape_id for shape_id in pd.unique(shapes_df['shape_id'].astype(str)) if len(shape_id) >= 2]
+    known = set(shape_ids)
+    extra = [mapping for mapping in pd.unique(mappings[in_pairs]) if mapping not in known]
+    nodes = shape_ids + [mapping for mapping in extra if len(mapping) >= 2]
+
+    index = pd.Index(nodes)
+    codes = index.get_indexer(mappings)
+    a, b = codes[first], codes[second]
+    keep = (a >= 0) & (b >= 0)  # drops edges to the removed (too short) mappings
+    a, b = a[keep], b[keep]
+
+    n_nodes = len(nodes)
+    keys = np.minimum(a, b).astype(np.int64) * n_nodes + np.maximum(a, b)
+    keys, weight = np.unique(keys, return_counts=True)
+    return nodes, (keys // n_nodes).astype(np.int32), (keys % n_nodes).astype(np.int32), weight.astype(np.int32)
+
+
+def comapping_delta(old_sequences_df, new_sequences_df):
+    """Edge weight increments caused by adding new rows to the sequences table: only the pairs that involve a new row,
+    within the sequences the new rows belong to, are counted.
+
+    :returns
+    :tuple: shape_a, shape_b (arrays of shape ids), weight (int array)
+    """
+    affected = set(new_sequences_df['sequence'].astype(str))
+    old_rows = old_sequences_df[old_sequences_df['sequence'].astype(str).isin(affected)]
+    sequences = np.concatenate([old_rows['sequence'].astype(str).to_numpy(), new_sequences_df['sequence'].astype(str).to_numpy()])
+    mappings = np.concatenate([old_rows['shape_mapping'].astype(str).to_numpy(), new_sequences_df['shape_mapping'].astype(str).to_numpy()])
+    is_new = np.r_[np.zeros(len(old_rows), dtype=bool), np.ones(len(new_sequences_df), dtype=bool)]
+
+    # old rows come before new ones inside each group, so a pair involves a new row exactly when its second row is new
+    sequence_codes, _ = pd.factorize(sequences, sort=True)
+    order = np.argsort(sequence_codes, kind='stable')
+    sorted_codes = sequence_codes[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(sorted_codes)])
+    first, second = _group_pairs(group_starts, group_sizes)
+    keep = is_new[order][second]
+    return mappings[order][first[keep]], mappings[order][second[keep]], np.ones(int(keep.sum()), dtype=np.int64)
+
+
+def add_nodes(graph, shape_ids):
+    """Appends the shape ids (of at least 2 characters, like the full build) that are not in a graph given as arrays yet,
+    so shapes without any co-mapping edge still show up as isolated nodes.
+
+    :returns
+    :tuple: the updated nodes, source, target, weight
+    """
+    nodes, source, target, weight = graph
+    known = set(nodes)
+    new = [shape_id for shape_id in pd.unique(np.asarray(shape_ids, dtype=object)) if shape_id not in known and len(shape_id) >= 2]
+    return list(nodes) + new, source, target, weight
+
+
+def add_edges(graph, shape_a, shape_b, weight):
+    """Adds weighted edges between shape ids to a graph given as arrays. Unknown shapes (of at least 2 characters, like the
+    full build) are appended as new nodes and weights of existing edges are summed.
+
+    :returns
+    :tuple: the updated nodes, source, target, weight
+    """
+    nodes, source, target, old_weight = graph
+    nodes = list(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    for shape_id in pd.unique(np.concatenate([shape_a, shape_b])):
+        if shape_id not in index and len(shape_id) >= 2:
+            index[shape_id] = len(nodes)
+            nodes.append(shape_id)
+
+    a = np.fromiter((index.get(shape_id, -1) for shape_id in shape_a), dtype=np.int64, count=len(shape_a))
+    b = np.fromiter((index.get(shape_id, -1) for shape_id in shape_b), dtype=np.int64, count=len(shape_b))
+    keep = (a >= 0) & (b >= 0)
+    a, b = a[keep], b[keep]
+
+    n_nodes = len(nodes)
+    keys = np.concatenate([source.astype(np.int64) * n_nodes + target, np.minimum(a, b) * n_nodes + np.maximum(a, b)])
+    weights = np.concatenate([old_weight, np.asarray(weight)[keep]])
+    keys, inverse = np.unique(keys, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=weights).astype(np.int32)
+    return nodes, (keys // n_nodes).astype(np.int32), (keys % n_nodes).astype(np.int32), summed
+
+
+def graph_hash(nodes, source, target, weight):
+    """Content hash of a graph given as arrays, used to key everything computed from it (layouts, communities)"""
+    digest = hashlib.sha1("\n".join(nodes).encode())
+    for array in (source, target, weight):
+        digest.update(np.ascontiguousarray(array, dtype=np.int32).tobytes())
+    return digest.hexdigest()
+
+
+def adjacency_matrix(nodes, source, target, weight):
+    """Symmetric CSR weighted adjacency matrix of a graph given as arrays"""
+    n_nodes = len(nodes)
+    off_diagonal = source != target
+    rows = np.concatenate([source, target[off_diagonal]])
+    cols = np.concatenate([target, source[off_diagonal]])
+    data = np.concatenate([weight, weight[off_diagonal]])
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n_nodes, n_nodes))
+
+
+def node_degrees(nodes, source, target):
+    """Unweighted degree of every node, counted like networkx (a self loop adds 2)"""
+    return np.bincount(source, minlength=len(nodes)) + np.bincount(target, minlength=len(nodes))
+
+
+if __name__ == "__main__":
+    import os, sys, time
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from library.cache_helper import load_sequences, load_shapes
+
+    for n in range(8, 15):
+        sequences_df, shapes_df = load_sequences(n), load_shapes(n)
+        if sequences_df is None or shapes_df is None:
+            continue
+        start = time.time()
+        nodes, source, target, weight = build_comapping_graph(sequences_df, shapes_df)
+        print(f"n={n}: {len(nodes)} nodes, {len(source)} edges in {time.time() - start:.3f}s")
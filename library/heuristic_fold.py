@@ -0,0 +1,311 @@
+"""
+Stochastic native fold search for chains too long to enumerate (n = 30-60), next to the exact search of native_fold.
+
+Every chain is a replica exchange Monte Carlo run: a ladder of replicas at geometric temperatures, each making pull moves
+(local, and able to reach every fold) and pivot moves (a rigid rotation or reflection of one end, for large rearrangements),
+with neighbouring replicas swapping temperatures so that the low temperature ones keep escaping local minima.
+A move only changes the contacts of the residues it moves, so its energy is updated from those residues alone.
+Independent chains with their own seeds run on a process pool within a sweep budget, so a run is reproducible for a
+given seed. A time limit can cap the chains as well, at the cost of that reproducibility.
+
+Folds are returned like fold_n paths (start at (0, 0), first step (0, 1), mirror images separately) so they can go
+straight to Shape.from_path / pipeline.native_records. The walk is not confined to the region of fold_n, so at small n the
+results match branch_and_bound_fold(sequence, bounded=False).
+
+usage: python library/heuristic_fold.py PPPHHPPHHPPPPPHHHHHHHPPHHPPPPHHPPHPP --sweeps 5000 --chains 8
+       python library/heuristic_fold.py --check 14
+"""
+import argparse
+import math
+import os, sys
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.native_fold import DIRS, moves_to_path, path_to_moves
+
+# the 7 lattice symmetries other than the identity, as (x, y) -> (a x + b y, c x + d y)
+SYMMETRIES = [(0, -1, 1, 0), (-1, 0, 0, -1), (0, 1, -1, 0), (-1, 0, 0, 1), (1, 0, 0, -1), (0, 1, 1, 0), (0, -1, -1, 0)]
+
+
+def chain_energy(positions, hydrophobic):
+    """Energy of a conformation, -1 per non-bonded H-H contact (same as compute_energy)"""
+    occupied = {position: k for k, position in enumerate(positions)}
+    energy = 0
+    for k, (x, y) in enumerate(positions):
+        if hydrophobic[k]:
+            for dx, dy in DIRS:
+                other = occupied.get((x + dx, y + dy))
+                if other is not None and other > k + 1 and hydrophobic[other]:
+                    energy -= 1
+    return energy
+
+
+def fold_key(positions):
+    """Key of a fold up to rotation and reflection, and its number of fold_n walks (2, or 1 if it is its own mirror)"""
+    moves = path_to_moves(positions)
+    rotated = tuple((move - moves[0]) % 4 for move in moves)
+    mirrored = tuple((4 - move) % 4 for move in rotated)
+    return min(rotated, mirrored), 1 if rotated == mirrored else 2
+
+
+def fold_paths(key):
+    """The fold_n walks of a fold key (the fold and its mirror image)"""
+    mirrored = tuple((4 - move) % 4 for move in key)
+    return [moves_to_path(moves) for moves in sorted({key, mirrored})]
+
+
+class _Conformation:
+    """One replica: positions, the site -> residue map and the energy, changed in place by moves"""
+
+    def __init__(self, positions, hydrophobic):
+        self.positions = list(positions)
+        self.occupied = {position: k for k, position in enumerate(self.positions)}
+        self.hydrophobic = hydrophobic
+        self.energy = chain_energy(self.positions, hydrophobic)
+
+    def _contacts(self, moved):
+        """H-H contacts involving the moved residues, each pair counted once"""
+        count = 0
+        for k in moved:
+            if not self.hydrophobic[k]:
+                continue
+            x, y = self.positions[k]
+            for dx, dy in DIRS:
+                other = self.occupied.get((x + dx, y + dy))
+                if other is not None and abs(other - k) > 1 and self.hydrophobic[other] and (other not in moved or other > k):
+                    count += 1
+        return count
+
+    def apply(self, changes):
+        """Moves residues to new sites (dict residue -> site), returns the energy change and the old sites"""
+        before = self._contacts(changes)
+        old = {k: self.positions[k] for k in changes}
+        for k in changes:
+            del self.occupied[old[k]]
+        for k, site in changes.items():
+            self.positions[k] = site
+            self.occupied[site] = k
+        delta = before - self._contacts(changes)
+        self.energy += delta
+        return delta, old
+
+    def revert(self, old, delta):
+        for k in old:
+            del self.occupied[self.positions[k]]
+        for k, site in old.items():
+            self.positions[k] = site
+            self.occupied[site] = k
+        self.energy -= delta
+
+    def pull_move(self, rng):
+        """Random pull move, returns the changes or None if the drawn move is not possible"""
+        positions, occupied, n = self.positions, self.occupied, len(self.positions)
+        i = rng.randrange(n)
+        step = rng.choice((-1, 1))  # residues i + step, i + 2 step, ... follow
+        anchor = i - step
+        changes = {}
+        if 0 <= anchor < n:
+            # i goes to a free site L next to its anchor and diagonal to it, i + step to the corner C of that square
+            ax, ay = positions[anchor]
+            x, y = positions[i]
+            dx, dy = rng.choice(((ay - y, ax - x), (y - ay, x - ax)))  # the two directions perpendicular to the bond
+            free_l = (ax + dx, ay + dy)
+            corner = (x + dx, y + dy)
+            if free_l in occupied:
+                return None
+            changes[i] = free_l
+            follower = i + step
+            if not 0 <= follower < n or positions[follower] == corner:
+                return changes
+            if corner in occupied:
+                return None
+            changes[follower] = corner
+        else:
+            # an end residue moves two steps away onto free sites, the rest follows
+            x, y = positions[i]
+            dx, dy = rng.choice(DIRS)
+            free_l = (x + dx, y + dy)
+            ex, ey = rng.choice(DIRS)
+            free_c = (free_l[0] + ex, free_l[1] + ey)
+            if free_l in occupied or free_c in occupied or free_c == positions[i]:
+                return None
+            changes[i] = free_c
+            follower = i + step
+            if not 0 <= follower < n:
+                return changes
+            changes[follower] = free_l
+        j = follower + step
+        while 0 <= j < n:
+            px, py = changes[j - step]
+            if abs(positions[j][0] - px) + abs(positions[j][1] - py) == 1:
+                break
+            changes[j] = positions[j - 2 * step]
+            j += step
+        return changes
+
+    def pivot_move(self, rng):
+        """Random pivot move of the shorter end of the chain, returns the changes or None if it collides"""
+        positions, n = self.positions, len(self.positions)
+        k = rng.randrange(1, n - 1)
+        moved = range(0, k) if k < n // 2 else range(k + 1, n)
+        a, b, c, d = rng.choice(SYMMETRIES)
+        px, py = positions[k]
+        changes = {}
+        for m in moved:
+            x, y = positions[m][0] - px, positions[m][1] - py
+            site = (px + a * x + b * y, py + c * x + d * y)
+            other = self.occupied.get(site)
+            if other is not None and other not in moved:
+                return None
+            changes[m] = site
+        return changes
+
+
+def _run_chain(sequence, seed, sweeps, time_limit, n_replicas, t_min, t_max, pivot_rate, target_energy, max_folds):
+    """One replica exchange run. Returns the best energy, the fold keys seen at that energy (with their multiplicity),
+    the time it was first reached and the number of sweeps made"""
+    rng = random.Random(seed)
+    n = len(sequence)
+    hydrophobic = [residue == 'H' for residue in sequence]
+    temperatures = [t_min * (t_max / t_min) ** (r / max(n_replicas - 1, 1)) for r in range(n_replicas)]
+    replicas = [_Conformation([(0, y) for y in range(n)], hydrophobic) for _ in temperatures]  # replicas[r] runs at temperatures[r]
+
+    start = time.time()
+    best_energy = replicas[0].energy
+    best_folds = {}
+    best_time = 0.0
+    sweep = 0
+    while (sweeps is None or sweep < sweeps) and (time_limit is None or time.time() - start < time_limit):
+        sweep += 1
+        for replica, temperature in zip(replicas, temperatures):
+            for _ in range(n):
+                changes = replica.pivot_move(rng) if n > 2 and rng.random() < pivot_rate else replica.pull_move(rng)
+                if not changes:
+                    continue
+                delta, old = replica.apply(changes)
+                if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+                    replica.revert(old, delta)
+                    continue
+                if replica.energy < best_energy:
+                    best_energy, best_folds, best_time = replica.energy, {}, time.time() - start
+                if replica.energy == best_energy and len(best_folds) < max_folds:
+                    key, multiplicity = fold_key(replica.positions)
+                    best_folds[key] = multiplicity
+        if target_energy is not None and best_energy <= target_energy:
+            break
+        # swap neighbouring temperatures
+        for r in range(sweep % 2, n_replicas - 1, 2):
+            exponent = (1 / temperatures[r] - 1 / temperatures[r + 1]) * (replicas[r].energy - replicas[r + 1].energy)
+            if exponent >= 0 or rng.random() < math.exp(exponent):
+                replicas[r], replicas[r + 1] = replicas[r + 1], replicas[r]
+    return best_energy, best_folds, best_time, sweep
+
+
+def heuristic_fold(sequence, chains=8, workers=None, sweeps=2000, time_limit=None, n_replicas=8, t_min=0.15, t_max=1.5,
+                   pivot_rate=0.1, target_energy=None, max_folds=100000, seed=0, pool=None):
+    """Approximate native folds of a sequence.
+
+    :params
+    :str: sequence: HP sequence
+    :int: chains: number of independent replica exchange runs
+    :int: workers: number of processes (defaults to every core), ignored if a pool is given
+    :int: sweeps: number of sweeps (n moves per replica) per chain (None for no limit)
+    :float: time_limit: optional cap in seconds per chain, which makes the result depend on the machine
+    :int: n_replicas: number of temperatures per chain, geometric between t_min and t_max
+    :float: pivot_rate: fraction of pivot moves among the moves
+    :int: target_energy: chains stop as soon as they reach it (e.g. a known ground state energy)
+    :int: seed: seed of the chains, the same seed and sweep budget give the same result
+    :ProcessPoolExecutor: pool: pool to run the chains on
+
+    :returns
+    :dict: energy: best energy found
+           folds: every distinct fold found at that energy, as fold_n paths
+           degeneracy: number of those folds (a lower bound of the degeneracy)
+           estimated_degeneracy: Chao1 estimate from how many chains found each fold
+           time_to_best: earliest time a chain reached the best energy, in seconds
+           chains_at_best: number of chains that reached it
+           sweeps: sweeps made by each chain
+    """
+    args = (sweeps, time_limit, n_replicas, t_min, t_max, pivot_rate, target_energy, max_folds)
+    seeds = [seed * 1000003 + chain for chain in range(chains)]
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as new_pool:
+            results = list(new_pool.map(_run_chain, [sequence] * chains, seeds, *[[arg] * chains for arg in args]))
+    else:
+        results = list(pool.map(_run_chain, [sequence] * chains, seeds, *[[arg] * chains for arg in args]))
+
+    energy = min(result[0] for result in results)
+    at_best = [result for result in results if result[0] == energy]
+    found = {}
+    for _, folds, _, _ in at_best:
+        for key, multiplicity in folds.items():
+            count, _ = found.get(key, (0, multiplicity))
+            found[key] = (count + 1, multiplicity)
+    degeneracy = sum(multiplicity for _, multiplicity in found.values())
+    # Chao1: folds seen by one chain only hint at how many were seen by none
+    singletons = sum(1 for count, _ in found.values() if count == 1)
+    doubletons = sum(1 for count, _ in found.values() if count == 2)
+    unseen = singletons * (singletons - 1) / (2 * (doubletons + 1)) if len(at_best) > 1 else 0.0
+    return {
+        "energy": energy,
+        "folds": sorted(path for key in found for path in fold_paths(key)),
+        "degeneracy": degeneracy,
+        "estimated_degeneracy": degeneracy + unseen * degeneracy / max(len(found), 1),
+        "time_to_best": min(result[2] for result in at_best),
+        "chains_at_best": len(at_best),
+        "sweeps": [result[3] for result in results],
+    }
+
+
+def check_against_exact(n, n_sequences=20, chains=4, sweeps=500, seed=0, pool=None):
+    """Compares heuristic_fold with the exact (unbounded) branch and bound on random sequences of length n: how often the
+    ground state energy is found, how many of the native folds are found, and the time to reach the ground state"""
+    from library.native_fold import branch_and_bound_fold
+    rng = random.Random(seed)
+    sequences = ["".join(rng.choice("HP") for _ in range(n)) for _ in range(n_sequences)]
+    energy_hits, fold_hits, fold_total, exact_time, target_time = 0, 0, 0, 0.0, 0.0
+    for k, sequence in enumerate(sequences):
+        start = time.time()
+        folds, degeneracy, energy, _ = branch_and_bound_fold(sequence, bounded=False)
+        exact_time += time.time() - start
+
+        start = time.time()
+        heuristic_fold(sequence, chains, sweeps=sweeps, target_energy=energy, seed=seed + k, pool=pool)
+        target_time += time.time() - start
+
+        result = heuristic_fold(sequence, chains, sweeps=sweeps, seed=seed + k, pool=pool)
+        exact = sorted(path for _, path in folds)
+        energy_hits += result["energy"] == energy
+        if result["energy"] == energy:
+            assert set(map(tuple, result["folds"])) <= set(map(tuple, exact))
+            fold_hits += result["degeneracy"]
+        fold_total += degeneracy
+    print(f"n={n}: ground state found for {energy_hits}/{n_sequences} sequences, {fold_hits}/{fold_total} native folds found "
+          f"in {sweeps} sweeps x {chains} chains | time to ground state {target_time / n_sequences:.2f}s "
+          f"vs exact search {exact_time / n_sequences:.2f}s per sequence")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximate native folds of HP sequences by replica exchange Monte Carlo")
+    parser.add_argument("sequences", nargs="*", help="HP sequences to fold")
+    parser.add_argument("--sweeps", type=int, default=2000, help="sweeps per chain")
+    parser.add_argument("--time", type=float, default=None, help="optional cap in seconds per chain")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the chains")
+    parser.add_argument("--chains", type=int, default=8, help="number of independent chains")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: every core)")
+    parser.add_argument("--replicas", type=int, default=8, help="temperatures per chain")
+    parser.add_argument("--target", type=int, default=None, help="stop once this energy is reached")
+    parser.add_argument("--check", type=int, nargs="*", help="compare with exact search on random sequences of these lengths")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for n in args.check or []:
+            check_against_exact(n, chains=args.chains, sweeps=args.sweeps, seed=args.seed, pool=pool)
+        for sequence in args.sequences:
+            result = heuristic_fold(sequence, args.chains, sweeps=args.sweeps, time_limit=args.time, n_replicas=args.replicas,
+                                    target_energy=args.target, seed=args.seed, pool=pool)
+            print(f"{sequence} (n={len(sequence)}): energy {result['energy']}, {result['degeneracy']} folds found "
+                  f"(~{result['estimated_degeneracy']:.0f} estimated), first reached after {result['time_to_best']:.2f}s "
+                  f"by {result['chains_at_best']}/{args.chains} chains, {sum(result['sweeps'])} sweeps")
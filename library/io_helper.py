@@ -0,0 +1,31 @@
+"""
+Reading large data files without loading them whole.
+"""
+import json
+import re
+
+_WHITESPACE = re.compile(r"[\s,]*")
+
+
+def iter_json_array(path, chunk_size=1 << 20):
+    """Yields the objects of a json file holding one array of objects, reading chunk_size characters at a time
+    instead of loading the whole file"""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} does not hold a json array")
+        pos = 1
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield item
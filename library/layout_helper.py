@@ -0,0 +1,152 @@
+"""
+Provides precomputed, cached node positions for the co-mapping graphs so the app never runs a layout on a request.
+Layouts are computed with igraph's weighted Fruchterman-Reingold (grid accelerated on large graphs, higher weights pull shapes
+closer), seeded so they are reproducible, and stored next to the graph cache keyed by the graph's content hash.
+When the graph changes, the previous positions are used as a warm start.
+Layouts are precomputed by running this file and by graph_logic.update_network_graph. On a cache miss in the app, the
+layout is computed in a background process and placeholder positions are returned in the meantime.
+
+usage: python library/layout_helper.py 8 9 10 11
+"""
+import os, sys
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import igraph as ig
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.cache_helper import load_graph, load_layout, save_layout, clear_stale
+from library.graph_helper import graph_hash
+
+LAYOUT_SEED = 0
+
+_pool = None
+_jobs = {}  # n -> (graph hash, future) of the layout being computed in the background
+_rng_lock = threading.Lock()
+
+
+def initial_positions(count):
+    """Seeded random starting positions for a layout from scratch"""
+    return np.random.default_rng(LAYOUT_SEED).uniform(-1, 1, (count, 2))
+
+
+def compute_layout(graph, initial=None, niter=500, start_temp=None):
+    """Weighted Fruchterman-Reingold layout of a graph given as arrays
+
+    :params
+    :tuple: graph: nodes, source, target, weight
+    :np.array: initial: optional (nodes, 2) starting positions, random (seeded) if None
+    :int: niter: number of iterations
+    :float: start_temp: largest move per iteration at the start, igraph's default if None
+
+    :returns
+    :np.array: (nodes, 2) positions
+    """
+    nodes, source, target, weight = graph
+    if len(nodes) == 0:
+        return np.empty((0, 2))
+    if initial is None:
+        initial = initial_positions(len(nodes))
+    g = ig.Graph(n=len(nodes), edges=np.column_stack([source, target]).tolist())
+    options = {} if start_temp is None else {"start_temp": start_temp}
+    # igraph draws from python's random module unless given another generator: use a seeded one of our own, so the
+    # global random state of the app is left alone
+    with _rng_lock:
+        ig.set_random_number_generator(random.Random(LAYOUT_SEED))
+        try:
+            layout = g.layout_fruchterman_reingold(weights=weight.tolist(), seed=initial.tolist(), niter=niter,
+                                                   grid="auto", **options)
+        finally:
+            ig.set_random_number_generator(random)
+    return np.array(layout.coords)
+
+
+def warm_start_positions(graph, old_nodes, old_xy):
+    """Starting positions for a graph from the layout of a previous version of it: known nodes keep their position,
+    new nodes start at the mean position of their already placed neighbours (or at a random spot in the old layout)"""
+    nodes, source, target, _ = graph
+    old_index = {node: i for i, node in enumerate(old_nodes)}
+    rng = np.random.default_rng(LAYOUT_SEED)
+    xy = np.empty((len(nodes), 2))
+    placed = np.zeros(len(nodes), dtype=bool)
+    for i, node in enumerate(nodes):
+        if node in old_index:
+            xy[i] = old_xy[old_index[node]]
+            placed[i] = True
+
+    lower, upper = (old_xy.min(axis=0), old_xy.max(axis=0)) if len(old_xy) else (np.full(2, -1.0), np.full(2, 1.0))
+    sums = np.zeros((len(nodes), 2))
+    counts = np.zeros(len(nodes))
+    for a, b in ((source, target), (target, source)):
+        known = placed[b]
+        np.add.at(sums, a[known], xy[b[known]])
+        np.add.at(counts, a[known], 1)
+    new = ~placed
+    has_neighbours = new & (counts > 0)
+    xy[has_neighbours] = sums[has_neighbours] / counts[has_neighbours, None]
+    lonely = new & (counts == 0)
+    xy[lonely] = rng.uniform(lower, upper, (int(lonely.sum()), 2))
+    xy[new] += rng.normal(0, 0.01 * (np.max(upper - lower) or 1), (int(new.sum()), 2))
+    return xy
+
+
+def _compute_and_save(n, graph, key, initial=None, niter=500, start_temp=None):
+    """Computes the layout of a graph and caches it (run in the background by get_layout)"""
+    xy = compute_layout(graph, initial, niter, start_temp)
+    save_layout(graph[0], xy, key, n)
+    clear_stale(n, "layout")
+    return xy
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=1)
+    return _pool
+
+
+def get_layout(n, graph=None, wait=False):
+    """Node positions for the graph at n, in the graph's node order. Uses the cached layout when it was computed on this
+    exact graph. Otherwise the layout is computed (warm started from the cached one if there is one) and cached.
+
+    :params
+    :int: n: the length of the sequences
+    :tuple: graph: nodes, source, target, weight, loaded from the cache if None
+    :bool: wait: if True, computes a missing layout before returning (for precomputing). If False, a missing layout is
+        computed in a background process and placeholder positions are returned right away: the previous layout carried
+        over to the new graph (see warm_start_positions), or the seeded starting positions if there is none
+
+    :returns
+    :np.array: (nodes, 2) positions
+    """
+    if graph is None:
+        graph = load_graph(n)
+    key = graph_hash(*graph)
+    cached = load_layout(n)
+    if cached is not None and cached[2] == key:
+        return cached[1]
+
+    if cached is None:
+        initial, options = initial_positions(len(graph[0])), {}
+    else:
+        initial, options = warm_start_positions(graph, cached[0], cached[1]), {"niter": 100, "start_temp": 0.1}
+    if wait:
+        return _compute_and_save(n, graph, key, initial, **options)
+
+    job = _jobs.get(n)
+    if job is None or job[0] != key or job[1].done():
+        _jobs[n] = (key, _get_pool().submit(_compute_and_save, n, graph, key, initial, **options))
+    return initial
+
+
+if __name__ == "__main__":
+    import time
+    for n in [int(arg) for arg in sys.argv[1:]] or range(8, 15):
+        graph = load_graph(n)
+        if graph is None:
+            continue
+        start = time.time()
+        get_layout(n, graph, wait=True)
+        print(f"n={n}: layout for {len(graph[0])} nodes in {time.time() - start:.2f}s")
@@ -5,20 +5,232 @@ import heapq
 from math import ceil
 import json
 import matplotlib.pyplot as plt
+import numpy as np
+from scipy import sparse
 
 # Brute Force Folding Functions
 
+DIRS = [(0, 1), (1, 0), (0, -1), (-1, 0)]  # move codes 0..3, 2 bits per step when packed
+
+
+def _allowed_cells(n):
+    """Returns the set of lattice cells a walk of length n is allowed to visit.
+    Same bounding heuristic as the original recursive fold_n so the set of folds is unchanged.
+    The region is symmetric under x -> -x which is what makes the mirror reduction exact.
+    """
+    cap_x = ceil(n / 2) - 1
+    allowed = set()
+    for x in range(-cap_x, cap_x + 1):
+        cap_y = ceil((n / (abs(x) + 1)) - 1) if abs(x) > 0 else cap_x
+        for y in range(-cap_y, cap_y + 1):
+            allowed.add((x, y))
+    return allowed
+
+
+def iter_walks(n, packed=False):
+    """Iteratively enumerates the canonical self-avoiding walks of length n starting at (0, 0).
+
+    The 8 lattice symmetries are removed: the first step is fixed to (0, 1) (rotations) and the
+    first step off the y axis must go to +x (reflection). Every canonical walk stands for itself
+    and its mirror image, see walk_multiplicity and mirror_path.
+
+    :params
+    n: the length of the path to be generated
+    packed: if True, yields each walk as an int of 2-bit move codes (see pack_moves) instead of a list of tuples
+
+    :returns
+    generator over canonical walks
+    """
+    if n < 1:
+        return
+    if n == 1:
+        yield 0 if packed else [(0, 0)]
+        return
+
+    allowed = _allowed_cells(n)
+    path = [(0, 0), (0, 1)]
+    visited = {(0, 0), (0, 1)}
+    codes = [0, 0]  # codes[k] is the packed code of the first k-1 moves
+    stack = [0]  # next direction to try from the tip, one entry per open node
+
+    while stack:
+        if len(path) == n:
+            yield codes[-1] if packed else list(path)
+            visited.remove(path.pop())
+            codes.pop()
+            stack.pop()
+            continue
+
+        d = stack[-1]
+        if d == 4:
+            stack.pop()
+            if len(path) > 2:
+                visited.remove(path.pop())
+                codes.pop()
+            continue
+        stack[-1] = d + 1
+
+        x, y = path[-1]
+        # still on the straight start along the y axis: only turn towards +x
+        if d == 3 and x == 0 and y == len(path) - 1:
+            continue
+        new = (x + DIRS[d][0], y + DIRS[d][1])
+        if new in allowed and new not in visited:
+            visited.add(new)
+            codes.append(codes[-1] | (d << (2 * (len(path) - 1))))
+            path.append(new)
+            stack.append(0)
+
+
+def iter_walk_chunks(n, chunk_size=100000, packed=False):
+    """Same as iter_walks but yields lists of at most chunk_size canonical walks"""
+    chunk = []
+    for walk in iter_walks(n, packed=packed):
+        chunk.append(walk)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def pack_moves(moves):
+    """Packs a list of move codes (indices into DIRS) into an int, 2 bits per step, first move in the lowest bits"""
+    code = 0
+    for i, move in enumerate(moves):
+        code |= move << (2 * i)
+    return code
+
+
+def unpack_moves(code, n):
+    """Inverse of pack_moves for a walk of length n (n - 1 moves)"""
+    return [(code >> (2 * i)) & 3 for i in range(n - 1)]
+
+
+def moves_to_bytes(code, n):
+    """Fixed-width little endian bytes for a packed walk of length n"""
+    return code.to_bytes(ceil(2 * (n - 1) / 8), "little")
+
+
+def bytes_to_moves(data):
+    """Inverse of moves_to_bytes, returns the packed int"""
+    return int.from_bytes(data, "little")
+
+
+def moves_to_coords(moves):
+    """Vectorized moves_to_path: (walks, n - 1) move codes to a (walks, n, 2) int8 coordinate array starting at (0, 0)"""
+    moves = np.asarray(moves, dtype=np.uint8)
+    coords = np.zeros((moves.shape[0], moves.shape[1] + 1, 2), dtype=np.int8)
+    np.cumsum(np.asarray(DIRS, dtype=np.int8)[moves], axis=1, out=coords[:, 1:])
+    return coords
+
+
+def coords_to_moves(coords):
+    """Vectorized path_to_moves: (walks, n, 2) coordinates to (walks, n - 1) uint8 move codes"""
+    steps = np.diff(np.asarray(coords, dtype=np.int8), axis=1)
+    # (0, 1) -> 0, (1, 0) -> 1, (0, -1) -> 2, (-1, 0) -> 3
+    return np.where(steps[..., 0] == 0, 1 - steps[..., 1], 2 - steps[..., 0]).astype(np.uint8)
+
+
+def pack_move_rows(moves):
+    """Packs (walks, n - 1) move codes into fixed-width rows of bytes, 4 moves per byte, first move in the lowest bits
+    (the same layout as moves_to_bytes)"""
+    moves = np.asarray(moves, dtype=np.uint8)
+    padded = np.zeros((moves.shape[0], -(-moves.shape[1] // 4) * 4), dtype=np.uint8)
+    padded[:, :moves.shape[1]] = moves
+    quads = padded.reshape(len(padded), -1, 4)
+    return quads[..., 0] | quads[..., 1] << 2 | quads[..., 2] << 4 | quads[..., 3] << 6
+
+
+def unpack_move_rows(rows, n):
+    """Inverse of pack_move_rows for walks of length n, returns (walks, n - 1) uint8 move codes"""
+    rows = np.asarray(rows, dtype=np.uint8)
+    moves = (rows[:, :, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+    return moves.reshape(len(rows), -1)[:, :n - 1]
+
+
+def moves_to_path(moves):
+    """Turns a list of move codes into a path of tuples starting at (0, 0)"""
+    x, y = 0, 0
+    path = [(0, 0)]
+    for move in moves:
+        x += DIRS[move][0]
+        y += DIRS[move][1]
+        path.append((x, y))
+    return path
+
+
+def path_to_moves(path):
+    """Turns a path of tuples into its list of move codes"""
+    return [DIRS.index((b[0] - a[0], b[1] - a[1])) for a, b in zip(path, path[1:])]
+
+
+def mirror_path(path):
+    """Reflects a path across the y axis"""
+    return [(-x, y) for x, y in path]
+
+
+def walk_multiplicity(path):
+    """Number of walks (out of the original fold_n set) a canonical walk stands for: 2, or 1 if it is its own mirror"""
+    return 1 if all(x == 0 for x, _ in path) else 2
+
+
 def fold_n(n):
-    """Exhaustively enumerates all possible paths of length n  starting at (0, 0)
-    
+    """Exhaustively enumerates all possible paths of length n  starting at (0, 0) with a first step of (0, 1)
+    Canonical walks (same search as iter_walks) are expanded with their mirror image, which is grown alongside the walk.
+
     :params
     n: the length of the path to be generated
 
     :returns
     paths: a list of all possible paths of length n
     """
+    if n < 3:
+        return [list(path) for path in iter_walks(n)]
 
-    dirs = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+    # same search as iter_walks, but the mirror image is grown alongside and the last step is expanded in place
+    allowed = _allowed_cells(n)
+    steps = {(x, y): [(x + dx, y + dy) for dx, dy in DIRS if (x + dx, y + dy) in allowed] for x, y in allowed}
+    straight_steps = {cell: [new for new in steps[cell] if new[0] >= 0] for cell in steps if cell[0] == 0}
+    path = [(0, 0), (0, 1)]
+    mirror = [(0, 0), (0, 1)]
+    visited = {(0, 0), (0, 1)}
+    stack = [iter(straight_steps[(0, 1)])]
+    paths = []
+
+    while stack:
+        new = next(stack[-1], None)
+        if new is None:
+            stack.pop()
+            if len(path) > 2:
+                visited.remove(path.pop())
+                mirror.pop()
+            continue
+        if new in visited:
+            continue
+        if len(path) == n - 1:
+            paths.append(path + [new])
+            if new[0] or path[-1] != (0, len(path) - 1):  # only the straight walk is its own mirror
+                paths.append(mirror + [(-new[0], new[1])])
+            continue
+        visited.add(new)
+        path.append(new)
+        mirror.append((-new[0], new[1]))
+        stack.append(iter(straight_steps[new] if new == (0, len(path) - 1) else steps[new]))
+    return paths
+
+
+def fold_n_recursive(n):
+    """Original recursive enumerator, kept as a reference for fold_n.
+
+    :params
+    n: the length of the path to be generated
+
+    :returns
+    paths: a list of all possible paths of length n
+    """
+
+    dirs = DIRS
     paths = []  # new paths to be generated
     cap_x = ceil(n / 2) - 1
 
@@ -120,14 +332,313 @@ def native_fold(heap, return_energy=False):
     return folds, len(folds)
 
 
+# ========================= Branch and Bound Search =========================
+def _remaining_contact_bound(sequence):
+    """bound[d] is an upper bound on the H-H contacts formed by placing residues d..n-1.
+    A contact (i, j) with i < j is counted when j is placed: j can touch at most 2 earlier residues (3 if it is the last one)
+    and only Hs of the other parity that are at least 3 residues before it.
+    """
+    n = len(sequence)
+    bound = [0] * (n + 1)
+    for j in range(n - 1, -1, -1):
+        gain = 0
+        if sequence[j] == 'H':
+            partners = sum(1 for i in range(j - 2) if sequence[i] == 'H' and (j - i) % 2 == 1)
+            gain = min(3 if j == n - 1 else 2, partners)
+        bound[j] = bound[j + 1] + gain
+    return bound
+
+
+def branch_and_bound_fold(sequence, bounded=True):
+    """Exact native fold search for a single sequence without enumerating every walk.
+    Canonical walks (see iter_walks) are grown depth first while keeping the energy so far, and a branch is cut as soon as
+    even the best case for the remaining residues cannot reach the best energy found. Ties are kept so the degeneracy is exact.
+        H-H bond = -1
+        P-P bond = 0
+
+    :param sequence: the sequence to be folded
+    :param bounded: if True, walks stay in the same region as fold_n so results match the brute force ones
+    :return: list of native folds as (energy, path), degeneracy, energy, number of nodes expanded
+    """
+    n = len(sequence)
+    if n < 3:
+        folds = [(0, path) for path in fold_n(n)]
+        return folds, len(folds), 0, len(folds)
+
+    allowed = _allowed_cells(n) if bounded else None
+    bound = _remaining_contact_bound(sequence)
+    path = [(0, 0), (0, 1)]
+    occupied = {(0, 0): 0, (0, 1): 1}
+    energies = [0]  # energy of the chain built so far, one entry per open node
+    stack = [0]
+    best_energy = 0
+    best_paths = []
+    nodes = 0
+
+    while stack:
+        if len(path) == n:
+            if energies[-1] < best_energy:
+                best_energy = energies[-1]
+                best_paths = []
+            best_paths.append(list(path))
+            del occupied[path.pop()]
+            energies.pop()
+            stack.pop()
+            continue
+
+        d = stack[-1]
+        if d == 4:
+            stack.pop()
+            energies.pop()
+            if len(path) > 2:
+                del occupied[path.pop()]
+            continue
+        stack[-1] = d + 1
+
+        x, y = path[-1]
+        if d == 3 and x == 0 and y == len(path) - 1:
+            continue
+        new = (x + DIRS[d][0], y + DIRS[d][1])
+        if new in occupied or (bounded and new not in allowed):
+            continue
+
+        j = len(path)
+        energy = energies[-1]
+        if sequence[j] == 'H':
+            for dx, dy in DIRS:
+                i = occupied.get((new[0] + dx, new[1] + dy))
+                if i is not None and i < j - 1 and sequence[i] == 'H':
+                    energy -= 1
+        if energy - bound[j + 1] > best_energy:
+            continue
+
+        nodes += 1
+        occupied[new] = j
+        path.append(new)
+        energies.append(energy)
+        stack.append(0)
+
+    folds = []
+    for native in best_paths:
+        folds.append((best_energy, native))
+        if walk_multiplicity(native) == 2:
+            folds.append((best_energy, mirror_path(native)))
+    folds.sort()
+    return folds, len(folds), best_energy, nodes
+
+
+def branch_and_bound_batch(sequences, bounded=True):
+    """Runs branch_and_bound_fold on a small batch of sequences, returns a list of its results"""
+    return [branch_and_bound_fold(sequence, bounded=bounded) for sequence in sequences]
+
+
+# ========================= Batched Energy Kernel =========================
+def paths_to_array(paths):
+    """Stacks a list of paths (lists of tuples) of equal length into a (paths, n, 2) int8 coordinate array"""
+    return np.asarray(paths, dtype=np.int8).reshape(len(paths), -1, 2)
+
+
+def sequences_to_array(sequences):
+    """Turns a list of HP strings into a (sequences, n) uint8 array with H = 1 and P = 0"""
+    return (np.array([list(seq) for seq in sequences]) == 'H').astype(np.uint8)
+
+
+def contact_pairs(n):
+    """Residue pairs (i, j) that can form a non-bonded contact on the square lattice: j - i odd and at least 3"""
+    i, j = np.triu_indices(n, k=3)
+    keep = (j - i) % 2 == 1
+    return i[keep], j[keep]
+
+
+def contact_matrix(coords):
+    """Precomputes the non-bonded contacts of every path once.
+
+    :param coords: (paths, n, 2) coordinate array (see paths_to_array)
+    :return: sparse (paths, pairs) int8 matrix with a 1 where the pair from contact_pairs is in contact
+    """
+    i, j = contact_pairs(coords.shape[1])
+    dist = np.abs(coords[:, i].astype(np.int16) - coords[:, j]).sum(axis=2)
+    return sparse.csr_matrix((dist == 1).astype(np.int8))
+
+
+def batch_energy(contacts, sequences):
+    """Energy of every sequence in every path as a single sparse matrix product.
+        H-H bond = -1
+        P-P bond = 0
+
+    :param contacts: sparse (paths, pairs) matrix from contact_matrix
+    :param sequences: (sequences, n) uint8 array from sequences_to_array
+    :return: (paths, sequences) int8 array of energies
+    """
+    i, j = contact_pairs(sequences.shape[1])
+    hh_pairs = (sequences[:, i] & sequences[:, j]).astype(np.int8)
+    return -(contacts @ hh_pairs.T)
+
+
+def batch_native_fold(coords, sequences, block_size=256, multiplicity=None, contacts=None):
+    """Scores a whole set of sequences against every path, block by block, and keeps only the native folds.
+    Gives the same energy, degeneracy and native paths as compute_energy + native_fold for each sequence.
+
+    :param coords: (paths, n, 2) coordinate array (see paths_to_array)
+    :param sequences: list of HP strings or (sequences, n) uint8 array
+    :param block_size: number of sequences scored per matrix product
+    :param multiplicity: optional per path weight (e.g. walk_multiplicity for canonical walks) summed into the degeneracy
+    :param contacts: optional precomputed contact_matrix(coords)
+    :return: energies (sequences,), degeneracies (sequences,), list of native path index arrays
+    """
+    if not isinstance(sequences, np.ndarray):
+        sequences = sequences_to_array(sequences)
+    if contacts is None:
+        contacts = contact_matrix(coords)
+
+    energies = np.empty(len(sequences), dtype=np.int64)
+    degeneracies = np.empty(len(sequences), dtype=np.int64)
+    native_indices = []
+    for start in range(0, len(sequences), block_size):
+        block = batch_energy(contacts, sequences[start:start + block_size])
+        block_min = block.min(axis=0)
+        is_native = block == block_min
+        energies[start:start + block_size] = block_min
+        if multiplicity is None:
+            degeneracies[start:start + block_size] = is_native.sum(axis=0)
+        else:
+            degeneracies[start:start + block_size] = multiplicity @ is_native
+        native_indices.extend(np.flatnonzero(is_native[:, k]) for k in range(is_native.shape[1]))
+
+    return energies, degeneracies, native_indices
+
+
+# ========================= Contact Map Reduction =========================
+def reduce_contact_maps(contacts, multiplicity=None, block_size=4096):
+    """Groups walks by contact map and finds the maps that are not contained in another one.
+    The energy of a walk only depends on its contact set, and a map whose contacts are a subset of another's can never be
+    strictly lower, so the minimum energy of any sequence is always reached on a maximal map.
+
+    :param contacts: sparse (paths, pairs) matrix from contact_matrix
+    :param multiplicity: optional per path weight, as in batch_native_fold
+    :param block_size: number of paths densified at a time
+    :return: dict with
+        maps: sparse (maps, pairs) int8 matrix of the distinct contact maps, largest first
+        walk_map: (paths,) map index of every path
+        walks: (paths,) path indices grouped by map, map k owns walks[offsets[k]:offsets[k + 1]]
+        offsets: (maps + 1,) offsets into walks
+        multiplicity: (maps,) summed path multiplicity of every map
+        maximal: (maximal maps,) indices of the maps that are not a subset of another map
+        parent: (maps,) for every other map, the index of a maximal map containing it (-1 for maximal maps)
+    """
+    n_paths, n_pairs = contacts.shape
+    packed = np.concatenate([np.packbits(contacts[start:start + block_size].toarray().astype(bool), axis=1)
+                             for start in range(0, n_paths, block_size)]) if n_paths else np.zeros((0, 1), np.uint8)
+    unique, walk_map = np.unique(packed, axis=0, return_inverse=True)
+    walk_map = walk_map.ravel()
+    dense = np.unpackbits(unique, axis=1)[:, :n_pairs]
+
+    # largest maps first, so the supersets of a map are always before it
+    sizes = dense.sum(axis=1, dtype=np.int64)
+    order = np.argsort(-sizes, kind="stable")
+    dense, sizes = dense[order], sizes[order]
+    walk_map = np.argsort(order)[walk_map]
+    maps = sparse.csr_matrix(dense.astype(np.int8))
+
+    n_maps = len(sizes)
+    parent = np.full(n_maps, -1, dtype=np.int64)
+    wide = maps.astype(np.int32)
+    rows = max(1, 2 ** 24 // max(n_maps, 1))
+    for start in range(0, n_maps, rows):
+        stop = min(start + rows, n_maps)
+        # candidates are the maps strictly larger than the smallest one of the block
+        end = np.searchsorted(-sizes, -sizes[stop - 1], side="left")
+        if end == 0:
+            continue
+        overlap = (wide[start:stop] @ wide[:end].T).toarray()
+        block_sizes = sizes[start:stop, None]
+        superset = (overlap == block_sizes) & (sizes[None, :end] > block_sizes)
+        # the largest superset of a map is itself maximal
+        has_parent = superset.any(axis=1)
+        parent[start:stop][has_parent] = superset[has_parent].argmax(axis=1)
+
+    walks = np.argsort(walk_map, kind="stable")
+    offsets = np.searchsorted(walk_map[walks], np.arange(n_maps + 1))
+    weights = np.ones(n_paths, dtype=np.int64) if multiplicity is None else np.asarray(multiplicity, dtype=np.int64)
+    return {
+        "maps": maps,
+        "walk_map": walk_map,
+        "walks": walks,
+        "offsets": offsets,
+        "multiplicity": np.bincount(walk_map, weights=weights, minlength=n_maps).astype(np.int64),
+        "maximal": np.flatnonzero(parent == -1),
+        "parent": parent,
+    }
+
+
+def reduced_native_fold(reduction, sequences, block_size=256):
+    """Same results as batch_native_fold, scoring sequences against the maximal contact maps only.
+    A map contained in a maximal one can only tie it, so it is scored only for the sequences its maximal map is native for.
+
+    :param reduction: output of reduce_contact_maps
+    :param sequences: list of HP strings or (sequences, n) uint8 array
+    :param block_size: number of sequences scored per matrix product
+    :return: energies (sequences,), degeneracies (sequences,), list of native path index arrays
+    """
+    if not isinstance(sequences, np.ndarray):
+        sequences = sequences_to_array(sequences)
+    maps, maximal, parent = reduction["maps"], reduction["maximal"], reduction["parent"]
+    walks, offsets = reduction["walks"], reduction["offsets"]
+    maximal_maps = maps[maximal]
+    dense_maps = maps.toarray().astype(bool)
+    children = np.flatnonzero(parent >= 0)
+    position = np.full(len(parent), -1, dtype=np.int64)
+    position[maximal] = np.arange(len(maximal))
+    child_parent = position[parent[children]]  # row of the parent of every child in the maximal block energies
+
+    i, j = contact_pairs(sequences.shape[1])
+    energies = np.empty(len(sequences), dtype=np.int64)
+    degeneracies = np.empty(len(sequences), dtype=np.int64)
+    native_indices = []
+    for start in range(0, len(sequences), block_size):
+        block = sequences[start:start + block_size]
+        hh_pairs = (block[:, i] & block[:, j]).astype(bool)
+        block_energy = -(maximal_maps @ hh_pairs.T.astype(np.int8))
+        block_min = block_energy.min(axis=0)
+        energies[start:start + len(block)] = block_min
+
+        maximal_native = block_energy == block_min
+        # children of native maximal maps that reach the same energy
+        child, k = np.nonzero(maximal_native[child_parent])
+        tied = (dense_maps[children[child]] & hh_pairs[k]).sum(axis=1) == -block_min[k]
+        native = np.zeros((len(block), len(parent)), dtype=bool)  # sequence major, rows are read one by one below
+        native[:, maximal] = maximal_native.T
+        native[k[tied], children[child[tied]]] = True
+
+        degeneracies[start:start + len(block)] = native @ reduction["multiplicity"]
+        for k in range(len(block)):
+            # walks of the native maps, gathered from their slices of walks
+            native_maps = np.flatnonzero(native[k])
+            first = offsets[native_maps]
+            lengths = offsets[native_maps + 1] - first
+            gather = np.repeat(first - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            native_indices.append(np.sort(walks[gather]))
+
+    return energies, degeneracies, native_indices
+
+
+def reduction_report(n, reduction, n_sequences):
+    """Work done by reduced_native_fold compared to batch_native_fold for one n, as a printable line"""
+    n_walks, n_maps, n_maximal = len(reduction["walk_map"]), reduction["maps"].shape[0], len(reduction["maximal"])
+    return (f"n={n}: {n_walks} walks -> {n_maps} contact maps -> {n_maximal} maximal maps "
+            f"({n_walks / max(n_maximal, 1):.1f}x fewer products for {n_sequences} sequences)")
+
+
 # ========================= Executing and Saving Folds =========================
 def execute_and_save_native_fold(n):
+    """Old json fold dump, see fold_store.save_folds for the binary store that replaces it"""
     fold = fold_n(n)
     # save the fold as a json file
     with open(f"data/folds/fold_{n}.json", "w") as f:
         json.dump(fold, f)
     
 def read_fold_from_json(n):
+    """Reads an old json fold dump, fold_store.read_folds returns the same list from the binary store"""
     with open(f"data/folds/fold_{n}.json", "r") as f:
         fold = json.load(f)
     
@@ -139,3 +650,67 @@ def read_fold_from_json(n):
 
 
 
+if __name__ == "__main__":
+    # benchmark the iterative enumerator against the original recursive one
+    import time
+    for n in range(12, 19):
+        start = time.time()
+        count = sum(1 for _ in iter_walks(n, packed=True))
+        packed_time = time.time() - start
+
+        start = time.time()
+        count_paths = sum(walk_multiplicity(path) for path in iter_walks(n))
+        path_time = time.time() - start
+
+        start = time.time()
+        count_fold = len(fold_n(n))
+        fold_time = time.time() - start
+
+        start = time.time()
+        count_rec = len(fold_n_recursive(n))
+        rec_time = time.time() - start
+
+        assert count_paths == count_fold == count_rec
+        print(f"n={n}: {count} canonical walks ({count_rec} total) | packed {packed_time:.2f}s | tuples {path_time:.2f}s | "
+              f"fold_n {fold_time:.2f}s | recursive {rec_time:.2f}s")
+
+    # check the batched energy kernel against compute_energy + native_fold
+    from permutations_helper import perm_gen
+    for n in range(8, 12):
+        paths = fold_n(n)
+        sequences = perm_gen(n)
+
+        start = time.time()
+        expected = [native_fold(compute_energy(paths, seq), return_energy=True) for seq in sequences]
+        loop_time = time.time() - start
+
+        start = time.time()
+        energies, degeneracies, native_indices = batch_native_fold(paths_to_array(paths), sequences)
+        batch_time = time.time() - start
+
+        for (folds, degeneracy, energy), e, d, idx in zip(expected, energies, degeneracies, native_indices):
+            assert (energy, degeneracy) == (e, d)
+            assert sorted(path for _, path in folds) == sorted(paths[k] for k in idx)
+        print(f"n={n}: {len(sequences)} sequences | loop {loop_time:.2f}s | batched {batch_time:.2f}s")
+
+    # check the contact map reduction against the batched brute force, on every sequence
+    for n in range(4, 15):
+        coords = paths_to_array(list(iter_walks(n)))
+        multiplicity = np.where(coords[:, :, 0].any(axis=1), 2, 1)
+        contacts = contact_matrix(coords)
+        sequences = perm_gen(n)
+
+        start = time.time()
+        expected = batch_native_fold(coords, sequences, multiplicity=multiplicity, contacts=contacts)
+        batch_time = time.time() - start
+
+        start = time.time()
+        reduction = reduce_contact_maps(contacts, multiplicity)
+        reduce_time = time.time() - start
+        start = time.time()
+        energies, degeneracies, native_indices = reduced_native_fold(reduction, sequences)
+        reduced_time = time.time() - start
+
+        assert (energies == expected[0]).all() and (degeneracies == expected[1]).all()
+        assert all(np.array_equal(a, b) for a, b in zip(native_indices, expected[2]))
+        print(f"{reduction_report(n, reduction, len(sequences))} | batched {batch_time:.2f}s | reduction {reduce_time:.2f}s + {reduced_time:.2f}s")
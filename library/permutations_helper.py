@@ -1,10 +1,12 @@
 """
-Defines toolset to generate sequence permutations - for now it is a naive implementation that is in need of optimisation.
+Defines toolset to generate sequence permutations. Sequences are handled as n bit integers (bit n-1 is the first residue, 1 = H)
+and filtered in NumPy blocks so the 2^n space can be streamed without holding every string in memory.
 """
 
 import time
 from itertools import permutations
 import sys, os
+import numpy as np
 
 # Set current working directory to be 3 levels above the current file
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # THIS WILL BREAK IF YOU MOVE FILES AROUND
@@ -14,6 +16,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  #
 def perm_gen(length=1, base=2):
     """Function that returns a list of all the possible permutations for a given sequence length and a given
     number of possible units. HP lattice by default"""
+    if base == 2:
+        return list(iter_sequences(length))
 
     # Generate a list of all binary sequences of length n
     initial_chain = []
@@ -77,9 +81,97 @@ def conv_to_lattice_degen(int_chain):
     return formatted_chain
 
 
+# ========================= Streaming Sequence Generation =========================
+def _popcount(x):
+    """Vectorized popcount of a uint64 array"""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def _reverse_bits(x, n):
+    """Reverses the n low bits of every element of a uint64 array"""
+    rev = np.zeros_like(x)
+    for k in range(n):
+        rev |= ((x >> np.uint64(k)) & np.uint64(1)) << np.uint64(n - 1 - k)
+    return rev
+
+
+def filter_block(start, stop, n, skip_reversed=False):
+    """Bit-level version of the conv_to_lattice_degen filter over the integers in [start, stop).
+
+    :params
+    :int: start, stop: the integer range to filter
+    :int: n: the length of the sequences
+    :bool: skip_reversed: if True, only keeps the smaller of a sequence and its reverse
+
+    :returns
+    :np.array: uint64 array of the integers that pass the filter
+    """
+    x = np.arange(start, stop, dtype=np.uint64)
+    # string position i is bit n-1-i, so even positions are the bits with the same parity as n-1
+    even_mask = np.uint64(sum(1 << (n - 1 - i) for i in range(0, n, 2)))
+    total = _popcount(x)
+    even_length = _popcount(x & even_mask)
+    odd_length = total - even_length
+
+    threshold = 0.9
+    keep = ((1 - threshold) * n < total) & (total < threshold * n)
+    keep &= (even_length > 0) & (odd_length > 0)
+    # 3 Hs must not be 3 neighbours in a row
+    one, two = np.uint64(1), np.uint64(2)
+    keep &= ~((total == 3) & ((x & (x >> one) & (x >> two)) != 0))
+    if skip_reversed:
+        keep &= x <= _reverse_bits(x, n)
+    return x[keep]
+
+
+def ints_to_sequences(ints, n):
+    """Turns an array of n bit integers into HP strings"""
+    shifts = np.arange(n - 1, -1, -1, dtype=np.uint64)
+    bits = (np.asarray(ints, dtype=np.uint64)[:, None] >> shifts) & np.uint64(1)
+    chars = np.where(bits == 1, ord('H'), ord('P')).astype(np.uint8)
+    return [seq.decode() for seq in np.ascontiguousarray(chars).view(f'S{n}').ravel()]
+
+
+def sequence_to_int(sequence):
+    """Inverse of ints_to_sequences for a single sequence"""
+    return int(sequence.replace('P', '0').replace('H', '1'), 2)
+
+
+def sequence_ranges(n, range_size):
+    """Yields (start, stop) integer ranges covering the 2^n sequence space, for workers to pick up"""
+    total = 2 ** n
+    for start in range(0, total, range_size):
+        yield start, min(start + range_size, total)
+
+
+def iter_sequences(n, start=0, stop=None, as_int=False, skip_reversed=False, block_size=1 << 16):
+    """Lazily yields the non degenerate sequences of length n, in the same order as perm_gen.
+    Memory use is bounded by block_size whatever n is.
+
+    :params
+    :int: n: the length of the sequences
+    :int: start, stop: only yield sequences whose integer is in [start, stop), the whole space by default
+    :bool: as_int: if True, yields the integers instead of HP strings
+    :bool: skip_reversed: if True, a sequence and its reverse are only yielded once
+    :int: block_size: number of integers filtered at a time
+    """
+    stop = 2 ** n if stop is None else min(stop, 2 ** n)
+    for block_start in range(start, stop, block_size):
+        ints = filter_block(block_start, min(block_start + block_size, stop), n, skip_reversed)
+        if as_int:
+            yield from (int(i) for i in ints)
+        elif len(ints):
+            yield from ints_to_sequences(ints, n)
+
+
 if __name__ == "__main__":
     start = time.time()
     # print(perm_gen(20, 2))
+    count = sum(1 for _ in iter_sequences(22))  # streams in constant memory
 
     end = time.time()
+    print(f'{count} sequences of length 22')
     print(f'Time taken: {end - start}')
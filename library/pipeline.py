@@ -0,0 +1,218 @@
+"""
+Runs the whole sequence -> native fold pipeline for a chain length n on every core and writes the files db_helper.upload_data expects.
+
+The 2^n sequence space is cut into shards of consecutive integers. Each shard is scored by a worker process against the
+fold set, which is saved once as a fold store (see fold_store) and memory-mapped by every worker instead of being
+pickled to each task.
+Workers only score the distinct maximal contact maps of the fold set (see native_fold.reduce_contact_maps).
+Every shard gets its own output file and is recorded in a manifest once it is written, so a crashed run picks up where it stopped.
+Like the stored data, sequences with more than MAX_DEGENERACY native folds are left out (see --max-degeneracy).
+
+usage: python library/pipeline.py 16 --workers 8 --shard-size 4096
+"""
+import argparse
+import hashlib
+import json
+import os, sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.native_fold import mirror_path, contact_matrix, reduce_contact_maps, reduced_native_fold
+from library.fold_store import FoldStore, fold_store_path, save_folds
+from library.permutations_helper import iter_sequences, sequence_ranges
+from library.shape_helper import Shape, encode_path
+from library.shard_helper import merge_shapes, shard_paths
+
+# the stored data leaves out sequences with more native folds than this
+MAX_DEGENERACY = 150
+
+# state loaded once per worker process by _init_worker
+_coords = None
+_multiplicity = None
+_reduction = None
+
+
+def prepare_fold_set(n, data_dir="data"):
+    """Enumerates the canonical walks of length n into a fold store with int8 coordinates, if there is no store yet.
+    Workers map the coordinates of that encoding straight from the file (a moves store also works but is decoded by each worker).
+
+    :params
+    :int: n: the length of the walks
+    :str: data_dir: root of the data folder
+
+    :returns
+    :str: path to the fold store
+    """
+    path = fold_store_path(n, data_dir)
+    if not os.path.exists(path):
+        save_folds(n, data_dir, encoding="coords")
+    return path
+
+
+def _init_worker(fold_path):
+    """Memory-maps the fold set and reduces it to its contact maps once per worker"""
+    global _coords, _multiplicity, _reduction
+    _coords = FoldStore(fold_path).coords()
+    _multiplicity = np.where(_coords[:, :, 0].any(axis=1), 2, 1)  # same as walk_multiplicity
+    _reduction = reduce_contact_maps(contact_matrix(_coords), _multiplicity)
+
+
+def sequence_id(sequence, shape_id):
+    """Deterministic signed 64 bit id for a (sequence, shape) row.
+
+    The id is the first 8 bytes of blake2b("{sequence}|{shape_id}") read as a signed little endian integer, so reruns
+    and resumed shards give a row the same id. The stored sequences_df files were written with random ids instead,
+    so rows from the two sources match on (sequence, shape_mapping), never on sequence_id.
+    """
+    digest = hashlib.blake2b(f"{sequence}|{shape_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def native_records(n, sequence, energy, degeneracy, native_paths):
+    """Builds the Sequences rows for one sequence: one row per distinct shape among its native folds.
+
+    :returns
+    :list: seq_records: rows for the Sequences table
+    :dict: shape_records: shape_id -> row for the Shapes table
+    """
+    seq_records = []
+    shape_records = {}
+    seen = set()
+    # the existing data keeps the last native path of each shape in sorted order
+    for path in sorted(native_paths, reverse=True):
+        shape = Shape.from_path(path)
+        if shape in seen:
+            continue
+        seen.add(shape)
+        shape_id = shape.shape_id()
+        shape_records[shape_id] = {"shape_id": shape_id, "min_degeneracy": degeneracy, "length": n, "min_energy": energy}
+        seq_records.append({
+            "sequence_id": sequence_id(sequence, shape_id),
+            "sequence": sequence,
+            "degeneracy": degeneracy,
+            "length": n,
+            "energy": energy,
+            "shape_mapping": shape_id,
+            "path": encode_path(path),
+        })
+    return seq_records, shape_records
+
+
+def run_shard(n, shard, start, stop, out_dir, max_degeneracy=MAX_DEGENERACY):
+    """Worker task: folds every sequence in [start, stop) and writes the shard file.
+    Sequences with more than max_degeneracy native folds are skipped.
+
+    :returns
+    :tuple: shard index, number of sequences folded, number of rows written
+    """
+    sequences = list(iter_sequences(n, start, stop))
+    seq_records, shape_records = [], {}
+    if sequences:
+        energies, degeneracies, native_indices = reduced_native_fold(_reduction, sequences)
+        for sequence, energy, degeneracy, indices in zip(sequences, energies, degeneracies, native_indices):
+            if max_degeneracy is not None and degeneracy > max_degeneracy:
+                continue
+            native_paths = []
+            for k in indices:
+                path = [tuple(coord) for coord in _coords[k].tolist()]
+                native_paths.append(path)
+                if _multiplicity[k] == 2:
+                    native_paths.append(mirror_path(path))
+            rows, shapes = native_records(n, sequence, int(energy), int(degeneracy), native_paths)
+            seq_records.extend(rows)
+            merge_shapes(shape_records, shapes)
+
+    shard_file = f"{out_dir}/shard_{shard:05d}.json"
+    with open(shard_file + ".tmp", "w") as f:
+        json.dump({"sequences": seq_records, "shapes": list(shape_records.values())}, f)
+    os.replace(shard_file + ".tmp", shard_file)
+    return shard, len(sequences), len(seq_records)
+
+
+def load_manifest(manifest_path, n, shard_size, max_degeneracy=MAX_DEGENERACY):
+    settings = {"n": n, "shard_size": shard_size, "max_degeneracy": max_degeneracy}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if all(manifest.get(key) == value for key, value in settings.items()):
+            return manifest
+        print("Manifest was written with different settings, starting over")
+    return {**settings, "done": []}
+
+
+def save_manifest(manifest, manifest_path):
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def merge_shards(n, out_dir, data_dir="data"):
+    """Concatenates every shard into data/{n}/seq_{n}.json and data/{n}/shape_{n}.json for db_helper.upload_data"""
+    seq_list = []
+    shapes = {}
+    for path in shard_paths(out_dir):
+        with open(path, "r") as f:
+            shard = json.load(f)
+        seq_list.extend(shard["sequences"])
+        merge_shapes(shapes, {record["shape_id"]: record for record in shard["shapes"]})
+
+    with open(f"{data_dir}/{n}/seq_{n}.json", "w") as f:
+        json.dump(seq_list, f)
+    with open(f"{data_dir}/{n}/shape_{n}.json", "w") as f:
+        json.dump(list(shapes.values()), f)
+    return len(seq_list), len(shapes)
+
+
+def run_pipeline(n, workers=None, shard_size=4096, data_dir="data", merge=True, max_degeneracy=MAX_DEGENERACY):
+    """Folds every sequence of length n across a process pool, resuming from the manifest if one exists.
+
+    :params
+    :int: n: the length of the sequences
+    :int: workers: number of worker processes (defaults to every core)
+    :int: shard_size: number of integers of the 2^n sequence space per shard
+    :str: data_dir: root of the data folder
+    :bool: merge: if True, merges the shards into the upload_data files once every shard is done
+    :int: max_degeneracy: sequences with more native folds than this are left out (None keeps every sequence)
+    """
+    out_dir = f"{data_dir}/{n}/shards"
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = f"{data_dir}/{n}/manifest.json"
+    manifest = load_manifest(manifest_path, n, shard_size, max_degeneracy)
+    done = set(manifest["done"])
+
+    fold_path = prepare_fold_set(n, data_dir)
+    ranges = list(sequence_ranges(n, shard_size))
+    todo = [(shard, start, stop) for shard, (start, stop) in enumerate(ranges)
+            if shard not in done or not os.path.exists(f"{out_dir}/shard_{shard:05d}.json")]
+    print(f"n={n}: {len(ranges)} shards, {len(ranges) - len(todo)} already done")
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(fold_path,)) as pool:
+        futures = [pool.submit(run_shard, n, shard, start, stop, out_dir, max_degeneracy) for shard, start, stop in todo]
+        for count, future in enumerate(as_completed(futures), 1):
+            shard, n_sequences, n_rows = future.result()
+            manifest["done"].append(shard)
+            save_manifest(manifest, manifest_path)
+            print(f"shard {shard} done ({n_sequences} sequences, {n_rows} rows) [{count}/{len(todo)}, {time.time() - start_time:.1f}s]")
+
+    if merge:
+        n_rows, n_shapes = merge_shards(n, out_dir, data_dir)
+        print(f"Merged {n_rows} sequence rows and {n_shapes} shapes into {data_dir}/{n}/")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fold every HP sequence of length n and write the upload_data files")
+    parser.add_argument("n", type=int, help="length of the sequences")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: every core)")
+    parser.add_argument("--shard-size", type=int, default=4096, help="integers of the 2^n sequence space per shard")
+    parser.add_argument("--data-dir", default="data", help="root of the data folder")
+    parser.add_argument("--no-merge", action="store_true", help="only write the shard files")
+    parser.add_argument("--max-degeneracy", type=int, default=MAX_DEGENERACY,
+                        help=f"leave out sequences with more native folds than this (default: {MAX_DEGENERACY}, 0 keeps every sequence)")
+    args = parser.parse_args()
+
+    run_pipeline(args.n, workers=args.workers, shard_size=args.shard_size, data_dir=args.data_dir, merge=not args.no_merge,
+                 max_degeneracy=args.max_degeneracy or None)
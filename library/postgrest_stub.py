@@ -0,0 +1,180 @@
+"""
+A small in-memory stand-in for the PostgREST api behind Supabase, to run the database code against without a database.
+It understands the part of the api this project uses: select, eq/neq/gt/gte/lt/lte/in filters, order, limit/offset,
+count=exact and inserts with or without upsert. It can add latency, fail a fraction of the requests and time out
+large inserts, to exercise retries.
+
+usage:
+    stub = start_stub({"Sequences": sequences_df, "Shapes": shapes_df}, {"Sequences": "sequence_id", "Shapes": "shape_id"})
+    client = create_client(stub.url, STUB_KEY)
+    ...
+    stub.shutdown()
+"""
+import csv
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import pandas as pd
+
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "neq": lambda column, value: column != value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
+STUB_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.stub"  # create_client only takes jwt shaped keys
+RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _parse_value(column, value):
+    """Converts a filter value from the url to the type of the column it is compared with"""
+    value = value.strip('"')
+    if pd.api.types.is_integer_dtype(column):
+        return int(value)
+    if pd.api.types.is_float_dtype(column):
+        return float(value)
+    return value
+
+
+def _apply_filter(df, name, expression):
+    operator, _, value = expression.partition(".")
+    column = df[name]
+    if operator == "in":
+        values = next(csv.reader([value.strip("()")], quotechar='"'))
+        return df[column.isin([_parse_value(column, v) for v in values])]
+    if operator not in OPERATORS:
+        raise ValueError(f"Unsupported operator {operator}")
+    return df[OPERATORS[operator](column, _parse_value(column, value))]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real api (the client pools connections)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, headers=None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._reply(status, json.dumps({"message": message, "code": str(status), "hint": None, "details": None}))
+
+    def _start(self):
+        """Common request handling: latency, random failures and finding the table. Returns (table name, params) or None"""
+        stub = self.server
+        self.body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with stub.lock:
+            stub.requests += 1
+        if stub.latency:
+            time.sleep(stub.latency)
+        if stub.fail_rate and random.random() < stub.fail_rate:
+            self._error(503, "stub failure")
+            return None
+        url = urlsplit(self.path)
+        table = url.path.rsplit("/", 1)[-1]
+        if table not in stub.tables:
+            self._error(404, f"relation {table} does not exist")
+            return None
+        return table, parse_qsl(url.query, keep_blank_values=True)
+
+    def do_GET(self):
+        started = self._start()
+        if started is None:
+            return
+        table, params = started
+        df = self.server.tables[table]
+        options = {}
+        try:
+            for name, expression in params:
+                if name in RESERVED:
+                    options[name] = expression
+                else:
+                    df = _apply_filter(df, name, expression)
+        except (ValueError, KeyError) as e:
+            self._error(400, str(e))
+            return
+        total = len(df)
+        if "order" in options:
+            column, _, direction = options["order"].partition(".")
+            df = df.sort_values(column, ascending=not direction.startswith("desc"), kind="stable")
+        offset = int(options.get("offset", 0))
+        df = df.iloc[offset:offset + int(options["limit"])] if "limit" in options else df.iloc[offset:]
+        select = options.get("select", "*")
+        if select != "*":
+            df = df[select.split(",")]
+        headers = {}
+        if "count=exact" in self.headers.get("Prefer", ""):
+            headers["Content-Range"] = f"{offset}-{offset + len(df) - 1}/{total}" if len(df) else f"*/{total}"
+        self._reply(200, df.to_json(orient="records"), headers)
+
+    def do_POST(self):
+        started = self._start()
+        if started is None:
+            return
+        table, params = started
+        stub = self.server
+        rows = json.loads(self.body or b"[]")
+        rows = [rows] if isinstance(rows, dict) else rows
+        key = dict(params).get("on_conflict") or stub.primary_keys[table]
+        new = pd.DataFrame(rows)
+        prefer = self.headers.get("Prefer", "")
+        if stub.max_rows and len(new) > stub.max_rows:
+            self._error(500, "canceling statement due to statement timeout")
+            return
+        if len(new) and new[key].duplicated().any():
+            self._error(400, "ON CONFLICT DO UPDATE command cannot affect row a second time")
+            return
+        with stub.lock:
+            old = stub.tables[table]
+            duplicates = old[key].isin(new[key]) if len(new) else old[key].isin([])
+            if "resolution=ignore-duplicates" in prefer:
+                new = new[~new[key].isin(old[key])] if len(new) else new
+                duplicates[:] = False
+            elif duplicates.any() and "resolution=merge-duplicates" not in prefer:
+                self._error(409, f"duplicate key value violates unique constraint on {key}")
+                return
+            stub.tables[table] = pd.concat([old[~duplicates], new], ignore_index=True) if len(old) else new.reset_index(drop=True)
+            stub.inserted += len(new)
+        self._reply(201, "" if "return=minimal" in prefer else new.to_json(orient="records"))
+
+
+def start_stub(tables, primary_keys, latency=0.0, fail_rate=0.0, max_rows=None, port=0):
+    """Starts the stub on a background thread.
+
+    :params
+    :dict: tables: table name -> dataframe with its rows
+    :dict: primary_keys: table name -> key column, used by upserts
+    :float: latency: seconds added to every request
+    :float: fail_rate: fraction of requests answered with a 503
+    :int: max_rows: inserts of more rows than this time out (500), None for no limit
+    :int: port: port to listen on, 0 for any free port
+
+    :returns
+    :ThreadingHTTPServer: the server, with .url (to give to create_client), .tables, .requests and .inserted
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.tables = {name: df.reset_index(drop=True) for name, df in tables.items()}
+    server.primary_keys = primary_keys
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.max_rows = max_rows
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.inserted = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -3,88 +3,162 @@ Provides helper functions to help handdling shapes for various purposes (databas
 """
 import numpy as np
 import math
+from functools import lru_cache
+
+# Saving shapes based on their center of mass
+GRID_SIZE = 25
+GRID_CENTER = 13
+
+
+def _centered_cells(coords):
+    """Grid rows and columns of every residue once the path is centred on its (floored) centroid.
+    coords is a (n, 2) or (paths, n, 2) array of x, y coordinates.
+    """
+    coords = np.asarray(coords, dtype=np.int64)
+    n = coords.shape[-2]
+    centroid = coords.sum(axis=-2, keepdims=True) // n
+    centered = coords - centroid + GRID_CENTER
+    return centered[..., 1], centered[..., 0]
+
 
-# Saving shapes based on their center of mass 
 def path_to_shape(path):
-    grid = np.asarray([[0]*25]*25, dtype=int) # actual grid for mapping
-    temp_grid = np.asarray([[0]*25]*25, dtype=int) # temp grid to hold the array before alignment
-    for coord in path:
-        temp_grid[coord[1]+13][coord[0]+13] = 1 # path transferred onto grid but uncentered
-    temp_grid = np.pad(temp_grid, 1) # zero padding to avoid multiplying by 0 when calculating moments
-
-    # find centroid of temp_grid
-    m_00 = len(path) # non-zero residues
-    m_01 = 0
-    for row_n, row in enumerate(temp_grid):
-        if np.any(row!=0):
-            m_01 += row_n * np.count_nonzero(row)
-    m_10 = 0
-    for col_n in range(np.shape(temp_grid)[1]):
-        if np.any(temp_grid[:, col_n]!=0):
-            m_10 += col_n *  np.count_nonzero(temp_grid[:, col_n])
-
-    # coordinates of centroid
-    n_centroid = math.floor((m_10/m_00))
-    m_centroid = math.floor((m_01/m_00))
-    centroid = (m_centroid, n_centroid)
-    print("centroid ==>", centroid)
-    # align temp_grid onto grid
-    dev_m = 13-centroid[0]
-    dev_n = 13-centroid[1]
-    coord_list = np.nonzero(temp_grid)
-    print("centroid ==>", (dev_m, dev_n))
-    for i in range(len(coord_list[0])):
-        grid[coord_list[0][i]+dev_m][coord_list[1][i]+dev_n] = 1
-    
+    """Maps a path onto a 25x25 grid centred on its centroid.
+
+    :params
+    :list: path: list of (x, y) tuples
+
+    :returns
+    :np.array: grid: 25x25 matrix with a 1 on every residue
+    :list: path: the input path
+    """
+    rows, cols = _centered_cells(path)
+    grid = np.zeros((GRID_SIZE, GRID_SIZE), dtype=int)
+    grid[rows, cols] = 1
     return grid, path
 
 
+def paths_to_shapes(coords):
+    """Batch version of path_to_shape.
+
+    :params
+    :np.array: coords: (paths, n, 2) coordinate array
+
+    :returns
+    :np.array: (paths, 25, 25) uint8 stack of grids
+    """
+    rows, cols = _centered_cells(coords)
+    grids = np.zeros((len(rows), GRID_SIZE, GRID_SIZE), dtype=np.uint8)
+    grids[np.arange(len(rows))[:, None], rows, cols] = 1
+    return grids
+
+
+def shape_keys(coords):
+    """Canonical shape keys straight from the coordinates, without building any grid.
+    The key of a path is its sorted flat grid cell indices packed as bytes: two paths have the same key exactly when
+    path_to_shape gives them the same grid (and therefore the same shape_id).
+
+    :params
+    :np.array: coords: (paths, n, 2) coordinate array
+
+    :returns
+    :np.array: (paths,) array of fixed width byte keys, usable with np.unique or as dict keys via .tobytes()
+    """
+    rows, cols = _centered_cells(coords)
+    cells = np.sort(rows * GRID_SIZE + cols, axis=-1).astype(np.uint16)
+    cells = np.ascontiguousarray(cells)
+    return cells.view(f'V{2 * cells.shape[-1]}').ravel()
+
+
+def shape_key(path):
+    """shape_keys for a single path, as hashable bytes"""
+    return shape_keys(np.asarray(path)[None]).tobytes()
+
+
+def unique_shapes(coords):
+    """Deduplicates shapes across many paths.
+
+    :returns
+    :np.array: first: index of the first path of every distinct shape
+    :np.array: inverse: for every path, the position of its shape in first
+    """
+    _, first, inverse = np.unique(shape_keys(coords), return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def _encode_count(count):
+    if count < 10:
+        return str(count)
+    return chr(count + 87)
+
+
 def serialize_shape(matrix):
     """
     Flattens matrix then condenses its elements into a string. When an element is repeated, it'll encode the number of repeats as follows:
     If its repeated 0-9 times it'll encode it as the count then the repeated digit 
     for 10-36 it'll encode it as a letter in the alphabet then the repeated digit.
-    Beyond that, it'll just separate the repeated digit into 2 batches of 36 or less
+    Beyond that, the count is stored as the character chr(count + 87)
     
     """
+    matrix = np.asarray(matrix).ravel()
+    # runs start at 0 and wherever the value changes
+    starts = np.concatenate(([0], np.flatnonzero(matrix[1:] != matrix[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(matrix)))
+    return "".join(_encode_count(int(count)) + str(value) for count, value in zip(counts, matrix[starts]))
 
-    matrix = matrix.flatten()
-    string = ""
-    count = 1
-
-    def encode_count(count):
-        if count < 10:
-            return str(count)
-        return chr(count+87)
-    # CLUNKY AND WILL BE IMPROVED - JUST A POC RN 
-    for i in range(len(matrix)-1):
-        if matrix[i] == matrix[i+1]:
-            count += 1
-        else:
-            string += encode_count(count)
-            string += str(matrix[i])
-            count = 1
-
-    string += encode_count(count)
-    string += str(matrix[-1])
 
-    return string
+def _decode_runs(string):
+    """Splits a serialized shape into its run lengths and values.
+    Raises ValueError unless the runs are valid and cover exactly the GRID_SIZE x GRID_SIZE grid, so a malformed id
+    can not make the decoder allocate more than one grid.
+    """
+    chars = np.frombuffer(string.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    if len(chars) == 0 or len(chars) % 2:
+        raise ValueError(f"Not a serialized shape: {string[:50]!r}")
+    counts = chars[0::2]
+    counts = np.where(counts <= ord("9"), counts - ord("0"), counts - 87)
+    values = chars[1::2] - ord("0")
+    valid_runs = ((counts >= 1) & (counts <= GRID_SIZE * GRID_SIZE) & (values >= 0) & (values <= 9)).all()
+    if not valid_runs or counts.sum() != GRID_SIZE * GRID_SIZE:
+        raise ValueError(f"Not a serialized shape: {string[:50]!r}")
+    return counts, values
+
+
+def shape_size(string):
+    """Number of filled cells of a serialized shape (the n of the sequences folding into it), without decoding the grid"""
+    if is_compact_shape(string):
+        return len(Shape.from_string(string))
+    counts, values = _decode_runs(string)
+    return int(counts[values == 1].sum())
 
 
 def deserialize_shape(string):
     """
-    Takes a string and decodes it into a matrix
+    Takes a string and decodes it into a (25, 25) float matrix (raises ValueError for a compact id of a shape that does not fit)
     """
-    matrix = np.array([])
+    if is_compact_shape(string):
+        return Shape.from_string(string).to_grid().astype(float)
+    counts, values = _decode_runs(string)
+    return np.repeat(values.astype(float), counts).reshape(GRID_SIZE, GRID_SIZE)
+
+
+@lru_cache(maxsize=4096)
+def shape_matrix(shape_id):
+    """
+    Cached deserialize_shape keyed by shape_id. The matrix is shared between callers so it is read only.
+    """
+    matrix = deserialize_shape(shape_id)
+    matrix.flags.writeable = False
+    return matrix
 
-    def decode_count(char):
-        if char.isdigit():
-            return int(char)
-        return ord(char)-87
-    
-    for i in range(0,len(string), 2):
-        matrix = np.append(matrix, np.full(decode_count(string[i]), int(string[i+1])))
-    return np.asarray(matrix).reshape(25, 25)
+
+def deserialize_shapes(shape_ids, dtype=np.uint8):
+    """
+    Decodes a list of shape ids into a (k, 25, 25) array, going through the shape_matrix cache
+    """
+    matrices = np.empty((len(shape_ids), GRID_SIZE, GRID_SIZE), dtype=dtype)
+    for k, shape_id in enumerate(shape_ids):
+        matrices[k] = shape_matrix(shape_id)
+    return matrices
 
 """
 The below functions allow us to convert between the database representation of a path and the actual path
@@ -105,17 +179,246 @@ def serialize_path(path):
 
 def deserialize_path(string):
     """
-    Takes a string and decodes it into a path
+    Takes a string and decodes it into a path (either format, see encode_path)
     """
+    if not is_legacy_path(string):
+        return [tuple(coord) for coord in decode_paths([string])[0].tolist()]
     path = []
     for coord in string.split():
         path.append(tuple(map(int, coord.split(","))))
     return path
 
 
+"""
+Compact path codec: a path is stored as its moves from (0, 0), 2 bits per move and 3 moves per base64url character,
+after a "P" and the number of padding moves in the last character. A path of length 12 takes 6 characters instead of
+about 60, and the alphabet has no comma, space, quote or bracket so the strings are safe in PostgREST filters.
+Strings written by serialize_path ("x,y x,y ...") always contain a comma, which is how the two formats are told apart.
+"""
+B64_ALPHABET = np.frombuffer(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_", dtype=np.uint8)
+_B64_VALUES = np.zeros(256, dtype=np.uint8)
+_B64_VALUES[B64_ALPHABET] = np.arange(64)
+_PATH_STEPS = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)], dtype=np.int8)  # same move codes as native_fold.DIRS
+
+
+def is_legacy_path(string):
+    return "," in string
+
+
+def encode_paths(coords):
+    """
+    Encodes a (k, n, 2) array of paths starting at (0, 0) into a list of k compact path strings
+    """
+    coords = np.asarray(coords, dtype=np.int8)
+    if coords.size == 0:
+        return [""] * len(coords)  # empty paths
+    if coords[:, 0].any():
+        raise ValueError("paths must start at (0, 0)")
+    steps = np.diff(coords, axis=1)
+    if (np.abs(steps).sum(axis=2) != 1).any():
+        raise ValueError("paths must only make unit steps")
+    moves = np.where(steps[..., 0] == 0, 1 - steps[..., 1], 2 - steps[..., 0]).astype(np.uint8)
+    pad = -moves.shape[1] % 3
+    moves = np.concatenate([moves, np.zeros((len(moves), pad), dtype=np.uint8)], axis=1).reshape(len(moves), -1, 3)
+    rows = np.empty((len(moves), 2 + moves.shape[1]), dtype=np.uint8)
+    rows[:, :2] = np.frombuffer(f"P{pad}".encode(), dtype=np.uint8)
+    rows[:, 2:] = B64_ALPHABET[moves[..., 0] | moves[..., 1] << 2 | moves[..., 2] << 4]
+    text = rows.tobytes().decode()
+    width = rows.shape[1]
+    return [text[start:start + width] for start in range(0, len(text), width)]
+
+
+def decode_paths(strings):
+    """
+    Decodes path strings of the same length (compact or serialize_path ones) into a (k, n, 2) int8 array
+    """
+    strings = list(strings)
+    legacy = [is_legacy_path(string) for string in strings]
+    if any(legacy):
+        # text paths: parse every number at once
+        old = [string for string, is_old in zip(strings, legacy) if is_old]
+        numbers = np.array(" ".join(old).replace(",", " ").split(), dtype=np.int8)
+        old = numbers.reshape(len(old), -1, 2)
+        if all(legacy):
+            return old
+        new = decode_paths([string for string, is_old in zip(strings, legacy) if not is_old])
+        if new.shape[1:] != old.shape[1:]:
+            raise ValueError("paths have different lengths")
+        coords = np.empty((len(strings),) + old.shape[1:], dtype=np.int8)
+        coords[np.array(legacy)] = old
+        coords[~np.array(legacy)] = new
+        return coords
+    if not strings:
+        return np.zeros((0, 0, 2), dtype=np.int8)
+    lengths = {len(string) for string in strings}
+    pads = {string[:2] for string in strings}
+    if len(lengths) > 1 or len(pads) > 1:
+        raise ValueError("paths have different lengths")
+    if len(strings[0]) < 2:
+        return np.zeros((len(strings), 0, 2), dtype=np.int8)  # empty paths
+    pad = int(strings[0][1])
+    chars = np.frombuffer("".join(string[2:] for string in strings).encode(), dtype=np.uint8).reshape(len(strings), len(strings[0]) - 2)
+    values = _B64_VALUES[chars]
+    moves = np.stack([values & 3, values >> 2 & 3, values >> 4 & 3], axis=2).reshape(len(strings), -1)
+    moves = moves[:, :moves.shape[1] - pad]
+    coords = np.zeros((len(strings), moves.shape[1] + 1, 2), dtype=np.int8)
+    np.cumsum(_PATH_STEPS[moves], axis=1, out=coords[:, 1:])
+    return coords
+
+
+def encode_path(path):
+    """
+    Compact string of one path of tuples, replaces serialize_path
+    """
+    return encode_paths([path])[0]
+
+
+def compact_path_column(paths):
+    """
+    Converts a column of path strings (either format, any mix of lengths) to compact strings, keeping the order
+    """
+    paths = list(paths)
+    compact = list(paths)
+    by_length = {}
+    for k, string in enumerate(paths):
+        if is_legacy_path(string):
+            by_length.setdefault(string.count(","), []).append(k)
+    for indices in by_length.values():
+        for k, string in zip(indices, encode_paths(decode_paths([paths[k] for k in indices]))):
+            compact[k] = string
+    return compact
+
+
+
+
+"""
+Sparse shapes: a Shape keeps only its occupied cells, as a sorted array of (x, y) coordinates moved so that its bounding
+box starts at (0, 0). Two paths give equal Shapes exactly when path_to_shape gives them the same grid, but memory and
+comparisons scale with n instead of the 25x25 canvas, and shapes of any size work.
+The string form is "S{width}x{height}x" followed by the bounding box as a bitboard (row major, 6 bits per base64url
+character). Shapes that fit the 25x25 grid keep their serialize_shape id as shape_id() so the database keys do not change,
+bigger ones use the string form. Serialized grids never start with an "S", so both kinds of ids can share a column.
+"""
+class Shape:
+    """Occupied cells of a shape, see above. Hashable, equality compares the cells."""
+    __slots__ = ("cells", "width", "height", "_key", "_hash")
+
+    def __init__(self, cells):
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        cells = cells - cells.min(axis=0)
+        self.width, self.height = (int(size) for size in cells.max(axis=0) + 1)
+        self.cells = cells[np.argsort(cells[:, 1] * self.width + cells[:, 0])].astype(np.int32)
+        self._key = np.array([self.width, self.height], dtype=np.int32).tobytes() + self.cells.tobytes()
+        self._hash = hash(self._key)
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(path)
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """Shape of the filled cells of a grid (rows are y, columns are x, like path_to_shape)"""
+        return cls(np.argwhere(np.asarray(matrix) == 1)[:, ::-1])
+
+    @classmethod
+    def from_string(cls, string):
+        """Parses the string form (see to_string)"""
+        width, height, body = string[1:].split("x", 2)
+        width, height = int(width), int(height)
+        values = _B64_VALUES[np.frombuffer(body.encode(), dtype=np.uint8)]
+        bits = ((values[:, None] >> np.arange(6, dtype=np.uint8)) & 1).ravel()[:width * height]
+        cells = np.flatnonzero(bits)
+        return cls(np.stack([cells % width, cells // width], axis=1))
+
+    @classmethod
+    def from_shape_id(cls, shape_id):
+        """Shape of an id of either kind"""
+        return cls.from_string(shape_id) if is_compact_shape(shape_id) else cls.from_matrix(deserialize_shape(shape_id))
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __eq__(self, other):
+        return isinstance(other, Shape) and self._key == other._key
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"Shape(n={len(self)}, {self.width}x{self.height})"
+
+    def to_matrix(self, dtype=np.uint8):
+        """Dense (height, width) matrix of the bounding box"""
+        matrix = np.zeros((self.height, self.width), dtype=dtype)
+        matrix[self.cells[:, 1], self.cells[:, 0]] = 1
+        return matrix
+
+    def to_grid(self, size=GRID_SIZE, dtype=int):
+        """The grid path_to_shape gives for any path of this shape, raises ValueError if the shape does not fit"""
+        centered = self.cells - self.cells.sum(axis=0) // len(self) + GRID_CENTER
+        if centered.min() < 0 or centered.max() >= size:
+            raise ValueError(f"{self!r} does not fit a {size}x{size} grid")
+        grid = np.zeros((size, size), dtype=dtype)
+        grid[centered[:, 1], centered[:, 0]] = 1
+        return grid
+
+    def to_string(self):
+        """Compact string form: "S{width}x{height}x" and the bounding box bitboard"""
+        bits = np.zeros(-(-self.width * self.height // 6) * 6, dtype=np.uint8)
+        bits[self.cells[:, 1] * self.width + self.cells[:, 0]] = 1
+        values = (bits.reshape(-1, 6) << np.arange(6, dtype=np.uint8)).sum(axis=1)
+        return f"S{self.width}x{self.height}x" + B64_ALPHABET[values].tobytes().decode()
+
+    def shape_id(self):
+        """serialize_shape id if the shape fits the 25x25 grid, the string form otherwise"""
+        try:
+            return serialize_shape(self.to_grid())
+        except ValueError:
+            return self.to_string()
+
+
+def is_compact_shape(string):
+    return string.startswith("S")
+
 
 
 if __name__ == "__main__":
+    import time
+    import pandas as pd
+    # sparse shapes against 25x25 grids: memory and deduplicating every walk of n by shape
+    from native_fold import iter_walks, paths_to_array
+    for n in (12, 14, 16):
+        coords = paths_to_array(list(iter_walks(n)))
+        start = time.time()
+        grid_ids = {serialize_shape(path_to_shape(path)[0]) for path in coords}
+        grid_time = time.time() - start
+        start = time.time()
+        shapes = {Shape.from_path(path) for path in coords}
+        shape_time = time.time() - start
+        assert len(shapes) == len(grid_ids)
+        print(f"n={n}: {len(shapes)} shapes from {len(coords)} walks | grid + serialize_shape {grid_time:.2f}s, Shape {shape_time:.2f}s | "
+              f"{GRID_SIZE * GRID_SIZE} grid cells vs {Shape.from_path(coords[0]).cells.nbytes} bytes of cells per shape")
+
+    # compact path codec against serialize_path on the stored sequences
+    for n in range(8, 12):
+        sequences_df = pd.read_json(f"data/sequences_df_{n}.json", orient="split", convert_dates=False)
+        old = sequences_df["path"].astype(str).tolist()
+        start = time.time()
+        expected = [deserialize_path(string) for string in old]
+        old_time = time.time() - start
+        start = time.time()
+        new = compact_path_column(old)
+        encode_time = time.time() - start
+        start = time.time()
+        coords = decode_paths(new)
+        decode_time = time.time() - start
+        assert coords.tolist() == [[list(coord) for coord in path] for path in expected]
+        old_json = len(sequences_df.to_json(orient="split"))
+        new_json = len(sequences_df.assign(path=new).to_json(orient="split"))
+        print(f"n={n}: path column {sum(map(len, old)) / 1e3:.0f}KB -> {sum(map(len, new)) / 1e3:.0f}KB, "
+              f"sequences json {old_json / 1e6:.2f}MB -> {new_json / 1e6:.2f}MB | "
+              f"deserialize_path {old_time * 1e3:.0f}ms, compact {encode_time * 1e3:.0f}ms, decode_paths {decode_time * 1e3:.0f}ms")
+
     path2 = [(0,0), (-1,0), (-1,-1), (-1, -2), (0, -2), (0, -1), (1, -1)]
     matrix, path = path_to_shape(path2)
 
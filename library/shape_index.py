@@ -0,0 +1,153 @@
+"""
+Answers "is this shape in the database" for many shape ids at once.
+The shape_ids of every n in the local cache are kept as a sorted array, so a lookup of a shape of a cached n is a binary
+search instead of a round trip. The rest goes to the database in chunked in.() queries, and shapes found there are
+remembered. The index is rebuilt when the cached shapes of an n are rewritten.
+By default a shape missing from the index is still checked in the database, since the cache can be stale or partial.
+
+Hit and miss counts are kept in lookup_stats() (hits: found locally, negative_hits: known to be absent locally,
+misses: sent to the database, found_remotely: of those, found in the database, queries: in.() queries sent).
+"""
+import os, sys
+import threading
+from collections import Counter
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.cache_helper import cache_path, load_shapes
+from library.shape_helper import shape_size
+from library.bulk_loader import fetch_by_keys
+
+_indexes = {}  # n -> (mtime of the cached shapes, sorted array of shape ids or None if n is not cached)
+_learned = set()  # shape ids found in the database but not in the cache
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def _index(n):
+    """Sorted array of the cached shape ids at n, None if the shapes of n are not cached"""
+    path = cache_path(n, "shapes")
+    version = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    with _lock:
+        cached = _indexes.get(n)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    shapes_df = load_shapes(n) if version is not None else None
+    ids = None if shapes_df is None else np.sort(shapes_df['shape_id'].astype(str).to_numpy(dtype=str))
+    with _lock:
+        _indexes[n] = (version, ids)
+    return ids
+
+
+def _in_index(ids, shape_ids):
+    """Boolean mask of the shape_ids that are in the sorted array ids"""
+    shape_ids = np.asarray(shape_ids, dtype=str)
+    positions = np.minimum(np.searchsorted(ids, shape_ids), len(ids) - 1)
+    return ids[positions] == shape_ids if len(ids) else np.zeros(len(shape_ids), dtype=bool)
+
+
+def lookup_shapes(shape_ids, trust_cache=False, chunk_size=200, client=None):
+    """Finds which of the shape ids are in the database.
+
+    :params
+    :list: shape_ids: shape ids to look up
+    :bool: trust_cache: if False (default), shapes missing from the cache are checked in the database. Only pass True when
+        the cache is known to be a complete snapshot of the database (kept up to date by graph_logic.update_network_graph):
+        a shape of a cached n that is not in the cache is then taken as absent without a query.
+    :int: chunk_size: number of ids per database query
+
+    :returns
+    :set: the shape ids that are in the database
+    """
+    shape_ids = list(dict.fromkeys(shape_ids))
+    found = {shape_id for shape_id in shape_ids if shape_id in _learned}
+    by_n = {}
+    for shape_id in shape_ids:
+        if shape_id not in found:
+            by_n.setdefault(shape_size(shape_id), []).append(shape_id)
+
+    remote = []
+    stats = Counter(hits=len(found))
+    for n, candidates in by_n.items():
+        ids = _index(n)
+        if ids is None:
+            remote.extend(candidates)
+            continue
+        mask = _in_index(ids, candidates)
+        found.update(shape_id for shape_id, hit in zip(candidates, mask) if hit)
+        stats["hits"] += int(mask.sum())
+        if trust_cache:
+            stats["negative_hits"] += int((~mask).sum())
+        else:
+            remote.extend(shape_id for shape_id, hit in zip(candidates, mask) if not hit)
+
+    if remote:
+        rows = fetch_by_keys("Shapes", ["shape_id"], "shape_id", remote, key="shape_id", chunk_size=chunk_size, client=client)
+        in_db = set(rows['shape_id'])
+        found |= in_db
+        stats.update(misses=len(remote), found_remotely=len(in_db), queries=-(-len(remote) // chunk_size))
+        with _lock:
+            _learned.update(in_db)
+    with _lock:
+        _stats.update(stats)
+    return found
+
+
+def lookup_stats():
+    """Counts of the lookups made so far, plus the hit rate of the local index"""
+    with _lock:
+        stats = dict(_stats)
+    total = stats.get("hits", 0) + stats.get("negative_hits", 0) + stats.get("misses", 0)
+    stats["hit_rate"] = (stats.get("hits", 0) + stats.get("negative_hits", 0)) / total if total else 0.0
+    return stats
+
+
+def reset_lookup_stats():
+    with _lock:
+        _stats.clear()
+
+
+def clear_index():
+    """Forgets the indexes and the shapes learned from the database"""
+    with _lock:
+        _indexes.clear()
+        _learned.clear()
+
+
+if __name__ == "__main__":
+    # compares one query per shape with the index and batched queries, against the PostgREST stub with 20ms of latency
+    import time
+    import pandas as pd
+    from supabase import create_client
+    from library.postgrest_stub import start_stub, STUB_KEY
+    from library.shape_helper import serialize_shape, deserialize_shape
+
+    ns = [n for n in range(8, 15) if load_shapes(n) is not None]
+    shapes_df = pd.concat([load_shapes(n).astype({"shape_id": str}) for n in ns], ignore_index=True)
+    stub = start_stub({"Shapes": shapes_df}, {"Shapes": "shape_id"}, latency=0.02)
+    client = create_client(stub.url, STUB_KEY)
+
+    # half real shapes, half real shapes with a cell moved (mostly not in the database)
+    rng = np.random.default_rng(0)
+    real = shapes_df["shape_id"].sample(200, random_state=0).tolist()
+    fake = []
+    for shape_id in real:
+        matrix = deserialize_shape(shape_id)
+        matrix[tuple(np.argwhere(matrix == 1)[rng.integers(matrix.sum())])] = 0
+        matrix[tuple(np.argwhere(matrix == 0)[rng.integers((matrix == 0).sum())])] = 1
+        fake.append(serialize_shape(matrix.astype(int)))
+    candidates = real + fake
+    expected = {shape_id for shape_id in candidates if shape_id in set(shapes_df["shape_id"])}
+
+    start = time.time()
+    one_by_one = {shape_id for shape_id in candidates if client.table("Shapes").select("shape_id").eq("shape_id", shape_id).execute().data}
+    print(f"one query per shape: {time.time() - start:.2f}s, {len(candidates)} requests, correct: {one_by_one == expected}")
+    for trust_cache in (False, True):
+        clear_index()
+        reset_lookup_stats()
+        requests = stub.requests
+        start = time.time()
+        found = lookup_shapes(candidates, trust_cache, client=client)
+        print(f"trust_cache={trust_cache}: {time.time() - start:.2f}s, {stub.requests - requests} requests, correct: {found == expected}, {lookup_stats()}")
+    stub.shutdown()
@@ -0,0 +1,20 @@
+"""
+Shard files written by the pipeline (data/{n}/shards/shard_*.json) and the shape rows they hold, shared by the pipeline
+and the upload code so neither has to import the other.
+"""
+import os
+
+
+def shard_paths(shard_dir):
+    """Paths of the shard files in a directory, in shard order"""
+    return [f"{shard_dir}/{name}" for name in sorted(os.listdir(shard_dir)) if name.startswith("shard_") and name.endswith(".json")]
+
+
+def merge_shapes(shapes, new_shapes):
+    """Folds new shape rows into shapes, keeping the minimum degeneracy and energy per shape"""
+    for shape_id, record in new_shapes.items():
+        if shape_id in shapes:
+            shapes[shape_id]["min_degeneracy"] = min(shapes[shape_id]["min_degeneracy"], record["min_degeneracy"])
+            shapes[shape_id]["min_energy"] = min(shapes[shape_id]["min_energy"], record["min_energy"])
+        else:
+            shapes[shape_id] = dict(record)
@@ -0,0 +1,183 @@
+"""
+Provides shape thumbnails rendered on demand instead of writing a PNG to assets/ for every node of every graph build.
+A thumbnail is rendered the first time its shape_id is asked for and its bytes are kept in a size bounded in-memory LRU and
+a size bounded on-disk store. Files are content addressed (named after the SHA-1 of the shape_id) so any shape_id is a safe
+file name, and the least recently used files are evicted once the store is over its limit (checked after pre-rendering and
+every EVICT_EVERY bytes rendered on demand).
+
+usage: python library/thumbnail_helper.py 10 11 --workers 8   (pre-renders every shape at those n)
+"""
+import os, sys
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library.shape_helper import shape_matrix
+
+THUMBNAIL_DIR = "data/cache/thumbnails"
+THUMBNAIL_SIZE = 300
+MEMORY_LIMIT = 64 * 1024 * 1024  # bytes of PNG kept in memory per process
+DISK_LIMIT = 1024 * 1024 * 1024  # bytes of PNG kept on disk
+EVICT_EVERY = 16 * 1024 * 1024  # bytes written by a process between two evictions of the on-disk store
+
+_memory = OrderedDict()
+_memory_size = 0
+_lock = threading.Lock()
+# starts full so the first write of a process checks the store it inherited
+_written_since_evict = EVICT_EVERY
+_evicting = threading.Lock()
+
+
+def thumbnail_key(shape_id):
+    """Content address of a shape's thumbnail, also used as its ETag"""
+    return hashlib.sha1(shape_id.encode()).hexdigest()
+
+
+def _disk_path(key, thumbnail_dir=THUMBNAIL_DIR):
+    return f"{thumbnail_dir}/{key[:2]}/{key}.png"
+
+
+def render_thumbnail(shape_id):
+    """Renders a shape as a THUMBNAIL_SIZE square greyscale PNG (same picture as the old assets/ files)
+
+    :returns
+    :bytes: the PNG file
+    """
+    normalized_matrix = (shape_matrix(shape_id) * 255).astype(np.uint8)
+    img = Image.fromarray(normalized_matrix, mode='L')
+    img = img.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.NEAREST)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _remember(key, data):
+    global _memory_size
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            return
+        _memory[key] = data
+        _memory_size += len(data)
+        while _memory_size > MEMORY_LIMIT and len(_memory) > 1:
+            _, evicted = _memory.popitem(last=False)
+            _memory_size -= len(evicted)
+
+
+def _write_disk(key, data, thumbnail_dir=THUMBNAIL_DIR):
+    path = _disk_path(key, thumbnail_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def evict_disk(limit=DISK_LIMIT, thumbnail_dir=THUMBNAIL_DIR):
+    """Deletes the least recently used thumbnails until the on-disk store is under limit bytes"""
+    if not os.path.isdir(thumbnail_dir):
+        return
+    files = []
+    for root, _, names in os.walk(thumbnail_dir):
+        for name in names:
+            if name.endswith(".png"):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # evicted by another process meanwhile
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _evict_in_background(thumbnail_dir):
+    try:
+        evict_disk(DISK_LIMIT, thumbnail_dir)
+    finally:
+        _evicting.release()
+
+
+def _count_written(size, thumbnail_dir=THUMBNAIL_DIR):
+    """Keeps the on-disk store under DISK_LIMIT while serving: every EVICT_EVERY bytes written, evict_disk runs in a
+    background thread (at most one at a time per process) so the request that crossed the mark does not wait for the walk"""
+    global _written_since_evict
+    with _lock:
+        _written_since_evict += size
+        if _written_since_evict < EVICT_EVERY or not _evicting.acquire(blocking=False):
+            return
+        _written_since_evict = 0
+    threading.Thread(target=_evict_in_background, args=(thumbnail_dir,), daemon=True).start()
+
+
+def get_thumbnail(shape_id, thumbnail_dir=THUMBNAIL_DIR):
+    """PNG bytes of a shape's thumbnail: from memory, else from disk, else rendered and stored in both
+
+    :returns
+    :tuple: png bytes, key (content address to use as ETag)
+    """
+    key = thumbnail_key(shape_id)
+    with _lock:
+        data = _memory.get(key)
+        if data is not None:
+            _memory.move_to_end(key)
+            return data, key
+
+    path = _disk_path(key, thumbnail_dir)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # mtime is the recency used by evict_disk
+    else:
+        data = render_thumbnail(shape_id)
+        _write_disk(key, data, thumbnail_dir)
+        _count_written(len(data), thumbnail_dir)
+    _remember(key, data)
+    return data, key
+
+
+def _prerender(shape_id, thumbnail_dir):
+    key = thumbnail_key(shape_id)
+    if not os.path.exists(_disk_path(key, thumbnail_dir)):
+        _write_disk(key, render_thumbnail(shape_id), thumbnail_dir)
+
+
+def prerender(shape_ids, workers=None, thumbnail_dir=THUMBNAIL_DIR, chunksize=64):
+    """Renders the thumbnails of many shapes into the on-disk store with a process pool, skipping the ones already there"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_prerender, shape_ids, [thumbnail_dir] * len(shape_ids), chunksize=chunksize))
+    evict_disk(thumbnail_dir=thumbnail_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from library.cache_helper import load_shapes
+
+    parser = argparse.ArgumentParser(description="Pre-render shape thumbnails")
+    parser.add_argument("n", type=int, nargs="+", help="chain lengths")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for n in args.n:
+        shapes_df = load_shapes(n)
+        if shapes_df is None:
+            print(f"n={n}: no cached shapes")
+            continue
+        shape_ids = [shape_id for shape_id in shapes_df['shape_id'] if len(shape_id) >= 2]
+        start = time.time()
+        prerender(shape_ids, args.workers)
+        print(f"n={n}: {len(shape_ids)} thumbnails in {time.time() - start:.2f}s")
@@ -0,0 +1,172 @@
+"""
+Uploads generated data to the database in batches.
+Records are streamed from the generated json (or pipeline shard) files, deduplicated on the fly and upserted in batches
+on a bounded pool of threads sharing one client. Upserts make every batch safe to send twice, so a failed batch is
+simply retried (in smaller pieces if it timed out) and an interrupted upload resumes from the journal, which records how
+far into each stream every batch has been committed.
+"""
+import os, sys
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import httpx
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class AdaptiveBatchSize:
+    """Batch size shared by the upload workers: halves when a batch fails, grows by half again after a run of successes"""
+
+    def __init__(self, start=1000, low=50, high=5000, grow_after=4):
+        self.size = start
+        self.low = low
+        self.high = high
+        self.grow_after = grow_after
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def success(self):
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.grow_after:
+                self.size = min(self.high, self.size + self.size // 2)
+                self.successes = 0
+
+    def failure(self):
+        with self.lock:
+            self.size = max(self.low, self.size // 2)
+            self.successes = 0
+
+
+def upsert_batch(client, table, rows, key, sizer, retries=6, backoff=0.5):
+    """Upserts rows, retrying with exponential backoff. Once the batch size has shrunk below the number of rows,
+    the next attempt sends the rows in pieces of the new size. The pieces share the retries of the batch."""
+    pending = [rows]
+    failures = 0
+    while pending:
+        chunk = pending.pop()
+        try:
+            client.table(table).upsert(chunk, on_conflict=key, returning=ReturnMethod.minimal).execute()
+            sizer.success()
+        except (httpx.HTTPError, APIError) as e:
+            sizer.failure()
+            if failures == retries:
+                raise
+            print(f"{table}: batch of {len(chunk)} failed ({e}), retrying")
+            time.sleep(backoff * 2 ** failures)
+            failures += 1
+            size = sizer.size
+            pending.extend(chunk[i:i + size] for i in range(0, len(chunk), size))
+    return len(rows)
+
+
+def upload_records(table, records, key, client=None, workers=4, sizer=None, skip=0, on_progress=None, retries=6):
+    """Upserts a stream of records in batches on a bounded thread pool.
+
+    :params
+    :str: table: name of the table
+    :iterable: records: dicts to upload, in a stable order (positions in it are what the journal stores)
+    :str: key: primary key column, records with a key already seen in the stream are skipped
+    :supabase.Client: client: defaults to the shared SupabaseDB client
+    :int: workers: number of batches in flight at the same time
+    :AdaptiveBatchSize: sizer: batch size controller, a new one by default
+    :int: skip: number of records at the start of the stream that are already uploaded
+    :function: on_progress: called with the position up to which every record is committed
+
+    :returns
+    :int: number of records uploaded
+    """
+    if client is None:
+        from library.db_helper import SupabaseDB
+        client = SupabaseDB.supabase
+    sizer = sizer or AdaptiveBatchSize()
+    seen = set()
+    in_flight = deque()  # (stream position after the batch, future) in stream order
+    uploaded = 0
+
+    def settle(block):
+        # waits for the oldest batch and reports the position everything before which is committed
+        nonlocal uploaded
+        if block:
+            wait([in_flight[0][1]])
+        position = None
+        while in_flight and in_flight[0][1].done():
+            position, future = in_flight.popleft()
+            uploaded += future.result()
+        if position is not None and on_progress is not None:
+            on_progress(position)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        position = 0
+        try:
+            for position, record in enumerate(records, 1):
+                if position <= skip or record[key] in seen:
+                    continue
+                seen.add(record[key])
+                batch.append(record)
+                if len(batch) >= sizer.size:
+                    in_flight.append((position, pool.submit(upsert_batch, client, table, batch, key, sizer, retries)))
+                    batch = []
+                    settle(block=len(in_flight) >= 2 * workers)
+            if batch:
+                in_flight.append((position, pool.submit(upsert_batch, client, table, batch, key, sizer, retries)))
+            while in_flight:
+                settle(block=True)
+        except BaseException:
+            # batches that have not started yet would only fail the same way
+            for _, future in in_flight:
+                future.cancel()
+            raise
+    if position > skip and on_progress is not None:
+        on_progress(position)
+    return uploaded
+
+
+def _source_signature(paths):
+    return [[path, os.path.getsize(path), os.path.getmtime(path)] for path in paths]
+
+
+def load_journal(journal_path, paths):
+    """Upload journal of a set of source files, reset if the files changed since it was written"""
+    signature = _source_signature(paths)
+    if os.path.exists(journal_path):
+        with open(journal_path, "r") as f:
+            journal = json.load(f)
+        if journal.get("source") == signature:
+            return journal
+        print("Source files changed since the last upload, starting over")
+    return {"source": signature}
+
+
+def save_journal(journal, journal_path):
+    with open(journal_path + ".tmp", "w") as f:
+        json.dump(journal, f)
+    os.replace(journal_path + ".tmp", journal_path)
+
+
+def upload_tables(tables, journal_path, paths, client=None, workers=4, resume=True):
+    """Uploads several streams in order (e.g. Shapes before the Sequences that reference them), journaling each one.
+
+    :params
+    :list: tables: (table name, key column, function returning the record stream)
+    :str: journal_path: where to keep the journal
+    :list: paths: source files, the journal is only reused if they did not change
+    """
+    journal = load_journal(journal_path, paths) if resume else {"source": _source_signature(paths)}
+    sizer = AdaptiveBatchSize()
+    for table, key, records in tables:
+        start = time.time()
+
+        def progress(position, table=table):
+            journal[table] = position
+            save_journal(journal, journal_path)
+
+        skip = journal.get(table, 0)
+        count = upload_records(table, records(), key, client, workers, sizer, skip, progress)
+        print(f"{table}: {count} rows uploaded in {time.time() - start:.1f}s ({skip} already done, last batch size {sizer.size})")
@@ -5,38 +5,70 @@
 4. Display in a WEB UI using Dash.
 """
 # Graph logic and data loading
-import pandas as pd
-import networkx as nx
-import igraph as ig
-import leidenalg
-
 import sys, os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from graph_logic import *
-
-import os
-import community 
-
-import pandas as pd
-import plotly.express as px
+from library.thumbnail_helper import get_thumbnail
+from library.shape_helper import shape_size
+from library.export_helper import submit_export, find_export, export_status, EXPORT_FORMATS
+from flask import request, Response, abort, send_file
 
 import dash
 from dash import dcc
 from dash import html
+from dash import Patch
 from dash.dependencies import Input, Output, State
 import dash_bootstrap_components as dbc
-import plotly.graph_objs as go
-import plotly.io as pio
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 
 # Use the Dash app to serve the figure
 
 # set initial figure
-initial_fig, initial_shape_ids, initial_shape_matrices, initial_shapes_df, initial_sequences_df = create_network_graph(10)
+initial_fig, _, _, _ = create_network_graph(INITIAL_N)
+initial_dataset = get_dataset(INITIAL_N)
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
 
+
+@server.route('/thumbnails/<shape_id>.png')
+def shape_thumbnail(shape_id):
+    # only shapes of a dataset are served, a shape's size is the n of its dataset
+    try:
+        n = shape_size(shape_id)
+    except ValueError:
+        abort(404)
+    if not MIN_N <= n <= MAX_N or shape_id not in get_dataset(n)['index']:
+        abort(404)
+    # a shape_id always renders to the same picture, so browsers can keep it for good
+    png, etag = get_thumbnail(shape_id)
+    headers = {'Cache-Control': 'public, max-age=31536000, immutable', 'ETag': f'"{etag}"'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(png, mimetype='image/png', headers=headers)
+
+
+@server.route('/exports/<int:n>/<view>.<fmt>')
+def export_figure(n, view, fmt):
+    # the first request queues the export in the background, later ones get the file once it is written.
+    # Polls look the export up by the version of its data, the figure is only built when nothing is running or done
+    if not MIN_N <= n <= MAX_N or view not in FIGURE_VIEWS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    name = f'{view}_{n}_{figure_version(n)}'
+    path = find_export(name, fmt)
+    status = export_status(path) if path is not None else 'missing'
+    if status == 'missing' or status.startswith('failed'):
+        status, path = submit_export(build_figure(n, view), fmt, name=name)
+    if status == 'done':
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=f'{view}_{n}.{fmt}', max_age=31536000)
+    return Response(f'Export {status}, try again shortly', status=202, headers={'Retry-After': '5'})
+
+
 app.layout = dbc.Container([
     html.Div(
     html.Img(
@@ -61,6 +93,13 @@ app.layout = dbc.Container([
             html.Br(),
             html.Button('Update Graph', id='update-graph-button', n_clicks=0),
             html.Button('Show Communities', id='show-communities-button', n_clicks=0),
+            dcc.RadioItems(
+                id='render-mode',
+                options=[{'label': 'Auto', 'value': 'auto'}, {'label': 'SVG', 'value': 'svg'}, {'label': 'WebGL', 'value': 'webgl'}],
+                value='auto',
+                inline=True,
+            ),
+            dcc.Checklist(id='show-edges', options=[{'label': 'Edges (WebGL)', 'value': 'edges'}], value=[], inline=True),
             dcc.Graph(id='graph', figure=initial_fig),
             dcc.Loading(
                 id="loading",
@@ -77,123 +116,149 @@ app.layout = dbc.Container([
         ])
   
     ]),
-dcc.Store(id='stored-shape-ids', data=initial_shape_ids),
-dcc.Store(id='stored-shape-matrices', data=initial_shape_matrices),
-dcc.Store(id='stored-shapes-df', data=initial_shapes_df.to_json(date_format='iso', orient='split')),
-dcc.Store(id='stored-sequences-df', data=initial_sequences_df.to_json(date_format='iso', orient='split'))
+# only the key of the server side dataset (see graph_logic.get_dataset) goes to the browser
+dcc.Store(id='dataset-key', data={'n': INITIAL_N, 'version': initial_dataset['version'], 'view': 'svg', 'edges': False}),
+# hover texts already fetched for the current dataset (shape_id -> text), and the shape waiting for one
+dcc.Store(id='hover-texts', data={}),
+dcc.Store(id='hover-request', data=None)
 
 ])
 
+def log_latency(callback):
+    """Logs (at debug level) how long each call of a server callback takes, to keep an eye on interaction latency"""
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = callback(*args, **kwargs)
+        logger.debug('%s: %.1f ms', callback.__name__, (time.perf_counter() - start) * 1000)
+        return result
+    return wrapper
+
+
 @app.callback(
     Output('graph', 'figure'),
-    Output('hover-image', 'src'),
-    Output('hover-data', 'children'),
-    Output('stored-shape-ids', 'data'),
-    Output('stored-shape-matrices', 'data'),
-    Output('stored-shapes-df', 'data'),
+    Output('dataset-key', 'data'),
+    Output('hover-texts', 'data'),
     Output('loading-output', 'children'),
     Input('update-graph-button', 'n_clicks'),
+    State('n-slider', 'value'),
+    State('render-mode', 'value'),
+    State('show-edges', 'value'),
+    prevent_initial_call=True,
+)
+@log_latency
+def update_graph(n_clicks, n_value, render_mode, show_edges):
+    dataset = get_dataset(n_value)
+    show_edges = 'edges' in show_edges
+    if render_mode == 'webgl' or (render_mode == 'auto' and len(dataset['shape_ids']) > GL_NODE_THRESHOLD):
+        fig = create_gl_figure(n_value, show_edges)
+        view = 'webgl'
+    else:
+        fig = create_network_graph(n_value)[0]
+        view = 'svg'
+    return fig, {'n': n_value, 'version': dataset['version'], 'view': view, 'edges': show_edges}, {}, None
+
+
+@app.callback(
+    Output('graph', 'figure', allow_duplicate=True),
+    Input('graph', 'relayoutData'),
+    State('dataset-key', 'data'),
+    prevent_initial_call=True,
+)
+@log_latency
+def expand_on_zoom(relayout_data, dataset_key):
+    # level of detail: a WebGL figure with super-nodes is rebuilt for the new range on every zoom
+    if not relayout_data or dataset_key.get('view') != 'webgl':
+        return dash.no_update
+    if len(get_dataset(dataset_key['n'])['shape_ids']) <= LOD_MAX_POINTS:
+        return dash.no_update
+    if 'xaxis.range[0]' in relayout_data or 'yaxis.range[0]' in relayout_data:
+        x_range = (relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']) if 'xaxis.range[0]' in relayout_data else None
+        y_range = (relayout_data['yaxis.range[0]'], relayout_data['yaxis.range[1]']) if 'yaxis.range[0]' in relayout_data else None
+    elif relayout_data.get('xaxis.autorange') or relayout_data.get('yaxis.autorange'):
+        x_range, y_range = None, None
+    else:
+        return dash.no_update
+    return create_gl_figure(dataset_key['n'], dataset_key['edges'], x_range, y_range)
+
+
+@app.callback(
+    Output('graph', 'figure', allow_duplicate=True),
+    Output('dataset-key', 'data', allow_duplicate=True),
+    Output('hover-texts', 'data', allow_duplicate=True),
+    Output('loading-output', 'children', allow_duplicate=True),
     Input('show-communities-button', 'n_clicks'),
-    Input('graph', 'hoverData'),
-    State('graph', 'figure'),
     State('n-slider', 'value'),
-    State('stored-shape-ids', 'data'),
-    State('stored-shape-matrices', 'data'),
-    State('stored-shapes-df', 'data'),
-    State('stored-sequences-df', 'data')
+    prevent_initial_call=True,
+)
+@log_latency
+def show_communities(n_clicks, n_value):
+    dataset = get_dataset(n_value)
+    return create_new_figure(n_value), {'n': n_value, 'version': dataset['version'], 'view': 'communities', 'edges': False}, {}, None
+
+
+# hover fast path, runs in the browser: the thumbnail url comes from the point's shape_id and the text from hover-texts.
+# Only a shape whose text was never fetched goes to the server, through hover-request.
+app.clientside_callback(
+    """
+    function(hoverData, texts) {
+        const no_update = window.dash_clientside.no_update;
+        // super-nodes have no shape
+        if (!hoverData || !hoverData.points[0].customdata) {
+            return [no_update, no_update, no_update];
+        }
+        const shapeId = hoverData.points[0].customdata[0];
+        const src = '/thumbnails/' + encodeURIComponent(shapeId) + '.png';
+        if (texts && shapeId in texts) {
+            return [src, texts[shapeId], no_update];
+        }
+        return [src, 'shape_id: ' + shapeId, shapeId];
+    }
+    """,
+    Output('hover-image', 'src'),
+    Output('hover-data', 'children'),
+    Output('hover-request', 'data'),
+    Input('graph', 'hoverData'),
+    State('hover-texts', 'data'),
+)
+
 
+@app.callback(
+    Output('hover-texts', 'data', allow_duplicate=True),
+    Input('hover-request', 'data'),
+    State('dataset-key', 'data'),
+    prevent_initial_call=True,
 )
-def update_graph_and_hover_data(n_clicks, communities_n_clicks, hover_data, current_figure, n_value, shape_ids, shape_matrices_json, shapes_df_json, sequences_df_json):
-    ctx = dash.callback_context
-    triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
+@log_latency
+def fetch_hover_text(shape_id, dataset_key):
+    if shape_id is None:
+        return dash.no_update
+    try:
+        text = hover_text(dataset_key['n'], shape_id)
+    except KeyError:
+        return dash.no_update
+    # only the new entry travels back, not the whole store
+    texts = Patch()
+    texts[shape_id] = text
+    return texts
 
 
-    # Check if the "Show Communities" button was clicked
-    if triggered_id == 'show-communities-button':
-        fig, shape_ids, shape_matrices, shapes_df, sequences_df = create_network_graph(n_value)
-        shape_matrices_list = {k: v.tolist() for k, v in shape_matrices.items()}  # Convert numpy arrays to lists
-        new_fig = create_new_figure(n_value)
-        return new_fig, dash.no_update, dash.no_update, shape_ids, shape_matrices_list, shapes_df.to_json(date_format='iso', orient='split'), None
-    
-    if triggered_id == 'update-graph-button':
-        fig, shape_ids, shape_matrices, shapes_df, sequences_df = create_network_graph(n_value)
-        shape_matrices_list = {k: v.tolist() for k, v in shape_matrices.items()}  # Convert numpy arrays to lists
-        print(f'n: {n_value}, sequences_df shape: {sequences_df.shape}, unique shape_ids: {sequences_df["shape_mapping"].nunique()}')
-        return fig, dash.no_update, dash.no_update, shape_ids, shape_matrices_list, shapes_df.to_json(date_format='iso', orient='split'), None
-    
-    elif triggered_id == 'graph' and hover_data is not None and shape_ids is not None and shape_matrices_json is not None and shapes_df_json is not None:
-        shape_matrices = {k: np.array(v) for k, v in shape_matrices_json.items()}  # Convert back to numpy arrays
-        point_index = hover_data['points'][0]['pointIndex']
-        shape_id = shape_ids[point_index]
-        image_path = f'{shape_id}.png'
-        save_image(shape_matrices[shape_id], image_path)
-        # get all sequences for shape_id in sequences_df
-        sequences_df = pd.read_json(sequences_df_json, orient='split')
-        # reset column hea
-
-        sequences = sequences_df[sequences_df['shape_mapping'] == shape_id]
-        # convert to string with newline characters
-        sequences_str = '\n'.join(sequences['sequence'].values)
-        
-        shapes_df = pd.read_json(shapes_df_json, orient='split')
-        shape_data = shapes_df[shapes_df['shape_id'] == shape_id].iloc[0]
-        hover_data_text = f'\n'.join([f'{col}: {val}' for col, val in shape_data.items()])
-        # add sequences to hover_data_text
-        hover_data_text += f'\nSequences:\n{sequences_str}'
-
-
-        
-        return dash.no_update, f'/assets/{image_path}', hover_data_text, dash.no_update, dash.no_update, dash.no_update, None
-    return dash.no_update, '', '', dash.no_update, dash.no_update, dash.no_update, None
-
-def create_new_figure(n_value):
-
-    G = nx.node_link_graph(load_data_from_json(f'data/graph_{n_value}.json'))
-    # draw
-    pos = nx.spring_layout(G)
-
-    new_fig = go.Figure()
-
-    # Convert the graph to igraph format
-    G_ig = ig.Graph.from_networkx(G)
-
-    # use leidenalg to find the communities and plot
-    partition = leidenalg.find_partition(G_ig, leidenalg.ModularityVertexPartition)
-
-    node_data = []
-    for node, membership in zip(G.nodes, partition.membership):
-        node_data.append({"node": node, "x": pos[node][0], "y": pos[node][1], "membership": membership})
-
-    node_data_df = pd.DataFrame(node_data)
-    num_communities = len(set(partition.membership))
-
-    new_fig = px.scatter(node_data_df, x="x", y="y", color="membership", color_continuous_scale='spectral', hover_name="node")
-    new_fig.update_traces(showlegend=False)
-    new_fig.update_layout(
-        # set x
-        xaxis=dict(
-            # set to bottom
-            side="bottom",
-            showticklabels=False,
-        ),
-        # set y
-        yaxis=dict(
-       
-            showticklabels=False,
-        ),  
-        # remove all titles for x and y axes
-        xaxis_title=None,
-        yaxis_title=None,
-
-        title=f"Graph of n={n_value} with {num_communities} communities generated by Leiden algorithm",
-        title_x=0.5,  # Center the title
-    )
-    # save the figure as png
-   
-
-    pio.write_image(new_fig, f"communities_{n_value}.pdf")
-
-    return new_fig
+# shows a fetched text if the pointer is still on that shape
+app.clientside_callback(
+    """
+    function(texts, hoverData) {
+        if (!hoverData || !texts || !hoverData.points[0].customdata) {
+            return window.dash_clientside.no_update;
+        }
+        const shapeId = hoverData.points[0].customdata[0];
+        return shapeId in texts ? texts[shapeId] : window.dash_clientside.no_update;
+    }
+    """,
+    Output('hover-data', 'children', allow_duplicate=True),
+    Input('hover-texts', 'data'),
+    State('graph', 'hoverData'),
+    prevent_initial_call=True,
+)
 
 if __name__ == '__main__':
     app.run_server(debug=False)
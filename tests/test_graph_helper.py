@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from library.graph_helper import add_edges, add_nodes, build_comapping_graph, comapping_delta
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def named_graph(graph):
+    """Node set and {(shape_a, shape_b): weight} edges, so graphs with a different node order compare equal"""
+    nodes, source, target, weight = graph
+    edges = {tuple(sorted((nodes[a], nodes[b]))): int(w) for a, b, w in zip(source, target, weight)}
+    return set(nodes), edges
+
+
+@pytest.mark.parametrize("n, new_fraction", [(9, 0.2), (11, 0.05), (11, 0.5)])
+def test_incremental_update_matches_full_build(n, new_fraction):
+    sequences_df = pd.read_json(os.path.join(DATA_DIR, f"sequences_df_{n}.json"), orient="split")
+    shapes_df = pd.read_json(os.path.join(DATA_DIR, f"shapes_df_{n}.json"), orient="split")
+    sequences_df = sequences_df.astype({"sequence": str, "shape_mapping": str})
+    shapes_df = shapes_df.astype({"shape_id": str})
+
+    is_new = np.random.default_rng(n).random(len(sequences_df)) < new_fraction
+    old_rows, new_rows = sequences_df[~is_new], sequences_df[is_new]
+    old_shapes = shapes_df[shapes_df["shape_id"].isin(old_rows["shape_mapping"])]
+    touched = shapes_df[shapes_df["shape_id"].isin(new_rows["shape_mapping"])]
+
+    # the same steps as graph_logic.update_network_graph
+    graph = build_comapping_graph(old_rows, old_shapes)
+    graph = add_nodes(graph, touched["shape_id"])
+    graph = add_edges(graph, *comapping_delta(old_rows, new_rows))
+
+    merged_shapes = pd.concat([old_shapes[~old_shapes["shape_id"].isin(touched["shape_id"])], touched], ignore_index=True)
+    merged_rows = pd.concat([old_rows, new_rows], ignore_index=True)
+    expected = build_comapping_graph(merged_rows, merged_shapes)
+
+    assert named_graph(graph) == named_graph(expected)
+    assert len(graph[0]) == len(expected[0])
@@ -0,0 +1,30 @@
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from library.heuristic_fold import heuristic_fold
+from library.native_fold import branch_and_bound_fold
+
+SEQUENCES = ["".join(random.Random(seed).choice("HP") for _ in range(10)) for seed in range(5)]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        yield pool
+
+
+@pytest.mark.parametrize("sequence", SEQUENCES)
+def test_ground_state_matches_exact_search(sequence, pool):
+    folds, _, energy, _ = branch_and_bound_fold(sequence, bounded=False)
+    result = heuristic_fold(sequence, chains=2, sweeps=200, seed=0, pool=pool)
+    assert result["energy"] == energy
+    assert set(map(tuple, result["folds"])) <= {tuple(path) for _, path in folds}
+
+
+def test_same_seed_same_result(pool):
+    runs = [heuristic_fold(SEQUENCES[0], chains=2, sweeps=50, seed=3, pool=pool) for _ in range(2)]
+    for run in runs:
+        del run["time_to_best"]
+    assert runs[0] == runs[1]
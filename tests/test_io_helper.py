@@ -0,0 +1,23 @@
+import json
+
+import pytest
+
+from library.io_helper import iter_json_array
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+def test_iter_json_array_across_chunks(tmp_path, chunk_size):
+    records = [{"shape_id": f"{k}x", "path": [[0, 0], [0, 1]], "text": "a, b ] c"} for k in range(50)]
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps(records, indent=1))
+    assert list(iter_json_array(path, chunk_size)) == records
+
+
+def test_iter_json_array_empty_and_invalid(tmp_path):
+    empty = tmp_path / "empty.json"
+    empty.write_text(" [ ] ")
+    assert list(iter_json_array(empty)) == []
+    invalid = tmp_path / "invalid.json"
+    invalid.write_text('{"a": 1}')
+    with pytest.raises(ValueError):
+        list(iter_json_array(invalid))
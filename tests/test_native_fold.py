@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from library.native_fold import branch_and_bound_fold, batch_native_fold, fold_n, fold_n_recursive, paths_to_array
+from library.permutations_helper import perm_gen
+
+
+def all_walks(n):
+    """Every self-avoiding walk of length n from (0, 0) with a first step of (0, 1), outside the fold_n region too"""
+    walks = []
+
+    def grow(path, visited):
+        if len(path) == n:
+            walks.append(list(path))
+            return
+        x, y = path[-1]
+        for new in ((x, y + 1), (x + 1, y), (x, y - 1), (x - 1, y)):
+            if new not in visited:
+                visited.add(new)
+                path.append(new)
+                grow(path, visited)
+                path.pop()
+                visited.remove(new)
+
+    grow([(0, 0), (0, 1)], {(0, 0), (0, 1)})
+    return walks
+
+
+def sample_sequences(n, k=40, seed=0):
+    sequences = perm_gen(n)
+    return random.Random(seed).sample(sequences, min(k, len(sequences)))
+
+
+def check_against_brute_force(paths, sequences, bounded):
+    energies, degeneracies, native_indices = batch_native_fold(paths_to_array(paths), sequences)
+    for sequence, energy, degeneracy, indices in zip(sequences, energies, degeneracies, native_indices):
+        folds, bb_degeneracy, bb_energy, _ = branch_and_bound_fold(sequence, bounded=bounded)
+        assert (bb_energy, bb_degeneracy) == (energy, degeneracy), sequence
+        assert [path for _, path in folds] == sorted(paths[k] for k in indices), sequence
+
+
+@pytest.mark.parametrize("n", range(4, 12))
+def test_bounded_branch_and_bound_matches_brute_force(n):
+    check_against_brute_force(fold_n(n), sample_sequences(n), bounded=True)
+
+
+@pytest.mark.parametrize("n", range(4, 11))
+def test_unbounded_branch_and_bound_matches_brute_force(n):
+    check_against_brute_force(all_walks(n), sample_sequences(n), bounded=False)
+
+
+@pytest.mark.parametrize("n", range(2, 13))
+def test_fold_n_matches_recursive_enumerator(n):
+    assert sorted(fold_n(n)) == sorted(fold_n_recursive(n))
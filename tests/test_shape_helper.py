@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from library.shape_helper import (GRID_SIZE, Shape, decode_paths, deserialize_path, deserialize_shape, deserialize_shapes,
+                                  encode_path, encode_paths, serialize_path, serialize_shape, shape_matrix, shape_size)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def random_shapes(count=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.random((GRID_SIZE, GRID_SIZE)) < density).astype(int) for density in rng.random(count)]
+
+
+@pytest.mark.parametrize("matrix", random_shapes())
+def test_random_shape_round_trip(matrix):
+    shape_id = serialize_shape(matrix)
+    assert np.array_equal(deserialize_shape(shape_id), matrix)
+    assert shape_size(shape_id) == matrix.sum()
+
+
+@pytest.mark.parametrize("value", [0, 1])
+def test_uniform_grid_round_trip(value):
+    # an empty grid and a full grid are a single run of all 625 cells
+    matrix = np.full((GRID_SIZE, GRID_SIZE), value)
+    shape_id = serialize_shape(matrix)
+    assert len(shape_id) == 2
+    assert np.array_equal(deserialize_shape(shape_id), matrix)
+    assert shape_size(shape_id) == value * GRID_SIZE * GRID_SIZE
+
+
+@pytest.mark.parametrize("n", range(8, 14))
+def test_stored_shape_ids_round_trip(n):
+    shape_ids = pd.read_json(f"{DATA_DIR}/shapes_df_{n}.json", orient="split", convert_dates=False)["shape_id"].tolist()
+    assert [serialize_shape(matrix) for matrix in deserialize_shapes(shape_ids)] == shape_ids
+    assert all(shape_size(shape_id) == n for shape_id in shape_ids)
+
+
+def test_shape_matrix_is_cached_and_read_only():
+    shape_id = serialize_shape(random_shapes(1, seed=1)[0])
+    matrix = shape_matrix(shape_id)
+    assert shape_matrix(shape_id) is matrix
+    assert not matrix.flags.writeable
+    with pytest.raises(ValueError):
+        matrix[0, 0] = 1
+    assert np.array_equal(matrix, deserialize_shape(shape_id))
+
+
+@pytest.mark.parametrize("shape_id", ["", "1", "x1", "z1", "01" * 625, "p1p1", "I1" * 27, "p1" * 4 + "p2",
+                                      (chr(0x10FFFF) + "1") * 170, "p1" + chr(0x10FFFF) + "0"])
+def test_malformed_shape_ids_are_rejected(shape_id):
+    # out of alphabet characters or runs that do not add up to the 625 cells, never decoded into a huge array
+    with pytest.raises(ValueError):
+        deserialize_shape(shape_id)
+    with pytest.raises(ValueError):
+        shape_size(shape_id)
+
+
+@pytest.mark.parametrize("n", range(8, 14))
+def test_stored_shape_ids_round_trip_through_shape(n):
+    shape_ids = pd.read_json(f"{DATA_DIR}/shapes_df_{n}.json", orient="split", convert_dates=False)["shape_id"].tolist()
+    assert [Shape.from_shape_id(shape_id).shape_id() for shape_id in shape_ids] == shape_ids
+
+
+@pytest.mark.parametrize("path", [[], [(0, 0)], [(0, 0), (0, 1)], [(0, 0), (0, 1), (1, 1), (1, 0), (2, 0)]])
+def test_path_round_trip(path):
+    assert deserialize_path(encode_path(path)) == path
+    assert deserialize_path(serialize_path(path)) == path
+
+
+def test_empty_path_batches():
+    assert encode_paths(np.zeros((3, 0, 2), dtype=np.int8)) == ["", "", ""]
+    assert decode_paths(["", ""]).shape == (2, 0, 2)
+    assert decode_paths([]).shape == (0, 0, 2)
@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+import pytest
+
+from library.shape_helper import GRID_SIZE, serialize_shape
+from library import thumbnail_helper
+from library.thumbnail_helper import get_thumbnail, thumbnail_key
+
+
+@pytest.mark.parametrize("shape_id", ["p1" * 4, (chr(0x10FFFF) + "1") * 170, "not a shape"])
+def test_malformed_shape_id_is_not_rendered(tmp_path, shape_id):
+    # the thumbnail route answers 404 on this ValueError, nothing may be rendered or stored
+    with pytest.raises(ValueError):
+        get_thumbnail(shape_id, str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_thumbnail_is_stored_on_disk(tmp_path):
+    matrix = np.zeros((GRID_SIZE, GRID_SIZE), dtype=int)
+    matrix[12, 10:15] = 1
+    shape_id = serialize_shape(matrix)
+    png, key = get_thumbnail(shape_id, str(tmp_path))
+    assert key == thumbnail_key(shape_id)
+    assert png.startswith(b"\x89PNG")
+    assert os.path.exists(os.path.join(tmp_path, key[:2], f"{key}.png"))
+
+
+def test_on_demand_renders_keep_the_store_under_the_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnail_helper, "DISK_LIMIT", 20_000)
+    monkeypatch.setattr(thumbnail_helper, "EVICT_EVERY", 2_000)
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        get_thumbnail(serialize_shape((rng.random((GRID_SIZE, GRID_SIZE)) < 0.5).astype(int)), str(tmp_path))
+    # wait for the last background eviction
+    with thumbnail_helper._evicting:
+        pass
+    sizes = [os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tmp_path) for name in names]
+    # at most EVICT_EVERY bytes (and the file that crossed it) were written since the last eviction
+    assert len(sizes) < 200
+    assert sum(sizes) <= thumbnail_helper.DISK_LIMIT + thumbnail_helper.EVICT_EVERY + max(sizes)